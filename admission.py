@@ -0,0 +1,109 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from aiogram import BaseMiddleware
+
+import payments
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_TEXT = "Сейчас очень много игроков, попробуйте еще раз через пару секунд"
+
+HIGH = 0
+LOW = 1
+
+
+class AdmissionController(BaseMiddleware):
+    # Ограничение нагрузки перед хендлерами (outer middleware на dp.update).
+    # Одновременно обрабатывается не больше max_concurrent апдейтов, остальные ждут в очереди до max_pending штук.
+    # Кто прождал дольше max_wait секунд - получает ответ "попробуйте еще раз" и не обрабатывается.
+    # Апдейты игроков внутри квеста (is_priority) обслуживаются раньше маркета и профиля,
+    # а при переполненной очереди вытесняют из нее апдейты с низким приоритетом.
+    # Апдейты платежей проходят без очереди: они редкие, а опоздание с ответом на оплату стоит денег.
+    # Inline-запросы тоже: они отвечаются из памяти и базу не нагружают
+    def __init__(self, max_concurrent=100, max_pending=1000, max_wait=2.0, is_priority=None):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self.is_priority = is_priority
+        self.active = 0
+        self.pending = 0
+        self.waiters = []  # куча [приоритет, порядковый номер, future]
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+
+    async def __call__(self, handler, event, data):
+        if payments.is_payment_update(event) or event.inline_query is not None:
+            return await handler(event, data)
+        priority = HIGH if self.is_priority is not None and await self.is_priority(event, data) else LOW
+        if not await self._acquire(priority):
+            self.shed += 1
+            await self._reject(event)
+            return None
+        self.admitted += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int) -> bool:
+        if self.active < self.max_concurrent and self.pending == 0:
+            self.active += 1
+            return True
+        if self.pending >= self.max_pending and (priority == LOW or not self._evict_low()):
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, [priority, next(self._seq), future])
+        self.pending += 1
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # Апдейт отменен в очереди: слот, который ему уже передали, возвращается, иначе - уходим из очереди
+            if not future.done():
+                future.cancel()
+                self.pending -= 1
+            elif future.result():
+                self._release()
+            raise
+        if future.done():
+            # Слот передан в _release (True) или апдейт вытеснен более важным (False)
+            return future.result()
+        future.cancel()
+        self.pending -= 1
+        return False
+
+    def _release(self):
+        self.active -= 1
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.pending -= 1
+            self.active += 1
+            future.set_result(True)
+            break
+
+    # Вытеснить из очереди самый новый апдейт с низким приоритетом
+    def _evict_low(self) -> bool:
+        victim = None
+        for entry in self.waiters:
+            if entry[0] == LOW and not entry[2].done() and (victim is None or entry[1] > victim[1]):
+                victim = entry
+        if victim is None:
+            return False
+        victim[2].set_result(False)
+        self.pending -= 1
+        return True
+
+    async def _reject(self, update):
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(OVERLOAD_TEXT)
+            elif update.message is not None:
+                await update.message.answer(OVERLOAD_TEXT)
+        except Exception as e:
+            logger.error("Ошибка при отказе в обработке апдейта: %s", e)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Типы событий
+SCENE_ENTERED = "scene_entered"
+CHOICE_MADE = "choice_made"
+RIDDLE_ATTEMPT = "riddle_attempt"
+ENDING_REACHED = "ending_reached"
+
+EVENT_COLUMNS = ['created_at', 'event_type', 'tg_user_id', 'quest_id', 'scene', 'detail', 'value']
+
+
+class EventLog:
+    # События копятся в памяти и пачками записываются в quest_events через COPY.
+    # Запись срабатывает по размеру пачки (batch_size) или по таймеру (flush_interval).
+    # Если буфер переполнен (база не успевает), новые события отбрасываются, а не блокируют хендлеры.
+    def __init__(self, database, batch_size=500, flush_interval=5.0, max_buffer=10000):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.dropped = 0
+        self.written = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    # ----------API событий-------------
+    def scene_entered(self, tg_user_id: int, quest_id, scene: str):
+        self.log(SCENE_ENTERED, tg_user_id, quest_id, scene)
+
+    def choice_made(self, tg_user_id: int, quest_id, scene: str, choice: str):
+        self.log(CHOICE_MADE, tg_user_id, quest_id, scene, detail=choice)
+
+    # elapsed_ms - сколько времени прошло с момента, когда загадка была задана
+    def riddle_attempt(self, tg_user_id: int, quest_id, riddle: str, correct: bool, elapsed_ms: int = None):
+        self.log(RIDDLE_ATTEMPT, tg_user_id, quest_id, riddle,
+                 detail="correct" if correct else "wrong", value=elapsed_ms)
+
+    def ending_reached(self, tg_user_id: int, quest_id, ending: str):
+        self.log(ENDING_REACHED, tg_user_id, quest_id, ending)
+
+    # Добавление события в буфер. Никаких обращений к базе - только append в список
+    def log(self, event_type: str, tg_user_id: int, quest_id=None, scene=None, detail=None, value=None):
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer.append((datetime.now(timezone.utc), event_type, tg_user_id, quest_id, scene, detail, value))
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # ----------фоновая запись-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        # Забираем текущий буфер целиком, новые события пишутся уже в новый список
+        records, self.buffer = self.buffer, []
+        try:
+            await self.database.copy_records('quest_events', records, EVENT_COLUMNS)
+            self.written += len(records)
+        except Exception as e:
+            self.dropped += len(records)
+            logger.error("Ошибка при записи событий аналитики (%s шт.): %s", len(records), e)
+
+
+class QuestEventsMiddleware(BaseMiddleware):
+    # Пишет в EventLog нажатие кнопки (choice_made) и сцену, которую отрисовал хендлер (scene_entered).
+    # quest_callbacks: callback_data -> id квеста, к которому относится кнопка.
+    # Срабатывания таймеров (timers.TimerService, в data передается timer) - не действия игрока и не пишутся
+    def __init__(self, events: EventLog, quest_callbacks: dict):
+        self.events = events
+        self.quest_callbacks = quest_callbacks
+
+    async def __call__(self, handler, event, data):
+        if data.get("timer") is not None:
+            return await handler(event, data)
+        quest_id = self.quest_callbacks.get(event.data)
+        handler_object = data.get("handler")
+        scene = handler_object.callback.__name__ if handler_object is not None else event.data
+        self.events.choice_made(event.from_user.id, quest_id, scene, event.data)
+        result = await handler(event, data)
+        self.events.scene_entered(event.from_user.id, quest_id, scene)
+        return result
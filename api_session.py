@@ -0,0 +1,85 @@
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import SendPhoto
+from aiogram.types import FSInputFile
+
+import screens
+
+logger = logging.getLogger(__name__)
+
+# Таймауты запросов по методам Bot API (секунды); остальные методы - timeout сессии.
+# getUpdates сюда не входит: aiogram передает для него свой таймаут (timeout сессии + polling_timeout)
+DEFAULT_METHOD_TIMEOUTS = {
+    "sendPhoto": 120,
+    "sendDocument": 120,
+    "answerCallbackQuery": 10,
+    "answerInlineQuery": 10,
+    "answerPreCheckoutQuery": 10,
+}
+
+
+class _Latency:
+    __slots__ = ('calls', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class TunedSession(screens.ScreenSession):
+    # Сессия Bot API с настройками соединений: размер пула (limit - всего, limit_per_host - на один хост),
+    # keep-alive простаивающих соединений, кеш DNS и таймауты по методам.
+    # api_url - свой сервер Bot API (telegram-bot-api --local) вместо api.telegram.org: у него больше лимит
+    # на размер файлов и меньше задержка. С local_files фото из uploads/ отправляются локальным путем
+    # (file://...) без загрузки - сервер должен видеть те же файлы по тем же абсолютным путям.
+    # По каждому методу считаются вызовы, ошибки и время ответа (latency()).
+    # Остальные аргументы - как у AiohttpSession (например, json_loads/json_dumps из runtime.session_json)
+    def __init__(self, api_url: Optional[str] = None, local_files: bool = False, limit: int = 100,
+                 limit_per_host: int = 0, keepalive_timeout: float = 30.0, dns_cache_ttl: int = 300,
+                 timeout: float = 60.0, method_timeouts: Optional[Dict[str, float]] = None, media=None, **kwargs):
+        super().__init__(limit=limit, timeout=timeout, media=media, **kwargs)
+        if api_url:
+            self.api = TelegramAPIServer.from_base(api_url.rstrip("/"), is_local=local_files)
+        self.local_files = bool(api_url) and local_files
+        self._connector_init.update(
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=dns_cache_ttl > 0,
+            ttl_dns_cache=dns_cache_ttl or None,
+        )
+        self.method_timeouts = {**DEFAULT_METHOD_TIMEOUTS, **(method_timeouts or {})}
+        self.latencies = {}  # метод -> _Latency
+
+    async def make_request(self, bot, method, timeout=None):
+        api_method = method.__api_method__
+        if timeout is None:
+            timeout = self.method_timeouts.get(api_method)
+        if self.local_files and isinstance(method, SendPhoto) and isinstance(method.photo, FSInputFile):
+            method = method.model_copy(update={'photo': Path(method.photo.path).absolute().as_uri()})
+
+        latency = self.latencies.get(api_method)
+        if latency is None:
+            latency = self.latencies[api_method] = _Latency()
+        started = time.monotonic()
+        try:
+            return await super().make_request(bot, method, timeout)
+        except Exception:
+            latency.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            latency.calls += 1
+            latency.total += elapsed
+            latency.max = max(latency.max, elapsed)
+
+    # {метод: (вызовов, ошибок, среднее время, максимальное время)}, самые медленные в среднем - первыми
+    def latency(self):
+        stats = {name: (value.calls, value.errors, value.total / value.calls, value.max)
+                 for name, value in self.latencies.items() if value.calls}
+        return dict(sorted(stats.items(), key=lambda item: item[1][2], reverse=True))
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastProgress:
+    def __init__(self, broadcast_id: int, total: int, sent=0, failed=0, blocked=0):
+        self.broadcast_id = broadcast_id
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.started_at = time.monotonic()
+        self.done = False
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def __str__(self):
+        status = "завершена" if self.done else "идет"
+        return (f"Рассылка #{self.broadcast_id} {status}: {self.processed}/{self.total}\n"
+                f"Доставлено: {self.sent}, ошибок: {self.failed}, заблокировали бота: {self.blocked}")
+
+
+class Broadcaster:
+    # Рассылка сообщения всем пользователям.
+    # Пользователи читаются страницами по tg_user_id (без загрузки всей таблицы),
+    # отправка идет не быстрее rate сообщений в секунду, чтобы у обычных ответов бота оставался запас
+    # до лимита Telegram (~30 сообщений в секунду). После каждой страницы курсор и результаты сохраняются,
+    # при остановке посреди страницы сохраняется уже отправленная часть
+    def __init__(self, bot, database, rate: float = 15, page_size: int = 50):
+        self.bot = bot
+        self.database = database
+        self.rate = rate
+        self.page_size = page_size
+        self.progress = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, text: str) -> BroadcastProgress:
+        if self.running:
+            raise RuntimeError("Рассылка уже идет")
+        broadcast_id = await self.database.create_broadcast(text, self.bot.id)
+        total = await self.database.count_broadcast_audience()
+        self.progress = BroadcastProgress(broadcast_id, total)
+        self._task = asyncio.create_task(self._run(broadcast_id, text, 0))
+        return self.progress
+
+    # Продолжение незавершенных рассылок после перезапуска
+    async def resume(self):
+        if self.running:
+            return
+        broadcasts = await self.database.get_running_broadcasts(self.bot.id)
+        if broadcasts:
+            self._task = asyncio.create_task(self._resume(broadcasts))
+
+    # Рассылки продолжаются по очереди, начиная с самой старой
+    async def _resume(self, broadcasts):
+        for row in broadcasts:
+            try:
+                remaining = await self.database.count_broadcast_recipients(row['id'], row['cursor'])
+            except Exception as e:
+                logger.error("Ошибка при продолжении рассылки #%s: %s", row['id'], e)
+                continue
+            total = row['sent'] + row['failed'] + row['blocked'] + remaining
+            self.progress = BroadcastProgress(row['id'], total, row['sent'], row['failed'], row['blocked'])
+            logger.warning("Продолжение рассылки #%s с пользователя %s", row['id'], row['cursor'])
+            await self._run(row['id'], row['text'], row['cursor'])
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, broadcast_id: int, text: str, cursor: int):
+        interval = 1 / self.rate
+        outcomes = []  # (tg_user_id, status) текущей страницы, еще не сохраненные
+        try:
+            while True:
+                recipients = await self.database.get_broadcast_recipients(broadcast_id, cursor, self.page_size)
+                if not recipients:
+                    break
+                for tg_user_id in recipients:
+                    started = time.monotonic()
+                    status = await self._send(tg_user_id, text)
+                    outcomes.append((tg_user_id, status))
+                    setattr(self.progress, status, getattr(self.progress, status) + 1)
+                    await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+                cursor = recipients[-1]
+                await self.database.save_broadcast_page(broadcast_id, cursor, outcomes)
+                outcomes = []
+            await self.database.finish_broadcast(broadcast_id)
+            self.progress.done = True
+        except asyncio.CancelledError:
+            # Остановка посреди страницы: отправленное сохраняется, чтобы после перезапуска не отправить повторно
+            if outcomes:
+                try:
+                    await self.database.save_broadcast_page(broadcast_id, outcomes[-1][0], outcomes)
+                except Exception as e:
+                    logger.error("Ошибка при сохранении рассылки #%s: %s", broadcast_id, e)
+            raise
+        except Exception as e:
+            logger.error("Ошибка в рассылке #%s: %s", broadcast_id, e)
+
+    async def _send(self, tg_user_id: int, text: str) -> str:
+        for _ in range(3):
+            try:
+                await self.bot.send_message(tg_user_id, text=text)
+                return 'sent'
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                return 'blocked'
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e):
+                    return 'blocked'
+                return 'failed'
+            except Exception as e:
+                logger.error("Ошибка при рассылке пользователю %s: %s", tg_user_id, e)
+                return 'failed'
+        return 'failed'
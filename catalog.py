@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class QuestCatalog:
+    # Каталог квестов в памяти, общий для всех ботов процесса. Таблица quests маленькая и меняется редко,
+    # поэтому она целиком перечитывается одним запросом не чаще раза в ttl секунд, а маркет, "Мои квесты"
+    # и финал квеста читают строки отсюда. Одновременные обращения к устаревшему каталогу ждут один запрос.
+    # Квест, которого еще нет в каталоге (добавлен после загрузки), читается из базы по id.
+    # Счетчики likes/dislikes в строках могут отставать - актуальные значения в ratings.QuestRatings.
+    # listeners вызываются после каждой загрузки с новым каталогом (id -> строка), например search.QuestIndex
+    def __init__(self, database, ttl: float = 60.0):
+        self.database = database
+        self.ttl = ttl
+        self.quests = {}  # id -> строка quests
+        self.loaded_at = None
+        self.refreshes = 0
+        self._refresh = None
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    async def _ensure_fresh(self):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return
+        try:
+            await asyncio.shield(self._start_refresh())
+        except Exception as e:
+            # Каталог остается прежним (или пустым - тогда квесты читаются из базы по id)
+            logger.error("Ошибка при загрузке каталога квестов: %s", e)
+
+    def _start_refresh(self):
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._load())
+        return self._refresh
+
+    async def _load(self):
+        try:
+            rows = await self.database.get_all_quest()
+            self.quests = {row['id']: row for row in rows or ()}
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+        finally:
+            self._refresh = None
+        for listener in self.listeners:
+            try:
+                listener(self.quests)
+            except Exception as e:
+                logger.error("Ошибка в обработчике обновления каталога квестов: %s", e)
+
+    async def all(self) -> List:
+        await self._ensure_fresh()
+        return list(self.quests.values())
+
+    # Без ожидания базы (для ответов с жестким сроком): устаревший каталог перечитывается в фоне,
+    # а сейчас используется уже загруженный
+    def refresh_in_background(self):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return
+        self._start_refresh().add_done_callback(self._log_background_error)
+
+    @staticmethod
+    def _log_background_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Ошибка при загрузке каталога квестов: %s", future.exception())
+
+    async def get(self, quest_id: int):
+        await self._ensure_fresh()
+        quest_data = self.quests.get(quest_id)
+        if quest_data is None:
+            quest_data = await self.database.get_quest_data_by_id(quest_id)
+        return quest_data
+
+    async def get_many(self, quest_ids: List[int]) -> List:
+        await self._ensure_fresh()
+        missing = [quest_id for quest_id in quest_ids if quest_id not in self.quests]
+        loaded = {}
+        if missing:
+            loaded = {quest_data['id']: quest_data for quest_data in await self.database.get_quests_by_ids(missing)}
+        quests = (self.quests.get(quest_id) or loaded.get(quest_id) for quest_id in quest_ids)
+        return [quest_data for quest_data in quests if quest_data is not None]
+
+    # Сбросить каталог (например, после добавления квеста) - следующее обращение перечитает таблицу
+    def invalidate(self):
+        self.loaded_at = None
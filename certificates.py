@@ -0,0 +1,123 @@
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Надписи на сертификате: (доля ширины, доля высоты) центра строки и размер шрифта
+USERNAME_LAYOUT = (0.5, 0.45, 64)
+QUEST_NAME_LAYOUT = (0.5, 0.60, 40)
+COMPLETIONS_LAYOUT = (0.5, 0.72, 32)
+TEXT_COLOR = (40, 30, 20)
+
+# ---------------- процесс-воркер ----------------
+# Шаблон и шрифты загружаются один раз при старте воркера, а не на каждый сертификат
+_template = None
+_fonts = {}
+
+
+def _init_worker(template_path: str, font_path: str):
+    global _template
+    from PIL import Image, ImageFont
+
+    with Image.open(template_path) as image:
+        _template = image.convert("RGB")
+    for _, _, size in (USERNAME_LAYOUT, QUEST_NAME_LAYOUT, COMPLETIONS_LAYOUT):
+        try:
+            _fonts[size] = ImageFont.truetype(font_path, size)
+        except OSError:
+            _fonts[size] = ImageFont.load_default()
+
+
+def _render(username: str, quest_name: str, completions: int) -> bytes:
+    from PIL import ImageDraw
+
+    image = _template.copy()
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+    for text, (x, y, size) in ((username, USERNAME_LAYOUT), (f"«{quest_name}»", QUEST_NAME_LAYOUT),
+                               (f"Пройден раз: {completions}", COMPLETIONS_LAYOUT)):
+        draw.text((width * x, height * y), text, font=_fonts[size], fill=TEXT_COLOR, anchor="mm")
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+# ---------------- сервис в процессе бота ----------------
+class CertificateRenderer:
+    # Сертификаты за прохождение квеста рисуются (Pillow) в пуле процессов, чтобы не останавливать
+    # event loop. Готовые PNG кешируются по содержимому (имя, квест, номер прохождения) - LRU на cache_size.
+    # Одновременно рисуется не больше max_pending сертификатов; если пул занят, рисование не уложилось
+    # в timeout секунд, нет Pillow или шаблона - render возвращает None, и вместо картинки отправляется текст
+    def __init__(self, template_path: str, font_path: str, workers: int = 2, max_pending: int = 8,
+                 timeout: float = 5.0, cache_size: int = 256):
+        self.template_path = template_path
+        self.font_path = font_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (username, quest_name, completions) -> PNG
+        self.pending = 0
+        self.rendered = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is not None or self.workers <= 0:
+            return
+        if importlib.util.find_spec("PIL") is None:
+            logger.warning("Pillow не установлен - сертификаты отправляются текстом")
+            return
+        if not os.path.exists(self.template_path):
+            logger.warning("Нет шаблона сертификата %s - сертификаты отправляются текстом", self.template_path)
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.template_path, self.font_path))
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, future):
+        self.pending -= 1
+
+    async def render(self, username: str, quest_name: str, completions: int) -> Optional[bytes]:
+        key = (username, quest_name, completions)
+        image = self.cache.get(key)
+        if image is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return image
+        if self._executor is None or self.pending >= self.max_pending:
+            self.fallbacks += 1
+            return None
+
+        # Слот занят, пока воркер не закончит, даже если ждать результат мы перестали по таймауту
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, _render, *key)
+        future.add_done_callback(self._release)
+        done, _ = await asyncio.wait({future}, timeout=self.timeout)
+        if not done:
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            logger.warning("Сертификат для %s не нарисован за %.1f с", username, self.timeout)
+            self.fallbacks += 1
+            return None
+        try:
+            image = future.result()
+        except Exception as e:
+            logger.error("Ошибка при рисовании сертификата: %s", e)
+            self.fallbacks += 1
+            return None
+        self.rendered += 1
+        self.cache[key] = image
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return image
@@ -1,22 +1,99 @@
 from typing import List
+import asyncio
+import contextvars
+import itertools
 import logging
+import time
 import asyncpg
 from asyncpg.pool import Pool
 
-# logging
-logging.basicConfig(
-    level=logging.WARNING,  # Уровень логирования
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
-    handlers=[
-        logging.FileHandler("app.log"),  # Запись логов в файл "app.log"
-        logging.StreamHandler()  # Вывод логов на консоль
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Telegram позволяет боту удалять сообщения не старше 48 часов (берем с запасом)
+MESSAGE_DELETE_WINDOW = 48 * 60 * 60 - 10 * 60
+# Сколько последних сообщений отслеживается в одном чате
+MAX_TRACKED_MESSAGES = 50
+
+# Чат, апдейт которого сейчас обрабатывается (выставляется middleware в main.py).
+# Нужен, чтобы чтения чата сразу после его записи шли в основную базу, а не в отстающую реплику
+current_chat = contextvars.ContextVar('current_chat', default=None)
+
+# Ошибки, после которых реплика считается недоступной
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+
+
+class Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool: Pool = None
+        self.healthy = False
+
+
+class BatchLoader:
+    # Загрузка строк по ключу пачками (как DataLoader). Ключи, запрошенные в одном такте event loop,
+    # загружаются одним запросом WHERE ... = ANY($1), а одинаковые ключи в очереди и в уже идущем запросе
+    # ждут один и тот же результат. load_many(keys, primary) возвращает строки, key_field - колонка с ключом.
+    # primary=True - кто-то из ждущих только что писал в базу, и пачку нужно читать из основной базы
+    def __init__(self, load_many, key_field: str, max_batch: int = 500):
+        self.load_many = load_many
+        self.key_field = key_field
+        self.max_batch = max_batch
+        self._queued = {}  # ключ -> future, еще не отправлено в базу
+        self._inflight = {}  # ключ -> future, запрос уже выполняется
+        self._primary = False
+        self._scheduled = False
+        self._tasks = set()
+        self.loads = 0
+        self.batches = 0
+
+    async def load(self, key, primary: bool = False):
+        self.loads += 1
+        future = self._queued.get(key)
+        if future is None and not primary:
+            future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._queued[key] = loop.create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._dispatch)
+        self._primary = self._primary or primary
+        # shield: отмена одного ждущего не должна отменять загрузку для остальных
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        batch, self._queued = self._queued, {}
+        primary, self._primary = self._primary, False
+        self._scheduled = False
+        self._inflight.update(batch)
+        keys = list(batch)
+        for start in range(0, len(keys), self.max_batch):
+            chunk = {key: batch[key] for key in keys[start:start + self.max_batch]}
+            task = asyncio.create_task(self._fetch(chunk, primary))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict, primary: bool):
+        self.batches += 1
+        try:
+            rows = await self.load_many(list(batch), primary)
+            found = {row[self.key_field]: row for row in rows}
+        except Exception as e:
+            found, error = None, e
+        for key, future in batch.items():
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if future.done():
+                continue
+            if found is None:
+                future.set_exception(error)
+            else:
+                future.set_result(found.get(key))
+
 
 class AsyncDatabase:
-    def __init__(self, db_name, user, password, host='localhost', port=5432, min_size=10, max_size=200):
+    def __init__(self, db_name, user, password, host='localhost', port=5432, min_size=10, max_size=200,
+                 replica_dsns=None, read_your_writes_window=5.0, health_check_interval=5.0):
         self.db_name = db_name
         self.user = user
         self.password = password
@@ -25,6 +102,16 @@ class AsyncDatabase:
         self.pool: Pool = None
         self.min_size = min_size
         self.max_size = max_size
+        # Реплики только для чтения (каталог, профиль, артефакты)
+        self.replicas = [Replica(dsn) for dsn in replica_dsns or []]
+        self.read_your_writes_window = read_your_writes_window
+        self.health_check_interval = health_check_interval
+        self._recent_writes = {}  # chat_id -> время (monotonic), до которого чтения чата идут в основную базу
+        self._replica_cycle = itertools.cycle(self.replicas)
+        self._health_task = None
+        # Пачечная загрузка строк по id (одинаковые запросы от разных игроков в одном такте - один запрос)
+        self.user_loader = BatchLoader(self._load_users, 'tg_user_id')
+        self.quest_loader = BatchLoader(self._load_quests, 'id')
 
     # ----------helping_methods-------------
     async def connect(self):
@@ -43,23 +130,112 @@ class AsyncDatabase:
             print(f"[DB] Error when connecting to the database: {e}")
             logger.error("Ошибка при подключении к базе данных:", e)
 
+        for replica in self.replicas:
+            await self._connect_replica(replica)
+        if self.replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_replicas())
+
     async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self.replicas:
+            if replica.pool:
+                await replica.pool.close()
+                replica.pool = None
         if self.pool:
             await self.pool.close()
             print("[DB] The connection to the database is closed.")
 
+    # ----------replicas-------------
+    async def _connect_replica(self, replica: Replica):
+        try:
+            replica.pool = await asyncpg.create_pool(dsn=replica.dsn, min_size=1, max_size=self.max_size)
+            replica.healthy = True
+        except Exception as e:
+            replica.healthy = False
+            logger.error("Ошибка при подключении к реплике %s: %s", replica.dsn, e)
+
+    # Периодическая проверка реплик: недоступные выключаются из чтения, восстановившиеся - возвращаются
+    async def _check_replicas(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for replica in self.replicas:
+                if replica.pool is None:
+                    await self._connect_replica(replica)
+                    continue
+                try:
+                    await asyncio.wait_for(replica.pool.fetchval("SELECT 1"), timeout=self.health_check_interval)
+                    if not replica.healthy:
+                        logger.warning("Реплика %s снова доступна", replica.dsn)
+                    replica.healthy = True
+                except Exception as e:
+                    if replica.healthy:
+                        logger.error("Реплика %s недоступна: %s", replica.dsn, e)
+                    replica.healthy = False
+            now = time.monotonic()
+            self._recent_writes = {chat: until for chat, until in self._recent_writes.items() if until > now}
+
+    def _mark_write(self):
+        chat_id = current_chat.get()
+        if chat_id is not None and self.replicas:
+            self._recent_writes[chat_id] = time.monotonic() + self.read_your_writes_window
+
+    # Чат текущего апдейта недавно писал в базу - его чтения должны идти в основную базу
+    def _reads_primary(self) -> bool:
+        chat_id = current_chat.get()
+        return chat_id is not None and self._recent_writes.get(chat_id, 0) > time.monotonic()
+
+    # Реплика для чтения или None, если читать нужно из основной базы
+    def _pick_replica(self):
+        if self._reads_primary():
+            return None
+        for _ in range(len(self.replicas)):
+            replica = next(self._replica_cycle)
+            if replica.healthy:
+                return replica
+        return None
+
+    # Чтение с реплики; при ошибке соединения реплика помечается недоступной и запрос повторяется в основной базе
+    async def _read(self, method: str, query: str, *args, primary: bool = False, **kwargs):
+        replica = None if primary else self._pick_replica()
+        if replica is not None:
+            try:
+                async with replica.pool.acquire() as connection:
+                    return await getattr(connection, method)(query, *args, **kwargs)
+            except REPLICA_ERRORS as e:
+                replica.healthy = False
+                logger.error("Ошибка чтения с реплики %s, запрос выполнен в основной базе: %s", replica.dsn, e)
+        async with self.pool.acquire() as connection:
+            return await getattr(connection, method)(query, *args, **kwargs)
+
+    # То же, что fetch / fetchrow / fetchval, но для запросов только на чтение (могут выполняться на реплике)
+    async def fetch_read(self, query: str, *args, primary: bool = False):
+        return await self._read('fetch', query, *args, primary=primary)
+
+    async def fetchrow_read(self, query: str, *args, primary: bool = False):
+        return await self._read('fetchrow', query, *args, primary=primary)
+
+    async def fetchval_read(self, query: str, *args, column: int = 0, primary: bool = False):
+        return await self._read('fetchval', query, *args, primary=primary, column=column)
+
     # Этот метод выполняет SQL-запрос на изменение данных (например, INSERT, UPDATE, DELETE).
     # Метод принимает SQL-запрос как строку и параметры для подстановки в запрос.
     # Он использует пул соединений для выполнения запроса и открывает транзакцию для обеспечения атомарности операций.
     async def execute(self, query: str, *args):
+        self._mark_write()
         async with self.pool.acquire() as connection:
             async with connection.transaction():
-                await connection.execute(query, *args)
+                return await connection.execute(query, *args)
 
     # Этот метод выполняет SQL-запрос, который возвращает несколько строк данных.
     # Он принимает SQL-запрос и параметры для подстановки.
     # Метод возвращает результат в виде списка строк (каждая строка представляет собой запись в таблице).
-    async def fetch(self, query: str, *args):
+    # write=True - запрос меняет данные (INSERT/UPDATE/DELETE ... RETURNING): после него чтения чата
+    # какое-то время идут в основную базу. SELECT без изменений - через fetch_read
+    async def fetch(self, query: str, *args, write: bool = False):
+        if write:
+            self._mark_write()
         async with self.pool.acquire() as connection:
             async with connection.transaction():
                 return await connection.fetch(query, *args)
@@ -67,7 +243,9 @@ class AsyncDatabase:
     # Этот метод выполняет SQL-запрос, который возвращает одну строку данных.
     # Подходит для запросов, которые должны вернуть только одну запись.
     # Метод возвращает одну строку из результата запроса.
-    async def fetchrow(self, query: str, *args):
+    async def fetchrow(self, query: str, *args, write: bool = False):
+        if write:
+            self._mark_write()
         async with self.pool.acquire() as connection:
             async with connection.transaction():
                 return await connection.fetchrow(query, *args)
@@ -76,29 +254,114 @@ class AsyncDatabase:
     # (например, результат агрегации или значения из одного столбца).
     # Метод принимает индекс столбца для возвращаемого значения.
     # По умолчанию индекс равен 0, что означает первый столбец.
-    async def fetchval(self, query: str, *args, column: int = 0):
+    async def fetchval(self, query: str, *args, column: int = 0, write: bool = False):
+        if write:
+            self._mark_write()
         async with self.pool.acquire() as connection:
             async with connection.transaction():
                 return await connection.fetchval(query, *args, column=column)
 
+    # Массовая вставка строк через COPY (один запрос на всю пачку вместо INSERT на каждую строку)
+    async def copy_records(self, table: str, records: List[tuple], columns: List[str]):
+        async with self.pool.acquire() as connection:
+            await connection.copy_records_to_table(table, records=records, columns=columns)
+
     # Есть ли пользователь с тг айди в таблице
     async def user_exists(self, tg_user_id: int) -> bool:
         query = "SELECT EXISTS(SELECT 1 FROM users WHERE tg_user_id = $1)"
         try:
-            result = await self.fetchval(query, tg_user_id)
+            result = await self.fetchval_read(query, tg_user_id)
             return result
         except Exception as e:
             #nt(f"[DB] Ошибка при проверке существования пользователя: {e}")
             return False
 
-    # Получение последнего сообщения
+    # Поток всех tg_user_id зарегистрированных пользователей по возрастанию (серверный курсор, без загрузки в память)
+    async def iter_user_ids(self, prefetch: int = 10000):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor('SELECT tg_user_id FROM users ORDER BY tg_user_id',
+                                                   prefetch=prefetch):
+                    yield row['tg_user_id']
+
+    # Уведомления о регистрации и удалении пользователей (для других инстансов бота)
+    async def create_users_notify_trigger(self, channel: str):
+        query = f'''
+            CREATE OR REPLACE FUNCTION notify_users_membership() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM pg_notify('{channel}', '+' || NEW.tg_user_id);
+                ELSE
+                    PERFORM pg_notify('{channel}', '-' || OLD.tg_user_id);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS users_membership_notify ON users;
+            CREATE TRIGGER users_membership_notify
+                AFTER INSERT OR DELETE ON users
+                FOR EACH ROW EXECUTE FUNCTION notify_users_membership();
+        '''
+        await self.execute(query)
+
+    # Отдельное соединение (вне пула) для LISTEN. callback(connection, pid, channel, payload)
+    async def listen(self, channel: str, callback):
+        connection = await asyncpg.connect(
+            database=self.db_name,
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port
+        )
+        await connection.add_listener(channel, callback)
+        return connection
+
+    # Колонка со временем отправки отслеживаемых сообщений (unix-время, параллельно last_message_ids)
+    async def create_message_tracking_columns(self):
+        query = '''
+            ALTER TABLE user_telegram ADD COLUMN IF NOT EXISTS last_message_sent_at BIGINT[];
+        '''
+        await self.execute(query)
+
+    # Сообщения, которые остаются в чате при переходах между экранами (сертификаты).
+    # Их id хранятся отдельно от last_message_ids, чтобы удалить их вместе с аккаунтом
+    async def create_kept_messages_table(self):
+        query = '''
+            CREATE TABLE IF NOT EXISTS kept_messages (
+                tg_user_id BIGINT NOT NULL,
+                message_id BIGINT NOT NULL,
+                sent_at BIGINT NOT NULL,
+                PRIMARY KEY (tg_user_id, message_id)
+            );
+        '''
+        await self.execute(query)
+
+    # Запоминает сообщение и заодно убирает записи, которые Telegram уже не позволяет удалить
+    async def keep_message(self, tg_user_id: int, message_id: int):
+        now = int(time.time())
+        query = '''
+            WITH expired AS (
+                DELETE FROM kept_messages WHERE tg_user_id = $1 AND sent_at < $4
+            )
+            INSERT INTO kept_messages (tg_user_id, message_id, sent_at) VALUES ($1, $2, $3)
+            ON CONFLICT (tg_user_id, message_id) DO NOTHING;
+        '''
+        await self.execute(query, tg_user_id, message_id, now, now - MESSAGE_DELETE_WINDOW)
+
+    # Получение последних сообщений, которые Telegram еще позволяет удалить
     async def get_last_messages_by_user_id(self, tg_user_id: int) -> List[int]:
         try:
             query = """
-                    SELECT last_message_ids FROM user_telegram
+                    SELECT ARRAY(
+                        SELECT id
+                        FROM unnest(last_message_ids, last_message_sent_at) AS m(id, sent_at)
+                        WHERE id IS NOT NULL AND coalesce(sent_at, $2) >= $2
+                    )
+                    FROM user_telegram
                     WHERE tg_user_id = $1;
                     """
-            last_message = await self.fetchval(query, tg_user_id)
+            last_message = await self.fetchval_read(query, tg_user_id, int(time.time()) - MESSAGE_DELETE_WINDOW)
 
             if last_message is not None:
                 #print(f"[DB] Последнее сообщение для пользователя {tg_user_id}: {last_message}")
@@ -120,33 +383,44 @@ class AsyncDatabase:
             if not isinstance(last_message, list):
                 last_message = [last_message]
 
-            exists_query = """
-                SELECT EXISTS(
-                    SELECT 1 FROM user_telegram WHERE tg_user_id = $1
-                );
+            now = int(time.time())
+            sent_at = [now] * len(last_message)
+
+            # Добавляем новые id и сразу уплотняем массив: убираем повторы и сообщения старше окна удаления,
+            # оставляем не больше MAX_TRACKED_MESSAGES самых новых.
+            # Старые записи без времени отправки считаем отправленными сейчас - они будут удалены при следующей очистке
+            update_query = """
+                UPDATE user_telegram
+                SET (last_message_ids, last_message_sent_at) = (
+                    SELECT coalesce(array_agg(id ORDER BY sent_at, id), ARRAY[]::bigint[]),
+                           coalesce(array_agg(sent_at ORDER BY sent_at, id), ARRAY[]::bigint[])
+                    FROM (
+                        SELECT id, sent_at FROM (
+                            SELECT DISTINCT ON (id) id, coalesce(sent_at, $4) AS sent_at
+                            FROM unnest(
+                                coalesce(last_message_ids, ARRAY[]::bigint[]) || $2::bigint[],
+                                coalesce(last_message_sent_at, ARRAY[]::bigint[]) || $3::bigint[]
+                            ) AS m(id, sent_at)
+                            WHERE id IS NOT NULL
+                            ORDER BY id, sent_at DESC
+                        ) AS deduplicated
+                        WHERE sent_at >= $5
+                        ORDER BY sent_at DESC, id DESC
+                        LIMIT $6
+                    ) AS kept
+                )
+                WHERE tg_user_id = $1;
             """
-            exists = await self.fetchval(exists_query, tg_user_id)
-
-            if exists:
-                # Обновляем массив, добавляя новые значения
-                update_query = """
-                    UPDATE user_telegram
-                    SET last_message_ids = ARRAY(
-                        SELECT unnest(last_message_ids) 
-                        UNION 
-                        SELECT unnest($2::bigint[])
-                    )
-                    WHERE tg_user_id = $1;
-                """
-                await self.execute(update_query, tg_user_id, last_message)
-                #print(f"[DB] Последнее сообщение для пользователя {tg_user_id} обновлено")
-            else:
+            result = await self.execute(update_query, tg_user_id, last_message, sent_at, now,
+                                        now - MESSAGE_DELETE_WINDOW, MAX_TRACKED_MESSAGES)
+
+            if result == "UPDATE 0":
                 # Вставляем новые значения в массив
                 insert_query = """
-                    INSERT INTO user_telegram (tg_user_id, last_message_ids)
-                    VALUES ($1, $2);
+                    INSERT INTO user_telegram (tg_user_id, last_message_ids, last_message_sent_at)
+                    VALUES ($1, $2, $3);
                 """
-                await self.execute(insert_query, tg_user_id, last_message)
+                await self.execute(insert_query, tg_user_id, last_message, sent_at)
                 #print(f"[DB] Добавлена новая запись для пользователя {tg_user_id} с последним сообщением")
 
         except Exception as e:
@@ -155,30 +429,158 @@ class AsyncDatabase:
 
     async def clear_last_message_ids_by_user_id(self, tg_user_id):
         try:
-            exists_query = """
-                SELECT EXISTS(
-                    SELECT 1 FROM user_telegram WHERE tg_user_id = $1
-                );
+            # Очищаем массив
+            update_query = """
+                UPDATE user_telegram
+                SET last_message_ids = ARRAY[]::bigint[], last_message_sent_at = ARRAY[]::bigint[]
+                WHERE tg_user_id = $1;
             """
-            exists = await self.fetchval(exists_query, tg_user_id)
-
-            if exists:
-                # Очищаем массив
-                update_query = """
-                    UPDATE user_telegram
-                    SET last_message_ids = ARRAY[]::bigint[]
-                    WHERE tg_user_id = $1;
-                """
-                await self.execute(update_query, tg_user_id)
-                #print(f"[DB] Поле last_message_ids для пользователя {tg_user_id} очищено")
-            else:
-                logger.error(f"[DB] Пользователь {tg_user_id} не найден, очистка не требуется")
-                #print(f"[DB] Пользователь {tg_user_id} не найден, очистка не требуется")
+            await self.execute(update_query, tg_user_id)
+            #print(f"[DB] Поле last_message_ids для пользователя {tg_user_id} очищено")
 
         except Exception as e:
             logger.error(f"Ошибка при очистке поля last_message_ids для пользователя {tg_user_id}: {e}")
             #print(f"Ошибка при очистке поля last_message_ids для пользователя {tg_user_id}: {e}")
 
+    # ---------------analytics----------------
+    async def create_quest_events_table(self):
+        query = '''
+            CREATE TABLE IF NOT EXISTS quest_events (
+                created_at TIMESTAMPTZ NOT NULL,
+                event_type TEXT NOT NULL,
+                tg_user_id BIGINT NOT NULL,
+                quest_id INTEGER,
+                scene TEXT,
+                detail TEXT,
+                value INTEGER
+            );
+        '''
+        await self.execute(query)
+
+    # ---------------broadcast----------------
+    # Рассылки: курсор (последний обработанный tg_user_id) и результат по каждому пользователю
+    # сохраняются в базе, поэтому после падения рассылка продолжается с места остановки
+    async def create_broadcast_tables(self):
+        query = '''
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_bot BOOLEAN NOT NULL DEFAULT FALSE;
+
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                cursor BIGINT NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+
+            -- бот, который ведет рассылку (несколько ботов в одном процессе работают с одной базой)
+            ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS bot_id BIGINT;
+
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                broadcast_id INTEGER NOT NULL REFERENCES broadcasts (id) ON DELETE CASCADE,
+                tg_user_id BIGINT NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (broadcast_id, tg_user_id)
+            );
+        '''
+        await self.execute(query)
+
+    async def create_broadcast(self, text: str, bot_id: int) -> int:
+        query = '''
+            INSERT INTO broadcasts (text, bot_id) VALUES ($1, $2) RETURNING id;
+        '''
+        return await self.fetchval(query, text, bot_id, write=True)
+
+    # Незавершенные рассылки бота. Рассылки без бота (созданные до появления bot_id) забирает
+    # первый бот, который их запросит, - строка блокируется, и второй бот ее уже не получит
+    async def get_running_broadcasts(self, bot_id: int):
+        query = '''
+            UPDATE broadcasts SET bot_id = $1
+            WHERE status = 'running' AND (bot_id = $1 OR bot_id IS NULL)
+            RETURNING *;
+        '''
+        return sorted(await self.fetch(query, bot_id, write=True), key=lambda row: row['id'])
+
+    # Следующая страница получателей (keyset-пагинация по tg_user_id).
+    # Пользователи, которым уже отправляли эту рассылку, и заблокировавшие бота пропускаются
+    async def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+        query = '''
+            SELECT u.tg_user_id FROM users u
+            WHERE u.tg_user_id > $2
+              AND NOT u.blocked_bot
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries d
+                  WHERE d.broadcast_id = $1 AND d.tg_user_id = u.tg_user_id
+              )
+            ORDER BY u.tg_user_id
+            LIMIT $3;
+        '''
+        # из основной базы: только что сохраненная страница на реплике может еще не появиться
+        rows = await self.fetch_read(query, broadcast_id, after_user_id, limit, primary=True)
+        return [row['tg_user_id'] for row in rows]
+
+    # Сохраняет результаты одной страницы рассылки одной транзакцией.
+    # outcomes - список (tg_user_id, status), где status: 'sent', 'failed' или 'blocked'
+    async def save_broadcast_page(self, broadcast_id: int, cursor: int, outcomes: List[tuple]):
+        sent = sum(1 for _, status in outcomes if status == 'sent')
+        failed = sum(1 for _, status in outcomes if status == 'failed')
+        blocked = [tg_user_id for tg_user_id, status in outcomes if status == 'blocked']
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany(
+                    '''
+                    INSERT INTO broadcast_deliveries (broadcast_id, tg_user_id, status)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (broadcast_id, tg_user_id) DO UPDATE SET status = EXCLUDED.status;
+                    ''',
+                    [(broadcast_id, tg_user_id, status) for tg_user_id, status in outcomes]
+                )
+                if blocked:
+                    await connection.execute(
+                        "UPDATE users SET blocked_bot = TRUE WHERE tg_user_id = ANY($1::bigint[])", blocked
+                    )
+                await connection.execute(
+                    '''
+                    UPDATE broadcasts
+                    SET cursor = $2, sent = sent + $3, failed = failed + $4, blocked = blocked + $5
+                    WHERE id = $1;
+                    ''',
+                    broadcast_id, cursor, sent, failed, len(blocked)
+                )
+
+    async def finish_broadcast(self, broadcast_id: int):
+        query = '''
+            UPDATE broadcasts SET status = 'done' WHERE id = $1;
+        '''
+        await self.execute(query, broadcast_id)
+
+    async def set_blocked_bot(self, tg_user_id: int, blocked: bool):
+        query = '''
+            UPDATE users SET blocked_bot = $2 WHERE tg_user_id = $1;
+        '''
+        await self.execute(query, tg_user_id, blocked)
+
+    async def count_broadcast_audience(self) -> int:
+        query = '''
+            SELECT count(*) FROM users WHERE NOT blocked_bot;
+        '''
+        return await self.fetchval_read(query)
+
+    # Сколько получателей рассылки осталось (те же условия, что в get_broadcast_recipients)
+    async def count_broadcast_recipients(self, broadcast_id: int, after_user_id: int) -> int:
+        query = '''
+            SELECT count(*) FROM users u
+            WHERE u.tg_user_id > $2
+              AND NOT u.blocked_bot
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries d
+                  WHERE d.broadcast_id = $1 AND d.tg_user_id = u.tg_user_id
+              );
+        '''
+        return await self.fetchval_read(query, broadcast_id, after_user_id)
+
     # ---------------profile------------------
     async def registration(self, tg_user_id: int, username: str):
         query = '''
@@ -193,161 +595,491 @@ class AsyncDatabase:
         '''
         await self.execute(query, username, tg_user_id)
 
+    # Таблицы с данными пользователя (по колонке tg_user_id). users удаляется последней.
+    # Новые таблицы с данными пользователя нужно добавлять сюда
+    # quest_ratings удаляется отдельно: голоса пользователя вычитаются из счетчиков quests
+    USER_DATA_TABLES = ('user_telegram', 'quest_sessions', 'broadcast_deliveries', 'player_stats',
+                        'entitlements', 'timers', 'kept_messages', 'users')
+    # Таблицы, которых может не быть: старая timeloop (до переноса в quest_sessions) и она же после переноса
+    OPTIONAL_USER_DATA_TABLES = ('timeloop', 'timeloop_migrated')
+
+    # Удаление всех данных пользователя одной транзакцией.
+    # Возвращает (id сообщений бота в чате пользователя, которые еще нужно удалить,
+    # удаленные оценки [(quest_id, mark), ...] - они уже вычтены из quests.likes/dislikes)
     async def delete_account(self, tg_user_id: int):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                message_ids = await connection.fetchval(
+                    '''
+                    SELECT ARRAY(
+                        SELECT m.id
+                        FROM user_telegram t, unnest(t.last_message_ids, t.last_message_sent_at) AS m(id, sent_at)
+                        WHERE t.tg_user_id = $1 AND m.id IS NOT NULL AND coalesce(m.sent_at, $2) >= $2
+                        UNION
+                        SELECT message_id FROM kept_messages WHERE tg_user_id = $1 AND sent_at >= $2
+                    )
+                    ''',
+                    tg_user_id, int(time.time()) - MESSAGE_DELETE_WINDOW
+                )
+                marks = await connection.fetch(
+                    '''
+                    WITH deleted AS (
+                        DELETE FROM quest_ratings WHERE tg_user_id = $1 RETURNING quest_id, mark
+                    ), updated AS (
+                        UPDATE quests q
+                        SET likes = q.likes - d.likes, dislikes = q.dislikes - d.dislikes
+                        FROM (
+                            SELECT quest_id,
+                                   count(*) FILTER (WHERE mark = 1) AS likes,
+                                   count(*) FILTER (WHERE mark = -1) AS dislikes
+                            FROM deleted GROUP BY quest_id
+                        ) AS d
+                        WHERE q.id = d.quest_id
+                    )
+                    SELECT quest_id, mark FROM deleted;
+                    ''',
+                    tg_user_id
+                )
+                for table in self.USER_DATA_TABLES:
+                    await connection.execute(f"DELETE FROM {table} WHERE tg_user_id = $1", tg_user_id)
+                for table in self.OPTIONAL_USER_DATA_TABLES:
+                    if await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", table):
+                        await connection.execute(f"DELETE FROM {table} WHERE tg_user_id = $1", tg_user_id)
+                # Вытесненные состояния FSM (ключ "<бот>:<чат>:<пользователь>:...", см. fsm_storage._spill_key)
+                if await connection.fetchval("SELECT to_regclass('fsm_spill') IS NOT NULL"):
+                    await connection.execute("DELETE FROM fsm_spill WHERE split_part(key, ':', 3) = $1",
+                                             str(tg_user_id))
+                await connection.execute("DELETE FROM account_purges WHERE tg_user_id = $1", tg_user_id)
+        return message_ids or [], [(row['quest_id'], row['mark']) for row in marks]
+
+    # Очередь удаления аккаунтов (на случай перезапуска до того, как удаление выполнено)
+    async def create_account_purges_table(self):
         query = '''
-            DELETE FROM user_telegram WHERE tg_user_id = $1
+            CREATE TABLE IF NOT EXISTS account_purges (
+                tg_user_id BIGINT PRIMARY KEY,
+                chat_id BIGINT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query)
 
+    async def add_account_purge(self, tg_user_id: int, chat_id: int):
         query = '''
-            DELETE FROM timeloop WHERE tg_user_id = $1
+            INSERT INTO account_purges (tg_user_id, chat_id) VALUES ($1, $2)
+            ON CONFLICT (tg_user_id) DO NOTHING;
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query, tg_user_id, chat_id)
 
+    async def get_account_purges(self):
         query = '''
-            DELETE FROM users WHERE tg_user_id = $1;
+            SELECT tg_user_id, chat_id FROM account_purges ORDER BY created_at;
         '''
-        await self.execute(query, tg_user_id)
+        return await self.fetch_read(query, primary=True)
 
-    async def get_user_data(self, tg_user_id: int):
+    # Таймеры квестов (timers.TimerService), чтобы они переживали перезапуск бота
+    async def create_timers_table(self):
         query = '''
-            SELECT * FROM users WHERE tg_user_id=$1
+            CREATE TABLE IF NOT EXISTS timers (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                tg_user_id BIGINT NOT NULL,
+                chat_id BIGINT NOT NULL,
+                due_at DOUBLE PRECISION NOT NULL
+            );
         '''
-        user_data = await self.fetchrow(query, tg_user_id)
-        return user_data
+        await self.execute(query)
 
-    async def get_username(self, tg_user_id: int):
-        query = '''SELECT username FROM users WHERE tg_user_id = $1'''
-        username = await self.fetchval(query, tg_user_id)
-        return username
+    # Перенос таймеров, сохраненных до появления namespace (ключ без "<id бота>:"), в namespace бота.
+    # Строка блокируется, и второй бот ее уже не заберет; старый ключ, у которого в namespace уже есть
+    # новый, удаляется. Возвращает число перенесенных таймеров
+    async def claim_legacy_timers(self, namespace: str) -> int:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    '''
+                    DELETE FROM timers t
+                    WHERE t.key !~ '^[0-9]+:' AND EXISTS (SELECT 1 FROM timers n WHERE n.key = $1 || t.key);
+                    ''',
+                    namespace
+                )
+                result = await connection.execute(
+                    '''
+                    UPDATE timers SET key = $1 || key WHERE key !~ '^[0-9]+:';
+                    ''',
+                    namespace
+                )
+        return int(result.split()[-1])
+
+    # Таймеры одного бота (ключи начинаются с prefix, см. timers.TimerService)
+    async def get_timers(self, prefix: str = ''):
+        query = '''
+            SELECT key, kind, tg_user_id, chat_id, due_at FROM timers WHERE left(key, length($1)) = $1;
+        '''
+        return await self.fetch_read(query, prefix, primary=True)
+
+    # Записать новые/перенесенные таймеры и удалить отмененные/сработавшие одной транзакцией
+    async def save_timers(self, timers: List[tuple], deleted_keys: List[str]):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                if deleted_keys:
+                    await connection.execute('DELETE FROM timers WHERE key = ANY($1)', deleted_keys)
+                if timers:
+                    await connection.executemany('''
+                        INSERT INTO timers (key, kind, tg_user_id, chat_id, due_at)
+                        VALUES ($1, $2, $3, $4, $5)
+                        ON CONFLICT (key) DO UPDATE
+                        SET kind = EXCLUDED.kind, tg_user_id = EXCLUDED.tg_user_id,
+                            chat_id = EXCLUDED.chat_id, due_at = EXCLUDED.due_at
+                    ''', timers)
 
-    async def get_my_quests(self, tg_user_id: int):
+    # Состояния FSM, вытесненные из памяти (fsm_storage.DatabaseSpill)
+    async def create_fsm_spill_table(self):
         query = '''
-            SELECT paid_quest_ids FROM users WHERE tg_user_id = $1;
+            CREATE TABLE IF NOT EXISTS fsm_spill (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                spilled_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
         '''
-        my_quests = await self.fetchval(query, tg_user_id)
-        return my_quests
+        await self.execute(query)
+
+    async def save_fsm_spill(self, key: str, state: str, data: str):
+        query = '''
+            INSERT INTO fsm_spill (key, state, data) VALUES ($1, $2, $3)
+            ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, data = EXCLUDED.data, spilled_at = now();
+        '''
+        await self.execute(query, key, state, data)
+
+    async def take_fsm_spill(self, key: str):
+        query = '''
+            DELETE FROM fsm_spill WHERE key = $1 RETURNING state, data;
+        '''
+        return await self.fetchrow(query, key, write=True)
+
+    # Ключи сохраненных состояний; те, что старше max_age секунд, удаляются
+    async def get_fsm_spill_keys(self, max_age: float):
+        query = '''
+            WITH expired AS (
+                DELETE FROM fsm_spill WHERE spilled_at < now() - make_interval(secs => $1)
+            )
+            SELECT key FROM fsm_spill WHERE spilled_at >= now() - make_interval(secs => $1);
+        '''
+        return [row['key'] for row in await self.fetch(query, max_age, write=True)]
+
+    async def _load_users(self, tg_user_ids: List[int], primary: bool):
+        query = '''
+            SELECT * FROM users WHERE tg_user_id = ANY($1)
+        '''
+        return await self.fetch_read(query, tg_user_ids, primary=primary)
+
+    async def get_user_data(self, tg_user_id: int):
+        user_data = await self.user_loader.load(tg_user_id, self._reads_primary())
+        return user_data
+
+    async def get_username(self, tg_user_id: int):
+        user_data = await self.get_user_data(tg_user_id)
+        return user_data['username'] if user_data is not None else None
 
     # ---------------quests-------------------
-    async def get_quest_data_by_id(self, quest_id: int):
+    async def _load_quests(self, quest_ids: List[int], primary: bool):
         query = '''
-            SELECT * FROM quests WHERE id = $1;
+            SELECT * FROM quests WHERE id = ANY($1);
         '''
+        return await self.fetch_read(query, quest_ids, primary=primary)
 
-        quest_data = await self.fetchrow(query, quest_id)
+    async def get_quest_data_by_id(self, quest_id: int):
+        quest_data = await self.quest_loader.load(quest_id, self._reads_primary())
         return quest_data
 
+    # Несколько квестов одним запросом, в порядке quest_ids (несуществующие пропускаются)
+    async def get_quests_by_ids(self, quest_ids: List[int]):
+        primary = self._reads_primary()
+        quests = await asyncio.gather(*(self.quest_loader.load(quest_id, primary) for quest_id in quest_ids))
+        return [quest_data for quest_data in quests if quest_data is not None]
+
     async def get_all_quest(self):
         query = '''
             SELECT * FROM quests;
         '''
-        return await self.fetch(query)
+        return await self.fetch_read(query)
 
-    async def quest_mark(self, mark: str, quest_id: int):
-        if mark == "like":
-            query = '''
-                UPDATE quests
-                SET likes = likes + 1
-                WHERE id = $1;
-            '''
-        elif mark == "dislike":
-            query = '''
-                UPDATE quests
-                SET dislikes = dislikes + 1
-                WHERE id = $1;
-            '''
-        await self.execute(query, quest_id)
+    # ---------------ratings------------------
+    # Одна оценка на пользователя и квест (её можно изменить): 1 - лайк, -1 - дизлайк
+    async def create_quest_ratings_table(self):
+        query = '''
+            CREATE TABLE IF NOT EXISTS quest_ratings (
+                tg_user_id BIGINT NOT NULL,
+                quest_id INTEGER NOT NULL,
+                mark SMALLINT NOT NULL,
+                PRIMARY KEY (tg_user_id, quest_id)
+            );
+        '''
+        await self.execute(query)
 
-    # -------------TIME_LOOP-------------
-    async def init_artefacts_time_loop(self, tg_user_id: int):
-        query = '''INSERT INTO timeloop (tg_user_id, dog, safe, key, safe_tip, first_question_tip, second_question_tip, third_question_tip, rate_count)
-                    VALUES ($1, 0, 0, 0, 0, 0, 0, 0, 0)
-                    ON CONFLICT (tg_user_id) DO NOTHING;
+    # Сохраняет оценку пользователя и возвращает предыдущую (None, если оценки не было).
+    # Старая оценка читается под блокировкой строки, а если строки нет - вставка без перезаписи:
+    # два быстрых клика подряд не получат оба None (иначе QuestRatings посчитает два новых голоса)
+    async def set_quest_rating(self, tg_user_id: int, quest_id: int, mark: int):
+        self._mark_write()
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                while True:
+                    old_mark = await connection.fetchval('''
+                        SELECT mark FROM quest_ratings WHERE tg_user_id = $1 AND quest_id = $2 FOR UPDATE;
+                    ''', tg_user_id, quest_id)
+                    if old_mark is not None:
+                        await connection.execute('''
+                            UPDATE quest_ratings SET mark = $3 WHERE tg_user_id = $1 AND quest_id = $2;
+                        ''', tg_user_id, quest_id, mark)
+                        return old_mark
+                    inserted = await connection.fetchval('''
+                        INSERT INTO quest_ratings (tg_user_id, quest_id, mark) VALUES ($1, $2, $3)
+                        ON CONFLICT (tg_user_id, quest_id) DO NOTHING
+                        RETURNING 1;
+                    ''', tg_user_id, quest_id, mark)
+                    if inserted is not None:
+                        return None
+                    # строку только что вставил параллельный клик - читаем ее под блокировкой
+
+    async def get_quest_marks(self):
+        query = '''
+            SELECT id, likes, dislikes FROM quests;
         '''
-        await self.execute(query, tg_user_id)
+        return await self.fetch_read(query)
 
-    async def get_artefacts_time_loop(self, tg_user_id: int):
+    # Применяет накопленные изменения счетчиков одной транзакцией: {quest_id: (likes_delta, dislikes_delta)}
+    # Возвращает актуальные значения счетчиков изменённых квестов
+    async def apply_quest_mark_deltas(self, deltas: dict):
         query = '''
-            SELECT * FROM timeloop WHERE tg_user_id = $1
+            UPDATE quests
+            SET likes = likes + $2, dislikes = dislikes + $3
+            WHERE id = $1
+            RETURNING id, likes, dislikes;
         '''
-        artefacts = await self.fetchrow(query, tg_user_id)
-        return artefacts
+        rows = []
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                for quest_id in sorted(deltas):
+                    likes, dislikes = deltas[quest_id]
+                    row = await connection.fetchrow(query, quest_id, likes, dislikes)
+                    if row is not None:
+                        rows.append(row)
+        return rows
 
-    async def clear_artefacts_time_loop(self, tg_user_id: int):
+    # --------------entitlements--------------
+    # Квесты пользователя: одна строка на (пользователь, квест), source - 'free', 'payment' или 'legacy'
+    # (перенесено из users.paid_quest_ids). payments - все успешные оплаты (charge_id от Telegram уникален),
+    # не удаляются вместе с аккаунтом. Цена квеста - quests.price в минимальных единицах валюты
+    async def create_entitlements_tables(self):
         query = '''
-            UPDATE timeloop
-            SET 
-                safe = 0,
-                dog = 0,
-                key = 0,
-                safe_tip = 0,
-                first_question_tip = 0,
-                second_question_tip = 0,
-                third_question_tip = 0
-            WHERE tg_user_id = $1;
+            ALTER TABLE quests ADD COLUMN IF NOT EXISTS price INTEGER NOT NULL DEFAULT 0;
+
+            CREATE TABLE IF NOT EXISTS entitlements (
+                tg_user_id BIGINT NOT NULL,
+                quest_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                charge_id TEXT,
+                granted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (tg_user_id, quest_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS payments (
+                charge_id TEXT PRIMARY KEY,
+                provider_charge_id TEXT,
+                tg_user_id BIGINT NOT NULL,
+                quest_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                currency TEXT NOT NULL,
+                paid_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            -- возврат оплаты уже купленного квеста: 'refunded' - возвращена, 'manual' - вернуть вручную
+            ALTER TABLE payments ADD COLUMN IF NOT EXISTS refund_status TEXT;
+
+            -- разовый перенос из paid_quest_ids (пока entitlements пуста)
+            INSERT INTO entitlements (tg_user_id, quest_id, source)
+            SELECT DISTINCT u.tg_user_id, q.quest_id, 'legacy'
+            FROM users u, unnest(u.paid_quest_ids) AS q(quest_id)
+            WHERE NOT EXISTS (SELECT 1 FROM entitlements)
+            ON CONFLICT (tg_user_id, quest_id) DO NOTHING;
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query)
 
-    async def update_dog_time_loop(self, tg_user_id: int, dog: int):
+    # Из основной базы: сюда приходят сразу после оплаты, реплика может еще не догнать
+    async def get_entitlements(self, tg_user_id: int) -> List[int]:
         query = '''
-            UPDATE timeloop
-            SET dog = $1
-            WHERE tg_user_id = $2;
+            SELECT quest_id FROM entitlements WHERE tg_user_id = $1 ORDER BY granted_at, quest_id;
         '''
-        await self.execute(query, dog, tg_user_id)
+        rows = await self.fetch_read(query, tg_user_id, primary=True)
+        return [row['quest_id'] for row in rows]
 
-    async def update_safe_time_loop(self, tg_user_id: int, safe: int):
+    async def grant_entitlement(self, tg_user_id: int, quest_id: int, source: str) -> bool:
         query = '''
-            UPDATE timeloop
-            SET safe = $1
-            WHERE tg_user_id = $2;
+            INSERT INTO entitlements (tg_user_id, quest_id, source) VALUES ($1, $2, $3)
+            ON CONFLICT (tg_user_id, quest_id) DO NOTHING
+            RETURNING 1;
         '''
-        await self.execute(query, safe, tg_user_id)
+        return await self.fetchval(query, tg_user_id, quest_id, source, write=True) is not None
 
-    async def update_key_time_loop(self, tg_user_id: int, key: int):
+    # Оплата и выдача квеста одной транзакцией. Возвращает (оплата новая, квест выдан этой оплатой):
+    # повтор того же successful_payment - (False, False), оплата уже купленного квеста - (True, False)
+    async def record_payment(self, tg_user_id: int, quest_id: int, charge_id: str, provider_charge_id: str,
+                             amount: int, currency: str):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                new_payment = await connection.fetchval('''
+                    INSERT INTO payments (charge_id, provider_charge_id, tg_user_id, quest_id, amount, currency)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                    ON CONFLICT (charge_id) DO NOTHING
+                    RETURNING 1;
+                ''', charge_id, provider_charge_id, tg_user_id, quest_id, amount, currency)
+                if new_payment is None:
+                    return False, False
+                granted = await connection.fetchval('''
+                    INSERT INTO entitlements (tg_user_id, quest_id, source, charge_id) VALUES ($1, $2, 'payment', $3)
+                    ON CONFLICT (tg_user_id, quest_id) DO NOTHING
+                    RETURNING 1;
+                ''', tg_user_id, quest_id, charge_id)
+        self._mark_write()
+        return True, granted is not None
+
+    async def set_payment_refund(self, charge_id: str, status: str):
         query = '''
-            UPDATE timeloop
-            SET key = $1
-            WHERE tg_user_id = $2;
+            UPDATE payments SET refund_status = $2 WHERE charge_id = $1;
         '''
-        await self.execute(query, key, tg_user_id)
+        await self.execute(query, charge_id, status)
+
+    # --------------player_stats--------------
+    # Пройденные квесты и звезды игроков (leaderboard.PlayerStats). При создании таблица заполняется
+    # по счетчику прохождений квеста quest_id (rate_count_index - индекс счетчика в quest_sessions.counters)
+    async def create_player_stats_table(self, quest_id: int, rate_count_index: int, first_stars: int,
+                                        repeat_stars: int):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute('''
+                    CREATE TABLE IF NOT EXISTS player_stats (
+                        tg_user_id BIGINT PRIMARY KEY,
+                        completions INTEGER NOT NULL DEFAULT 0,
+                        stars INTEGER NOT NULL DEFAULT 0
+                    );
+                ''')
+                await connection.execute('''
+                    INSERT INTO player_stats (tg_user_id, completions, stars)
+                    SELECT tg_user_id, counters[$2], $3 + (counters[$2] - 1) * $4
+                    FROM quest_sessions
+                    WHERE quest_id = $1 AND counters[$2] > 0 AND NOT EXISTS (SELECT 1 FROM player_stats)
+                    ON CONFLICT (tg_user_id) DO NOTHING;
+                ''', quest_id, rate_count_index + 1, first_stars, repeat_stars)
 
-    async def inc_safe_tip_time_loop(self, tg_user_id: int):
+    async def iter_player_stats(self, prefetch: int = 10000):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor('SELECT tg_user_id, completions, stars FROM player_stats',
+                                                   prefetch=prefetch):
+                    yield row
+
+    # Применяет накопленные изменения одним запросом: {tg_user_id: (completions_delta, stars_delta)}.
+    # Возвращает актуальные значения изменённых строк
+    async def apply_player_stats_deltas(self, deltas: dict):
+        user_ids = sorted(deltas)
         query = '''
-            UPDATE timeloop
-            SET safe_tip = safe_tip+1
-            WHERE tg_user_id = $1
+            INSERT INTO player_stats AS s (tg_user_id, completions, stars)
+            SELECT * FROM unnest($1::bigint[], $2::integer[], $3::integer[])
+            ON CONFLICT (tg_user_id) DO UPDATE
+            SET completions = s.completions + EXCLUDED.completions, stars = s.stars + EXCLUDED.stars
+            RETURNING tg_user_id, completions, stars;
+        '''
+        return await self.fetch(query, user_ids, [deltas[tg_user_id][0] for tg_user_id in user_ids],
+                                [deltas[tg_user_id][1] for tg_user_id in user_ids], write=True)
+
+    # -------------quest_sessions-------------
+    # Прогресс пользователя в квесте: одна узкая строка на (пользователь, квест).
+    # flags - битовая маска артефактов, counters - массив счетчиков фиксированной длины.
+    # Раскладка битов и счетчиков для каждого квеста описана в quest_sessions.py
+    async def create_quest_sessions_table(self, counters_size: int):
+        query = f'''
+            CREATE TABLE IF NOT EXISTS quest_sessions (
+                tg_user_id BIGINT NOT NULL,
+                quest_id INTEGER NOT NULL,
+                flags INTEGER NOT NULL DEFAULT 0,
+                counters SMALLINT[] NOT NULL DEFAULT array_fill(0::smallint, ARRAY[{int(counters_size)}]),
+                PRIMARY KEY (tg_user_id, quest_id)
+            );
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query)
 
-    async def inc_first_q_tip_time_loop(self, tg_user_id: int):
+    async def init_quest_session(self, tg_user_id: int, quest_id: int):
         query = '''
-            UPDATE timeloop
-            SET first_question_tip = first_question_tip+1
-            WHERE tg_user_id = $1
+            INSERT INTO quest_sessions (tg_user_id, quest_id)
+            VALUES ($1, $2)
+            ON CONFLICT (tg_user_id, quest_id) DO NOTHING;
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query, tg_user_id, quest_id)
 
-    async def inc_second_q_tip_time_loop(self, tg_user_id: int):
+    # primary=True - прочитать из основной базы (например, сразу после записи вне апдейта этого чата)
+    async def get_quest_session(self, tg_user_id: int, quest_id: int, primary: bool = False):
         query = '''
-            UPDATE timeloop
-            SET second_question_tip = second_question_tip+1
-            WHERE tg_user_id = $1
+            SELECT flags, counters FROM quest_sessions WHERE tg_user_id = $1 AND quest_id = $2
         '''
-        await self.execute(query, tg_user_id)
+        return await self.fetchrow_read(query, tg_user_id, quest_id, primary=primary)
+
+    async def set_quest_session_flag(self, tg_user_id: int, quest_id: int, bit: int, value: bool):
+        if value:
+            query = '''
+                UPDATE quest_sessions SET flags = flags | $3
+                WHERE tg_user_id = $1 AND quest_id = $2;
+            '''
+        else:
+            query = '''
+                UPDATE quest_sessions SET flags = flags & ~$3
+                WHERE tg_user_id = $1 AND quest_id = $2;
+            '''
+        await self.execute(query, tg_user_id, quest_id, 1 << bit)
 
-    async def inc_third_q_tip_time_loop(self, tg_user_id: int):
+    # index - номер счетчика, начиная с 0 (в postgres массивы нумеруются с 1)
+    async def inc_quest_session_counter(self, tg_user_id: int, quest_id: int, index: int):
         query = '''
-            UPDATE timeloop
-            SET third_question_tip = third_question_tip+1
-            WHERE tg_user_id = $1
+            UPDATE quest_sessions
+            SET counters[$3 + 1] = LEAST(counters[$3 + 1] + 1, 32767)
+            WHERE tg_user_id = $1 AND quest_id = $2;
         '''
-        await self.execute(query, tg_user_id)
+        await self.execute(query, tg_user_id, quest_id, index)
 
-    async def inc_rate_count_time_loop(self, tg_user_id: int):
+    # Сбрасывает артефакты и все счетчики, кроме keep_counters (номера с 0)
+    async def clear_quest_session(self, tg_user_id: int, quest_id: int, keep_counters: List[int]):
         query = '''
-            UPDATE timeloop
-            SET rate_count = rate_count+1
-            WHERE tg_user_id = $1
+            UPDATE quest_sessions
+            SET
+                flags = 0,
+                counters = ARRAY(
+                    SELECT CASE WHEN i - 1 = ANY($3::int[]) THEN counters[i] ELSE 0 END
+                    FROM generate_subscripts(counters, 1) AS i
+                    ORDER BY i
+                )::smallint[]
+            WHERE tg_user_id = $1 AND quest_id = $2;
+        '''
+        await self.execute(query, tg_user_id, quest_id, keep_counters)
+
+    # Разовый перенос данных из старой таблицы timeloop в quest_sessions.
+    # Порядок битов (dog, safe, key) и счетчиков совпадает с quest_sessions.TIME_LOOP.
+    # После переноса таблица переименовывается в timeloop_migrated, поэтому повторно миграция не выполняется
+    async def migrate_timeloop_to_quest_sessions(self, quest_id: int, counters_size: int) -> int:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                exists = await connection.fetchval("SELECT to_regclass('timeloop') IS NOT NULL")
+                if not exists:
+                    return 0
+                query = '''
+                    INSERT INTO quest_sessions (tg_user_id, quest_id, flags, counters)
+                    SELECT
+                        tg_user_id,
+                        $1,
+                        (dog <> 0)::int | ((safe <> 0)::int << 1) | ((key <> 0)::int << 2),
+                        (ARRAY[safe_tip, first_question_tip, second_question_tip, third_question_tip, rate_count]
+                            || array_fill(0, ARRAY[$2 - 5]))::smallint[]
+                    FROM timeloop
+                    ON CONFLICT (tg_user_id, quest_id) DO NOTHING;
                 '''
-        await self.execute(query, tg_user_id)
+                result = await connection.execute(query, quest_id, counters_size)
+                await connection.execute("ALTER TABLE timeloop RENAME TO timeloop_migrated")
+                return int(result.split()[-1])
@@ -0,0 +1,65 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EntitlementStore:
+    # Какие квесты есть у пользователя: таблица entitlements, одна строка на (пользователь, квест).
+    # Множество квестов пользователя кешируется в памяти (LRU на max_users пользователей), поэтому проверка
+    # на buy:/play: - поиск в set без запроса в базу. Если квеста в кешированном множестве нет, оно
+    # перечитывается из основной базы: покупка могла пройти на другом инстансе, а отказ все равно ведет
+    # к счету на оплату. Выдача идемпотентна: повтор той же оплаты (тот же charge_id) ничего не меняет
+    def __init__(self, database, max_users: int = 100000):
+        self.database = database
+        self.max_users = max_users
+        self.cache = OrderedDict()  # tg_user_id -> set(quest_id)
+        self.hits = 0
+        self.loads = 0
+
+    async def _load(self, tg_user_id: int) -> set:
+        self.loads += 1
+        quest_ids = self.cache[tg_user_id] = set(await self.database.get_entitlements(tg_user_id))
+        self.cache.move_to_end(tg_user_id)
+        while len(self.cache) > self.max_users:
+            self.cache.popitem(last=False)
+        return quest_ids
+
+    async def quest_ids(self, tg_user_id: int) -> set:
+        quest_ids = self.cache.get(tg_user_id)
+        if quest_ids is None:
+            return await self._load(tg_user_id)
+        self.cache.move_to_end(tg_user_id)
+        return quest_ids
+
+    async def owns(self, tg_user_id: int, quest_id: int) -> bool:
+        quest_ids = self.cache.get(tg_user_id)
+        if quest_ids is not None and quest_id in quest_ids:
+            self.hits += 1
+            self.cache.move_to_end(tg_user_id)
+            return True
+        return quest_id in await self._load(tg_user_id)
+
+    def _add(self, tg_user_id: int, quest_id: int):
+        quest_ids = self.cache.get(tg_user_id)
+        if quest_ids is not None:
+            quest_ids.add(quest_id)
+
+    # Бесплатный квест попадает в "Мои квесты" при первом запуске
+    async def grant_free(self, tg_user_id: int, quest_id: int):
+        await self.database.grant_entitlement(tg_user_id, quest_id, 'free')
+        self._add(tg_user_id, quest_id)
+
+    # Оплата квеста (successful_payment). Возвращает (оплата новая, квест выдан этой оплатой):
+    # повтор уже обработанной оплаты - (False, False), оплата уже купленного квеста - (True, False),
+    # такую оплату нужно вернуть
+    async def grant_payment(self, tg_user_id: int, quest_id: int, charge_id: str, provider_charge_id: str,
+                            amount: int, currency: str):
+        new_payment, granted = await self.database.record_payment(tg_user_id, quest_id, charge_id,
+                                                                  provider_charge_id, amount, currency)
+        self._add(tg_user_id, quest_id)
+        return new_payment, granted
+
+    # Аккаунт удален (строки entitlements удаляются вместе с остальными данными пользователя)
+    def discard(self, tg_user_id: int):
+        self.cache.pop(tg_user_id, None)
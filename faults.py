@@ -0,0 +1,178 @@
+import asyncio
+import inspect
+import json
+import logging
+import math
+import random
+from typing import Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+# Внедрение задержек и ошибок в запросы к базе и к Bot API - для нагрузочного теста (load_benchmark.py)
+# и проверки, как бот переживает медленную базу, 429 и 5xx. Сценарий - JSON файл:
+#
+# {
+#   "seed": 1,
+#   "database": {
+#     "*": {"latency_ms": {"median": 20, "p99": 500}, "error_rate": 0.01},
+#     "get_user_data": {"timeout_rate": 0.02, "timeout_s": 5}
+#   },
+#   "bot_api": {
+#     "sendPhoto": {"latency_ms": {"min": 100, "max": 400}, "errors": {"429": 0.05, "502": 0.01}, "retry_after": 2}
+#   }
+# }
+#
+# Правила - по имени метода (AsyncDatabase или Bot API), "*" - для всех методов; правило метода дополняет "*".
+# latency_ms: число - постоянная задержка, {"min", "max"} - равномерная, {"median", "p99"} - логнормальная.
+# error_rate - доля ошибок (для Bot API - 500), errors - доли ошибок Bot API по кодам,
+# timeout_rate - доля запросов, которые висят timeout_s секунд и заканчиваются таймаутом
+
+TIMEOUT = -1
+SERVER_ERROR = 500
+# квантиль нормального распределения для p99
+_Z99 = 2.326
+
+
+class InjectedFault(Exception):
+    pass
+
+
+def _latency(spec):
+    # Функция random.Random -> задержка в секундах или None
+    if spec is None:
+        return None
+    if isinstance(spec, (int, float)):
+        return lambda rng: spec / 1000
+    if "median" in spec:
+        mu = math.log(spec["median"])
+        sigma = math.log(spec.get("p99", spec["median"]) / spec["median"]) / _Z99
+        return lambda rng: rng.lognormvariate(mu, sigma) / 1000
+    return lambda rng: rng.uniform(spec.get("min", 0), spec["max"]) / 1000
+
+
+class MethodFaults:
+    __slots__ = ('latency', 'errors', 'timeout_rate', 'timeout', 'retry_after')
+
+    def __init__(self, spec: dict):
+        self.latency = _latency(spec.get("latency_ms"))
+        self.errors = {int(code): float(rate) for code, rate in spec.get("errors", {}).items()}
+        if spec.get("error_rate"):
+            self.errors[SERVER_ERROR] = self.errors.get(SERVER_ERROR, 0.0) + float(spec["error_rate"])
+        self.timeout_rate = float(spec.get("timeout_rate", 0))
+        self.timeout = float(spec.get("timeout_s", 5))
+        self.retry_after = int(spec.get("retry_after", 1))
+
+
+class FaultInjector:
+    # Правила одной стороны (база или Bot API). inject ждет задержку и возвращает исход запроса:
+    # None - выполнить запрос, TIMEOUT или код ошибки. enabled - выключатель (фазы нагрузочного теста)
+    def __init__(self, rules: dict, rng: random.Random):
+        default = rules.get("*", {})
+        self.default = MethodFaults(default)
+        self.rules = {name: MethodFaults({**default, **spec}) for name, spec in rules.items() if name != "*"}
+        self.rng = rng
+        self.enabled = True
+        self.stats = {}  # метод -> [запросов, ошибок, таймаутов]
+
+    def faults(self, name: str) -> MethodFaults:
+        return self.rules.get(name, self.default)
+
+    async def inject(self, name: str) -> Optional[int]:
+        if not self.enabled:
+            return None
+        faults = self.faults(name)
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0, 0]
+        stats[0] += 1
+        roll = self.rng.random()
+        if roll < faults.timeout_rate:
+            stats[2] += 1
+            await asyncio.sleep(faults.timeout)
+            return TIMEOUT
+        roll -= faults.timeout_rate
+        if faults.latency is not None:
+            await asyncio.sleep(faults.latency(self.rng))
+        for code, rate in faults.errors.items():
+            if roll < rate:
+                stats[1] += 1
+                return code
+            roll -= rate
+        return None
+
+
+class FaultyDatabase:
+    # Обертка над AsyncDatabase: перед каждым async-методом - задержка, ошибка или таймаут из сценария.
+    # Остальные атрибуты (пул, синхронные методы, async-генераторы) отдаются как есть
+    def __init__(self, database, injector: FaultInjector):
+        self._database = database
+        self._injector = injector
+
+    def __getattr__(self, name):
+        value = getattr(self._database, name)
+        if not inspect.iscoroutinefunction(value):
+            return value
+        injector = self._injector
+
+        async def method(*args, **kwargs):
+            outcome = await injector.inject(name)
+            if outcome == TIMEOUT:
+                raise asyncio.TimeoutError()
+            if outcome is not None:
+                raise InjectedFault(f"{name}: внедренная ошибка базы")
+            return await value(*args, **kwargs)
+        return method
+
+
+class FaultInjectionMiddleware(BaseRequestMiddleware):
+    # Middleware сессии Bot API: ошибки - те же исключения, что aiogram выбрасывает на настоящие ответы
+    def __init__(self, injector: FaultInjector):
+        self.injector = injector
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        outcome = await self.injector.inject(name)
+        if outcome is None:
+            return await make_request(bot, method)
+        if outcome == TIMEOUT:
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        if outcome == 429:
+            retry_after = self.injector.faults(name).retry_after
+            raise TelegramRetryAfter(method=method, message=f"Too Many Requests: retry after {retry_after}",
+                                     retry_after=retry_after)
+        if outcome >= 500:
+            raise TelegramServerError(method=method, message=f"Internal Server Error ({outcome})")
+        raise TelegramBadRequest(method=method, message=f"Bad Request ({outcome})")
+
+
+class FaultScenario:
+    def __init__(self, database: FaultInjector, bot_api: FaultInjector, path: str = ""):
+        self.database = database
+        self.bot_api = bot_api
+        self.path = path
+
+    @property
+    def enabled(self) -> bool:
+        return self.database.enabled or self.bot_api.enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self.database.enabled = self.bot_api.enabled = value
+
+    def wrap_database(self, database) -> FaultyDatabase:
+        return FaultyDatabase(database, self.database)
+
+    def install(self, session):
+        session.middleware(FaultInjectionMiddleware(self.bot_api))
+
+
+def load_scenario(path: str) -> FaultScenario:
+    with open(path, encoding="utf-8") as file:
+        spec = json.load(file)
+    rng = random.Random(spec.get("seed"))
+    logger.warning("Включено внедрение сбоев: сценарий %s", path)
+    return FaultScenario(FaultInjector(spec.get("database", {}), rng), FaultInjector(spec.get("bot_api", {}), rng),
+                         path)
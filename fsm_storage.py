@@ -0,0 +1,163 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    # Пустые data не храним (None вместо {}), запись без состояния и данных удаляется целиком
+    __slots__ = ('state', 'data', 'expires_at')
+
+    def __init__(self, state, data, expires_at: float):
+        self.state = state
+        self.data = data
+        self.expires_at = expires_at
+
+
+class BoundedMemoryStorage(BaseStorage):
+    # FSM в памяти с ограничением размера: не больше max_entries записей, запись живет ttl секунд
+    # с последнего обращения. Записи лежат в OrderedDict в порядке обращений, поэтому и самые старые
+    # по LRU, и просроченные по TTL всегда в начале - удаляются за O(1).
+    # В отличие от MemoryStorage, чтение не создает запись, а сброс состояния и данных ее удаляет.
+    # spill (например, DatabaseSpill) - куда сохранить вытесненную по LRU запись с активным состоянием;
+    # при следующем обращении она загружается обратно. Просроченные по TTL записи считаются брошенными
+    def __init__(self, max_entries: int = 100000, ttl: float = 24 * 60 * 60, spill=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill = spill
+        self.records = OrderedDict()  # StorageKey -> _Record
+        self.spilled = set()  # ключи (строкой) записей, которые лежат в spill
+        self.evicted = 0
+        self.expired = 0
+        self.spilled_count = 0
+        self.restored = 0
+
+    # Загрузить ключи записей, сохраненных в spill до перезапуска (старше ttl там удаляются)
+    async def start(self):
+        if self.spill is not None:
+            self.spilled = set(await self.spill.keys(self.ttl))
+
+    async def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _spill_key(key: StorageKey) -> str:
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+                f"{key.business_connection_id or ''}:{key.destiny}")
+
+    async def _get(self, key: StorageKey) -> Optional[_Record]:
+        now = time.monotonic()
+        record = self.records.get(key)
+        if record is not None:
+            if record.expires_at <= now:
+                del self.records[key]
+                self.expired += 1
+                record = None
+            else:
+                record.expires_at = now + self.ttl
+                self.records.move_to_end(key)
+        self._expire(now)
+        if record is None and self.spilled:
+            record = await self._restore(key, now)
+        return record
+
+    def _expire(self, now: float):
+        while self.records:
+            key, record = next(iter(self.records.items()))
+            if record.expires_at > now:
+                return
+            del self.records[key]
+            self.expired += 1
+
+    async def _restore(self, key: StorageKey, now: float) -> Optional[_Record]:
+        spill_key = self._spill_key(key)
+        if spill_key not in self.spilled:
+            return None
+        self.spilled.discard(spill_key)
+        try:
+            saved = await self.spill.take(spill_key)
+        except Exception as e:
+            logger.error("Ошибка при загрузке состояния FSM %s: %s", spill_key, e)
+            return None
+        if saved is None:
+            return None
+        record = self.records[key] = _Record(saved[0], saved[1] or None, now + self.ttl)
+        self.restored += 1
+        await self._evict()
+        return record
+
+    async def _put(self, key: StorageKey, record: _Record):
+        if record.state is None and not record.data:
+            self.records.pop(key, None)
+            return
+        self.records[key] = record
+        await self._evict()
+
+    async def _evict(self):
+        while len(self.records) > self.max_entries:
+            old_key, old = self.records.popitem(last=False)
+            self.evicted += 1
+            if self.spill is not None and old.state is not None:
+                await self._spill(old_key, old)
+
+    async def _spill(self, key: StorageKey, record: _Record):
+        spill_key = self._spill_key(key)
+        try:
+            await self.spill.save(spill_key, record.state, record.data or {})
+            self.spilled.add(spill_key)
+            self.spilled_count += 1
+        except Exception as e:
+            logger.error("Ошибка при сохранении состояния FSM %s: %s", spill_key, e)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = await self._get(key)
+        if record is None:
+            if state is None:
+                return
+            record = _Record(None, None, time.monotonic() + self.ttl)
+        record.state = state
+        await self._put(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        if record is None:
+            if not data:
+                return
+            record = _Record(None, None, time.monotonic() + self.ttl)
+        record.data = data.copy() if data else None
+        await self._put(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get(key)
+        if record is None or record.data is None:
+            return {}
+        return record.data.copy()
+
+
+class DatabaseSpill:
+    # Хранение вытесненных состояний FSM в таблице fsm_spill (data - JSON)
+    def __init__(self, database):
+        self.database = database
+
+    async def keys(self, max_age: float):
+        return await self.database.get_fsm_spill_keys(max_age)
+
+    async def save(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        await self.database.save_fsm_spill(key, state, json.dumps(data, ensure_ascii=False))
+
+    async def take(self, key: str):
+        row = await self.database.take_fsm_spill(key)
+        if row is None:
+            return None
+        return row['state'], json.loads(row['data'])
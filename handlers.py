@@ -0,0 +1,1443 @@
+import asyncio
+import logging
+import time
+
+from aiogram.filters import Command, CommandObject, ChatMemberUpdatedFilter, KICKED, MEMBER
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import (Message, CallbackQuery, FSInputFile, BufferedInputFile, ChatMemberUpdated, LabeledPrice,
+                           PreCheckoutQuery, InlineQuery, InlineQueryResultArticle, InputTextMessageContent)
+
+import analytics
+import payments
+import riddles
+import screens
+import timers
+
+logger = logging.getLogger(__name__)
+
+# Кол-во квестов на одной странице
+QUESTS_PER_PAGE = 5
+
+# Inline-поиск: результатов в одном ответе и параметр /start ссылки на квест (quest_<id>)
+INLINE_RESULTS_PER_PAGE = 20
+QUEST_LINK_PREFIX = "quest_"
+
+# Сколько регистрация ждет удаления старого аккаунта (секунды); дольше - значит удаление повторяется после ошибки
+PURGE_WAIT_TIMEOUT = 10
+
+# Кнопки квеста TimeLoop -> id квеста (для аналитики)
+TIME_LOOP_QUEST_ID = 2
+TIME_LOOP_CALLBACKS = dict.fromkeys([
+    "startTimeLoop", "open_letter", "other_clues_1", "read_notes", "other_clues_2", "code", "other_clues_3",
+    "open_box", "safe_tip", "other_clues_4", "laboratory", "open_door", "take_puppy", "not_risk", "devices",
+    "drafts", "other_clues_5", "myselfTS", "myselfD", "use_device", "not_risk_D", "use_diary", "searchTS",
+    "talkTS", "question1", "anomaly", "rejection", "myselfUncle", "again_time_loop",
+    "final_like:2", "final_dislike:2"
+], TIME_LOOP_QUEST_ID)
+
+
+# ---------------------Registration------------------------
+class Registration(StatesGroup):
+    UsernameWaiting = State()
+
+
+class ChangeName(StatesGroup):
+    ChangeNameWaiting = State()
+
+
+# --------------------------quest_clases--------------------
+class TimeLoop(StatesGroup):
+    Start = State()
+    Legend = State()
+    Code = State()
+    GetKey = State()
+    Question1 = State()
+    Question2 = State()
+    Question3 = State()
+    Unsuccessful = State()
+
+
+# Апдейты игроков, которые сейчас проходят квест, обрабатываются в первую очередь
+async def is_in_quest_update(update, data) -> bool:
+    if update.callback_query is not None:
+        return update.callback_query.data in TIME_LOOP_CALLBACKS
+    state = data.get("state")
+    if state is None:
+        return False
+    current_state = await state.get_state()
+    return current_state is not None and current_state.startswith("TimeLoop:")
+
+
+# Регистрация всех хендлеров бота на router. Хендлеры - замыкания над сервисами app (main.App),
+# поэтому у каждого бота в процессе свои Bot, очереди и таймеры, а база и каталог - общие (app.shared)
+def register_handlers(router, app):
+    config = app.config
+    bot = app.bot
+    broadcaster = app.broadcaster
+    account_purges = app.account_purges
+    timer_service = app.timer_service
+    shared = app.shared
+    database = shared.database
+    catalog = shared.catalog
+    events = shared.events
+    sessions = shared.sessions
+    quest_ratings = shared.quest_ratings
+    members = shared.members
+    player_stats = shared.player_stats
+    entitlements = shared.entitlements
+    quest_index = shared.quest_index
+    certificates = shared.certificates
+    TIME_LOOP_SESSION = shared.TIME_LOOP_SESSION
+
+    router.callback_query.middleware(analytics.QuestEventsMiddleware(events, TIME_LOOP_CALLBACKS))
+
+    # Любое действие в квесте переносит напоминание и очистку брошенной сессии
+    @router.callback_query.middleware()
+    async def quest_activity_middleware(handler, event: CallbackQuery, data):
+        if event.data in TIME_LOOP_CALLBACKS and not event.data.startswith("final_"):
+            tg_user_id = event.from_user.id
+            if config.quest_reminder_delay:
+                timer_service.schedule(f"reminder:{tg_user_id}", "quest_reminder", tg_user_id,
+                                       event.message.chat.id, config.quest_reminder_delay)
+            if config.quest_session_ttl:
+                timer_service.schedule(f"expire:{tg_user_id}", "quest_expire", tg_user_id,
+                                       event.message.chat.id, config.quest_session_ttl)
+        return await handler(event, data)
+
+    # Время на ответ на загадку Хранителя (перезапускается на каждой новой загадке)
+    def start_riddle_timer(chat_id: int):
+        if config.riddle_time_limit:
+            timer_service.schedule(f"riddle:{chat_id}", "riddle_timeout", chat_id, chat_id, config.riddle_time_limit)
+
+    # Квест закончен - напоминать и ждать ответа на загадку больше не нужно
+    def cancel_quest_timers(tg_user_id: int):
+        timer_service.cancel(f"riddle:{tg_user_id}")
+        timer_service.cancel(f"reminder:{tg_user_id}")
+
+    # Аккаунт удален - ни один таймер пользователя больше не должен сработать, ни в одном боте процесса
+    # (строки в timers удаляются вместе с остальными данными пользователя)
+    def cancel_user_timers(tg_user_id: int, chat_id: int):
+        for other in shared.apps:
+            other.timer_service.cancel(f"riddle:{chat_id}")
+            other.timer_service.cancel(f"reminder:{tg_user_id}")
+            other.timer_service.cancel(f"expire:{tg_user_id}")
+
+    account_purges.register_evictor(cancel_user_timers)
+
+    # --------------------------payments--------------------------
+    # Регистрируются первыми: successful_payment приходит обычным сообщением, и без этого его
+    # перехватили бы хендлеры состояний FSM (ввод имени, ответы на загадки)
+
+    # Последняя проверка перед списанием: квест продается, цена и валюта те же, что в счете, и квест еще не куплен
+    @router.pre_checkout_query()
+    async def pre_checkout(query: PreCheckoutQuery):
+        error = None
+        try:
+            quest_id = payments.parse_quest_payload(query.invoice_payload)
+            quest_data = await catalog.get(quest_id) if quest_id is not None else None
+            if quest_data is None or quest_data['is_free']:
+                error = screens.PAYMENT_QUEST_UNAVAILABLE
+            elif query.currency != config.payments_currency or query.total_amount != quest_data.get('price'):
+                error = screens.PAYMENT_PRICE_CHANGED
+            elif await entitlements.owns(query.from_user.id, quest_id):
+                error = screens.PAYMENT_ALREADY_OWNED
+        except Exception as e:
+            logger.error("Произошла ошибка в pre_checkout: %s", e)
+            error = screens.PAYMENT_FAILED
+        try:
+            await query.answer(ok=error is None, error_message=error)
+        except Exception as e:
+            logger.error("Произошла ошибка при ответе на pre_checkout_query: %s", e)
+
+
+    # Деньги списаны: выдаем квест (повтор того же платежа ничего не выдает второй раз) и сразу запускаем его
+    @router.message(lambda message: message.successful_payment is not None)
+    async def successful_payment(message: Message):
+        try:
+            payment = message.successful_payment
+            tg_user_id: int = int(message.from_user.id)
+            quest_id = payments.parse_quest_payload(payment.invoice_payload)
+            if quest_id is None:
+                logger.error("Оплата с неизвестным payload %s, платеж %s", payment.invoice_payload,
+                             payment.telegram_payment_charge_id)
+                return
+            new_payment, granted = await entitlements.grant_payment(
+                tg_user_id, quest_id, payment.telegram_payment_charge_id, payment.provider_payment_charge_id,
+                payment.total_amount, payment.currency)
+            if not new_payment:
+                return
+            if not granted:
+                await refund_payment(message, quest_id)
+                return
+            quest_data = await catalog.get(quest_id)
+            quest_name = quest_data['name'] if quest_data is not None else ""
+            await message.answer(screens.PAYMENT_SUCCESS.render(quest_name=quest_name).text)
+            if quest_id == TIME_LOOP_QUEST_ID:
+                await quest(message)
+        except Exception as e:
+            logger.error("Произошла ошибка в successful_payment: %s", e)
+
+
+    # Оплата уже купленного квеста: звезды возвращаются сразу, оплата в валюте провайдера
+    # отмечается в payments для ручного возврата
+    async def refund_payment(message: Message, quest_id: int):
+        payment = message.successful_payment
+        tg_user_id: int = int(message.from_user.id)
+        charge_id = payment.telegram_payment_charge_id
+        status = 'manual'
+        if payment.currency == payments.STARS_CURRENCY:
+            try:
+                await bot.refund_star_payment(user_id=tg_user_id, telegram_payment_charge_id=charge_id)
+                status = 'refunded'
+            except Exception as e:
+                logger.error("Ошибка при возврате звезд за платеж %s: %s", charge_id, e)
+        if status == 'manual':
+            logger.error("Повторная оплата квеста %s пользователем %s, платеж %s нужно вернуть вручную",
+                         quest_id, tg_user_id, charge_id)
+        await database.set_payment_refund(charge_id, status)
+        await message.answer(screens.PAYMENT_REFUNDED if status == 'refunded' else screens.PAYMENT_REFUND_PENDING)
+
+
+    @router.message(Command("start"))
+    async def start_command(message: Message, command: CommandObject = None):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = int(message.chat.id)
+            user_exist = not account_purges.is_pending(chat_id) and await members.contains(chat_id)
+            args = command.args if command is not None else None
+            if user_exist and args and args.startswith(QUEST_LINK_PREFIX) and args[len(QUEST_LINK_PREFIX):].isdigit():
+                # переход по кнопке из inline-выдачи
+                await show_quest_card(chat_id, int(args[len(QUEST_LINK_PREFIX):]))
+            elif user_exist:
+                await main_menu(chat_id)
+            else:
+                screen = screens.START_REGISTRATION
+                await message.answer(text=screen.text, reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в \start: %s", e)
+
+
+    # Безопасное удаление последнего сообщения.
+    # Все отслеживаемые сообщения удаляются одним запросом deleteMessages (Telegram пропускает те, что уже удалены).
+    # Сообщения старше 48 часов удалить нельзя, поэтому база их уже не возвращает
+    async def safely_delete_last_message(tg_user_id, chat_id):
+        try:
+            last_messages = await database.get_last_messages_by_user_id(tg_user_id)
+            if last_messages:
+                try:
+                    await bot.delete_messages(chat_id=chat_id, message_ids=last_messages[:100])
+                except Exception as e:
+                    # print(f"[Bot] Ошибка при удалении сообщений для пользователя {tg_user_id}: {str(e)}")
+                    pass
+                await database.clear_last_message_ids_by_user_id(tg_user_id)
+                # print(f"[DB] Все сообщения удалениы из базы данных {tg_user_id}")
+        except Exception as e:
+            logger.error("Произошла ошибка в safely_delete_last_message: %s", e)
+
+
+    async def main_menu(tg_user_id: int):
+        try:
+            screen = screens.MAIN_MENU
+            await bot.send_message(tg_user_id, screen.text, reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в main_menu: %s", e)
+
+
+    # ---------------------Registration------------------------
+    @router.callback_query(lambda call: call.data == "Registration")
+    async def registration_button_press(callback: CallbackQuery, state: FSMContext):
+        try:
+            await callback.message.answer(
+                text="Пожалуйста, введите Ваше имя: "
+            )
+            # Устанавливаем пользователю состояние "выбирает username"
+            await state.set_state(Registration.UsernameWaiting)
+        except Exception as e:
+            logger.error("Произошла ошибка в registration_button_press: %s", e)
+
+
+    @router.message(Registration.UsernameWaiting)
+    async def register_user(message: Message, state: FSMContext):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = int(message.chat.id)
+            username = message.text
+            await state.update_data(username=username)
+            if not await account_purges.wait_for(chat_id, timeout=PURGE_WAIT_TIMEOUT):
+                # Состояние ввода имени остается - можно отправить имя еще раз
+                await message.answer("Старый аккаунт еще удаляется, попробуйте отправить имя через пару минут")
+                return
+            await database.registration(chat_id, username)
+            members.add(chat_id)
+            await message.answer("Регистрация завершена!")
+            await state.clear()
+            await main_menu(chat_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в register_user: %s", e)
+
+
+    # -------------------------my profile----------------------
+    # Пройденные квесты, звезды и место в рейтинге - из памяти, без запросов в базу
+    def profile_stats(tg_user_id: int) -> dict:
+        stats = player_stats.get(tg_user_id)
+        rank = f"{stats.rank} из {stats.players}" if stats.rank is not None else "—"
+        return {"completions": stats.completions, "stars": stats.stars, "rank": rank}
+
+
+    @router.callback_query(lambda call: call.data == "my_profile")
+    async def my_profile_button_press(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            user_data = await database.get_user_data(tg_user_id)
+            username = user_data['username']
+            screen = screens.PROFILE.render(username=username, **profile_stats(tg_user_id))
+            msg = await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в my_profile_button_press: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "leaderboard")
+    async def leaderboard(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            leaders = player_stats.leaders()
+            # имена лучших игроков одним запросом (database.user_loader)
+            usernames = await asyncio.gather(*(database.get_username(leader[0]) for leader in leaders))
+            rows = [screens.LEADERBOARD_ROW.format(rank=rank, username=username or "Игрок", stars=stars,
+                                                   completions=completions)
+                    for (_, completions, stars, rank), username in zip(leaders, usernames)]
+            screen = screens.LEADERBOARD.render(rows="\n".join(rows) or screens.LEADERBOARD_EMPTY)
+            msg = await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в leaderboard: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "change_username")
+    async def change_username_button_press(callback: CallbackQuery, state: FSMContext):
+        try:
+            await callback.message.answer(
+                text="Пожалуйста, введите новое имя: "
+            )
+            # Устанавливаем пользователю состояние "выбирает username"
+            await state.set_state(ChangeName.ChangeNameWaiting)
+        except Exception as e:
+            logger.error("Произошла ошибка в change_username_button_press: %s", e)
+
+
+    @router.message(ChangeName.ChangeNameWaiting)
+    async def change_name(message: Message, state: FSMContext):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = int(message.chat.id)
+            new_username = message.text
+            await state.update_data(username=new_username)
+            await database.change_username(chat_id, new_username)
+            user_data = await database.get_user_data(chat_id)
+            username = user_data['username']
+            screen = screens.PROFILE_CHANGED.render(username=username, **profile_stats(chat_id))
+            await bot.send_message(chat_id, text=screen.text, reply_markup=screen.reply_markup)
+            await state.clear()
+        except Exception as e:
+            logger.error("Произошла ошибка в change_name: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "delete_account")
+    async def delete_account(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+
+            screen = screens.DELETE_ACCOUNT
+            await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в delete_account: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "apply_delete_account")
+    async def apply_delete_account(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            await account_purges.enqueue(tg_user_id, chat_id)
+            await bot.send_message(tg_user_id, text="Ваш аккаунт успешно удален!")
+            screen = screens.START_REGISTRATION
+            await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в apply_delete_account: %s", e)
+
+
+    # -------------------------my quests-----------------------
+
+
+    # Добавить звезды за хорошую концовку
+
+
+    @router.callback_query(lambda call: call.data == "my_quests")
+    async def my_quests_button_press(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            quests_list = sorted(await entitlements.quest_ids(tg_user_id))
+            if quests_list:
+                # все купленные квесты из каталога в памяти
+                for quest_data in await catalog.get_many(quests_list):
+                    id = quest_data['id']
+                    name = quest_data['name']
+                    description = quest_data['description']
+                    like, dislike = quest_ratings.get(id, quest_data)
+                    price = payments.price_label(quest_data, config.payments_currency)
+                    message_txt = screens.MY_QUEST_CARD.render(name=name, description=description,
+                                                               like=like, dislike=dislike, price=price).text
+                    await bot.send_message(tg_user_id, text=message_txt,
+                                           reply_markup=screens.quest_card_keyboard("Играть", "play", id))
+                screen = screens.TO_MAIN_MENU
+                await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+            else:
+                screen = screens.MY_QUESTS_EMPTY
+                await bot.send_message(tg_user_id,
+                                       text=screen.text,
+                                       parse_mode="Markdown",
+                                       reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в my_quests_button_press: %s", e)
+
+
+    @router.callback_query(lambda call: call.data.startswith('play:'))
+    async def play(callback: CallbackQuery):
+        try:
+            quest_id = int(callback.data.split(':')[1])
+            await open_quest(callback, quest_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в play: %s", e)
+
+
+    # --------------------------market--------------------------
+    @router.callback_query(lambda call: call.data == "market")
+    async def market(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            quests_list = await catalog.all()
+            if quests_list:
+                for quest_data in quests_list:
+                    id = quest_data['id']
+                    name = quest_data['name']
+                    description = quest_data['description']
+                    like, dislike = quest_ratings.get(id, quest_data)
+                    price = payments.price_label(quest_data, config.payments_currency)
+
+                    # text_play_buy = "Играть" if is_free else "Купить" Закинуть в если выбрал квест
+
+                    message_txt = screens.QUEST_CARD.render(name=name, description=description,
+                                                            like=like, dislike=dislike, price=price).text
+                    msg = await bot.send_message(tg_user_id, text=message_txt,
+                                                 reply_markup=screens.quest_card_keyboard("Выбрать", "buy", id))
+                    await safely_delete_last_message(tg_user_id, chat_id)
+                    await database.set_last_message_by_user_id(chat_id, msg.message_id)
+                screen = screens.TO_MAIN_MENU
+                msg2 = await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+                await database.set_last_message_by_user_id(chat_id, msg2.message_id)
+            else:
+                screen = screens.MARKET_EMPTY
+                msg = await bot.send_message(tg_user_id,
+                                             text=screen.text,
+                                             parse_mode="Markdown",
+                                             reply_markup=screen.reply_markup)
+                await safely_delete_last_message(tg_user_id, chat_id)
+                await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в market: %s", e)
+
+
+    # Карточка одного квеста, как в маркете
+    async def show_quest_card(tg_user_id: int, quest_id: int):
+        quest_data = await catalog.get(quest_id)
+        if quest_data is None:
+            await main_menu(tg_user_id)
+            return
+        like, dislike = quest_ratings.get(quest_id, quest_data)
+        message_txt = screens.QUEST_CARD.render(name=quest_data['name'], description=quest_data['description'],
+                                                like=like, dislike=dislike,
+                                                price=payments.price_label(quest_data, config.payments_currency)).text
+        await bot.send_message(tg_user_id, text=message_txt,
+                               reply_markup=screens.quest_card_keyboard("Выбрать", "buy", quest_id))
+
+
+    # --------------------------inline-поиск--------------------------
+    # @bot запрос: ответ только из памяти (индекс и каталог), без запросов в базу - у inline-ответа
+    # жесткий срок. Устаревший каталог перечитывается в фоне и попадет в следующие ответы.
+    # Telegram кеширует выдачу на время жизни каталога; offset - номер первого результата страницы
+    @router.inline_query()
+    async def inline_search(query: InlineQuery):
+        try:
+            catalog.refresh_in_background()
+            offset = int(query.offset) if query.offset.isdigit() else 0
+            found = quest_index.search(query.query)
+            end = offset + INLINE_RESULTS_PER_PAGE
+            bot_username = (await bot.me()).username
+            results = []
+            for quest_data in found[offset:end]:
+                id = quest_data['id']
+                like, dislike = quest_ratings.get(id, quest_data)
+                price = payments.price_label(quest_data, config.payments_currency)
+                card = screens.QUEST_CARD.render(name=quest_data['name'], description=quest_data['description'],
+                                                 like=like, dislike=dislike, price=price).text
+                description = screens.INLINE_QUEST_DESCRIPTION.render(
+                    price=price, like=like, dislike=dislike, description=quest_data['description'] or "").text
+                results.append(InlineQueryResultArticle(
+                    id=str(id),
+                    title=quest_data['name'],
+                    description=description,
+                    input_message_content=InputTextMessageContent(message_text=card),
+                    reply_markup=screens.quest_link_keyboard(bot_username, f"{QUEST_LINK_PREFIX}{id}")))
+            await query.answer(results,
+                               cache_time=int(config.quest_catalog_ttl),
+                               is_personal=False,
+                               next_offset=str(end) if end < len(found) else "")
+        except Exception as e:
+            logger.error("Произошла ошибка в inline_search: %s", e)
+
+
+    # ----------------------------playing-----------------------
+    @router.callback_query(lambda callback: callback.data.startswith('buy:'))
+    async def StartQuest(callback: CallbackQuery):
+        try:
+            quest_id = int(callback.data.split(':')[1])
+            await open_quest(callback, quest_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в StartQuest: %s", e)
+
+
+    # Запуск квеста из маркета (buy:) и "Моих квестов" (play:). Проверка владения - по кешу entitlements,
+    # без запроса в базу. Бесплатный квест добавляется в "Мои квесты" при первом запуске,
+    # за платный, которого у пользователя нет, отправляется счет - квест запустится после оплаты
+    async def open_quest(callback: CallbackQuery, quest_id: int):
+        tg_user_id: int = int(callback.from_user.id)
+        quest_data = await catalog.get(quest_id)
+        if quest_data is None:
+            await callback.message.answer(screens.QUEST_START_ERROR)
+            return
+        if not await entitlements.owns(tg_user_id, quest_id):
+            if not quest_data['is_free']:
+                await send_quest_invoice(callback.message.chat.id, quest_data)
+                return
+            await entitlements.grant_free(tg_user_id, quest_id)
+
+        if quest_id == TIME_LOOP_QUEST_ID:
+            await quest(callback.message)
+        else:
+            await callback.message.answer(screens.QUEST_START_ERROR)
+
+
+    # Счет на оплату квеста: цена - quests.price в валюте config.payments_currency (по умолчанию звезды)
+    async def send_quest_invoice(chat_id: int, quest_data):
+        price = quest_data.get('price') or 0
+        if price <= 0:
+            logger.error("У платного квеста %s не задана цена", quest_data['id'])
+            await bot.send_message(chat_id, text=screens.QUEST_START_ERROR)
+            return
+        await bot.send_invoice(chat_id,
+                               title=quest_data['name'][:32],
+                               description=(quest_data['description'] or quest_data['name'])[:255],
+                               payload=payments.quest_payload(quest_data['id']),
+                               provider_token=config.payments_provider_token,
+                               currency=config.payments_currency,
+                               prices=[LabeledPrice(label=quest_data['name'][:32], amount=price)])
+
+
+    # --------------------------quests--------------------------
+
+    # TIME LOOP
+
+    async def quest(message: Message):
+        try:
+            chat_id: int = int(message.chat.id)
+            legend1 = ("Вы - молодой журналист, который получает странное письмо от своего пропавшего дяди "
+                       "известного археолога.")
+            legend2 = ("В письме дядя утверждает, что нашел способ путешествовать во времени, "
+                       "но что-то пошло не так, и он застрял в прошлом.")
+            legend3 = ("Вы должны разгадать тайну исчезновения дяди, "
+                       "используя письма, найденные в его кабинете, и свои детективные способности.")
+            # Удаление предыдущих сообщений
+            await safely_delete_last_message(chat_id, chat_id)
+
+            # Отправка и сохранение первого сообщения
+            sent_message = await message.answer(legend1)
+            await database.set_last_message_by_user_id(chat_id, sent_message.message_id)
+
+            # Отправка и сохранение второго сообщения
+            sent_message = await message.answer(legend2)
+            await database.set_last_message_by_user_id(chat_id, sent_message.message_id)
+
+            # Отправка третьего сообщения с клавиатурой и сохранение его ID
+            sent_message = await message.answer(
+                text=legend3,
+                reply_markup=screens.TIME_LOOP_INTRO_KB)
+            await database.set_last_message_by_user_id(chat_id, sent_message.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в quest: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "startTimeLoop")
+    async def StartTimeLoop(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            await sessions.init(tg_user_id, TIME_LOOP_SESSION)
+            txt = "Вы видете письмо на столе"
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.LETTER_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(int(callback.from_user.id), msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в StartTimeLoop: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "open_letter")
+    async def open_letter(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            photo_path = "uploads/First_letter.JPG"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.OPEN_LETTER_KB)
+            # print(msg.message_id)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в open_letter: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "other_clues_1")
+    async def Other_clues_1(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt = ("Среди бумаг дяди вы находите стопку записок, оставленных им во время его путешествия в прошлое. "
+                   "В них он описывает свои впечатления, людей, с которыми встретился, и события, которые наблюдал. "
+                   "Хотите прочитать записку?")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.CLUES_1_KB)
+            # print(msg.chat.id)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в Other_clues_1: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "read_notes")
+    async def read_notes(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            photo_path = "uploads/Notes.png"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.NOTES_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в read_notes: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "other_clues_2")
+    async def other_clues_2(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt = ("В ящике стола вы находите дневник Вашего дяди, в котором зашифрован непонятный код.\n "
+                   "В нем он записывал свои наблюдения, результаты исследований и некоторые тайные записи.")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.CLUES_2_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в other_clues_2: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "code")
+    async def decode(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            photo_path = "uploads/Code.png"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.CODE_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в decode: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "other_clues_3")
+    async def other_clues_3(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt1 = ('В шкафу Вы находите ящик, запертый на ключ. '
+                    'Внутри - странный артефакт, похожий на кулон. '
+                    'В дневнике дяди упоминается, что этот артефакт может служить ключом к путешествию во времени, '
+                    '"Ключом Времени". \nЧто вы делаете?')
+            txt2 = ('В шкафу Вы находите ящик, который уже открыли, а внутри пыль. '
+                    'Видно, что когда-то тут лежал кулон. Который Вы уже взяли.')
+            artefacts = await sessions.get(tg_user_id, TIME_LOOP_SESSION)
+            if artefacts['safe']:
+                msg = await bot.send_message(chat_id=chat_id, text=txt2, reply_markup=screens.CLUES_3_OPENED_KB)
+            else:
+                msg = await bot.send_message(chat_id=chat_id, text=txt1, reply_markup=screens.CLUES_3_KB)
+
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в other_clues_3: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "open_box")
+    async def open_box(callback: CallbackQuery, state: FSMContext):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt = "Введите пароль:"
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.BACK_TO_BOX_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            await state.set_state(TimeLoop.Code)
+        except Exception as e:
+            logger.error("Произошла ошибка в open_box: %s", e)
+
+
+    @router.message(TimeLoop.Code)
+    async def check_code(message: Message):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = int(message.chat.id)
+            if message.text == "6142":
+                msg = await bot.send_message(chat_id=chat_id, text="Успешно")
+                await database.set_last_message_by_user_id(chat_id, message.message_id)
+                await database.set_last_message_by_user_id(chat_id, msg.message_id)
+                await sessions.set_flag(chat_id, TIME_LOOP_SESSION, 'safe')
+                await access_code(message)
+            else:
+                artefacts = await sessions.get(chat_id, TIME_LOOP_SESSION)
+                count_safe_try = artefacts['safe_tip']
+                # print(count_safe_try)
+                txt = "----НЕВЕРНЫЙ КОД!----\n попробуйте еще раз"
+                if count_safe_try >= 3:
+                    msg = await bot.send_message(chat_id=chat_id, text=txt,
+                                                 reply_markup=screens.WRONG_CODE_TIP_KB)
+                else:
+                    msg = await bot.send_message(chat_id=chat_id, text=txt,
+                                                 reply_markup=screens.BACK_TO_BOX_KB)
+                    await sessions.inc(chat_id, TIME_LOOP_SESSION, 'safe_tip')
+                await database.set_last_message_by_user_id(chat_id, message.message_id)
+                await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в check_code: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "safe_tip")
+    async def safe_tip(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            photo_path = "uploads/Tip.png"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.SAFE_TIP_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в safe_tip: %s", e)
+
+
+    async def access_code(message: Message):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = int(message.chat.id)
+            await bot.send_message(chat_id=chat_id, text="Вы нашли артефакт")
+            await sessions.set_flag(chat_id, TIME_LOOP_SESSION, 'key')
+            photo_path = "uploads/Key.png"
+            photo = FSInputFile(photo_path)
+            await safely_delete_last_message(chat_id, chat_id)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo)
+            msg2 = await bot.send_message(chat_id=chat_id,
+                                          text="Это «Ключ Времени», которые поможет вам воспользоваться временной аномалией",
+                                          reply_markup=screens.ACCESS_CODE_KB)
+            await safely_delete_last_message(chat_id, chat_id)
+            await database.set_last_message_by_user_id(chat_id, msg2.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в access_code: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "other_clues_4")
+    async def other_clues_4(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt = ("За книжным шкафом вы обнаруживаете тайный ход. "
+                   "В дневнике дяди упоминается, что он использовал этот ход, "
+                   "чтобы добраться до места проведения своих экспериментов. "
+                   "\nЧто вы делаете?")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.CLUES_4_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в other_clues_4: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "laboratory")
+    async def laboratory(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            txt0 = ("Как только Вы вошли, дверь с грохотом закрылась. "
+                    "Вы попали в заброшенную пыльную лабораторию дяди. "
+                    "Тут очень мало света, но Вам удается что-то разглядеть. "
+                    "Здесь Вы видите несколько приборов, записную книжку с информацией о путешествиях во времени и чертежи. "
+                    "\nЧто вы делаете?")
+            msg0 = await bot.send_message(chat_id=chat_id, text=txt0, reply_markup=screens.LABORATORY_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg0.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в laboratory: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "open_door")
+    async def open_door(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id = callback.message.chat.id
+            txt = ("Дверь заклинило. У Вас не получается её открыть, но вы заметили щенка, привязанного к ножке стола "
+                   "с надписью на ошейнике КОПЕРНИК. Он выглядит уставшим. Однако Вы замечаете его умные глаза и острые когти")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.OPEN_DOOR_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в open_door: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "take_puppy")
+    async def take_puppy(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id = callback.message.chat.id
+            txt = "Это оказалась очень умная и добрая собака. Теперь у тебя появился новый пушистый друг"
+            await sessions.set_flag(tg_user_id, TIME_LOOP_SESSION, 'dog')
+            photo_path = "uploads/Kopernik.png"
+            photo = FSInputFile(photo_path)
+            await bot.send_photo(chat_id=chat_id, photo=photo)
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.BACK_TO_LABORATORY_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в take_puppy: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "not_risk")
+    async def not_risk(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id = callback.message.chat.id
+            txt1 = ("Вы в заброшенной лаборатории дяди. "
+                    "Тут очень мало света, но Вам удается что-то разглядеть."
+                    " Здесь Вы видите несколько приборов, записную книжку с информацией о путешествиях во времени и чертежи. "
+                    "\nЧто Вы делаете?")
+
+            msg1 = await bot.send_message(chat_id=chat_id, text=txt1, reply_markup=screens.NOT_RISK_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg1.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в not_risk: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "devices")
+    async def devices_callback(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = int(callback.message.chat.id)
+            photo_path = "uploads/page_1.JPG"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.BACK_TO_LABORATORY_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в devices_callback: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "drafts")
+    async def drafts(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            photo_path = "uploads/device.JPG"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.BACK_TO_LABORATORY_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в drafts: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "other_clues_5")
+    async def other_clues_5(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ("Вы нашли информацию о том, как ваш дядя попал в прошлое, "
+                   "и кто мог бы ему помочь. В записках дяди упоминается "
+                   "«Хранитель Времени», который, по его мнению, может помочь ему вернуться."
+                   " \nВам нужно найти его.")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.CLUES_5_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в other_clues_5: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "myselfTS")
+    async def myself(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ('В записках дяди вы обнаруживаете, что "Ключ Времени" '
+                   '- это не просто артефакт, а ключ к особой точке во времени, '
+                   'связанной с Хранителем Времени. Вам нужно найти это место, где использовать его.')
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.MYSELF_TS_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в myself: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "myselfD")
+    async def myselfD(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = "Вы нашли прибор, отдалённо напоминающий нужное устройство. Однако он может быть опасен"
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.MYSELF_D_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в myselfD: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "use_device")
+    async def use_device(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = "К сожалению это оказался не тот прибор. При его запуске произошел взрыв и Вы погибли\n💀💀💀"
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await sessions.clear(chat_id, TIME_LOOP_SESSION)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            await sessions.clear(tg_user_id, TIME_LOOP_SESSION)
+            events.ending_reached(tg_user_id, TIME_LOOP_QUEST_ID, "use_device")
+            await unsuccess_final_rate(callback.message, 2)
+        except Exception as e:
+            logger.error("Произошла ошибка в use_device: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "not_risk_D")
+    async def not_risk_D(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = "Прибор Вам немного напомнил бомбу и Вы решили не рисковать"
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.NOT_RISK_D_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в not_risk_D: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "use_diary")
+    async def use_diary(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            artefacts = await sessions.get(tg_user_id, TIME_LOOP_SESSION)
+            txt = "В дневнике Вы нашли это фото.\n Благодаря ему Вы нашли прибор Вашего дяди"
+            photo_path = "uploads/Location_device.JPG"
+            photo = FSInputFile(photo_path)
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            pht = await bot.send_photo(chat_id=chat_id, photo=photo)
+            if artefacts['key']:
+                txt2 = ("Вы нашли прибор, где «Ключ Времени» может открыть временную аномалию. "
+                        "После того, как вы воспользовались прибором, повернув ключ, "
+                        "Вас встречает Хранитель Времени.")
+                msg2 = await bot.send_message(chat_id=chat_id, text=txt2,
+                                              reply_markup=screens.KEEPER_MET_KB)
+                await safely_delete_last_message(tg_user_id, chat_id)
+                await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+                await database.set_last_message_by_user_id(tg_user_id, msg2.message_id)
+                await database.set_last_message_by_user_id(tg_user_id, pht.message_id)
+            else:
+                txt2 = ("К сожалению, "
+                        "Вы не смогли найти «Ключ Времени». "
+                        "Вы не можете запустить прибор. Вы не смогли спасти Вашего дядю.")
+                msg2 = await bot.send_message(chat_id=chat_id, text=txt2)
+                await sessions.clear(chat_id, TIME_LOOP_SESSION)
+                events.ending_reached(tg_user_id, TIME_LOOP_QUEST_ID, "no_key")
+                await unsuccess_final_rate(callback.message, 2)
+                await safely_delete_last_message(tg_user_id, chat_id)
+                await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+                await database.set_last_message_by_user_id(tg_user_id, msg2.message_id)
+                await database.set_last_message_by_user_id(tg_user_id, pht.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в use_diary: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "searchTS")
+    async def searchTS(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            photo_path = "uploads/page_2.JPG"
+            photo = FSInputFile(photo_path)
+            txt = ("Вы нашли прибор, где «Ключ Времени» может открыть "
+                   "временную аномалию. После того, как вы воспользовались прибором, "
+                   "повернув ключ, Вас встречает Хранитель Времени.")
+            msg = await bot.send_message(chat_id=chat_id, text="В дневнике Вы находите следующую запись")
+            pht = await bot.send_photo(chat_id=chat_id, photo=photo, reply_markup=screens.SEARCH_TS_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            await database.set_last_message_by_user_id(tg_user_id, pht.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в searchTS: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "talkTS")
+    async def talkTS(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ("Хранитель:\n Приветствую тебя, я полагаю твое появление здесь связанно с тем, "
+                   "чтобы воспользоваться «Ключом времени». Я должен убедиться, "
+                   "что ты достоин моей помощи. Тебе нужно будет ответить на "
+                   "3 вопроса и у тебя будет 4 попытки на каждый вопрос. "
+                   "Справишься - я помогу тебе, иначе ты будешь страдать")
+            msg = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.TALK_TS_KB)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в talkTS: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "question1")
+    async def question1(callback: CallbackQuery, state: FSMContext):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ("Что течет, но не имеет ни источника, ни устья? "
+                   "Что можно потратить, но нельзя вернуть? "
+                   "Что все имеют, но никому не принадлежит?")
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await state.set_state(TimeLoop.Question1)
+            await state.update_data(question1=1, asked_at=time.time())
+            start_riddle_timer(chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в question1: %s", e)
+
+
+    @router.message(TimeLoop.Question1)
+    async def question2(message: Message, state: FSMContext):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = message.chat.id
+            correct = riddles.TIME_LOOP_QUESTION_1.match(message.text)
+            user_data = await state.get_data()
+            tries = user_data.get("question1", 1)
+            elapsed_ms = int((time.time() - user_data.get("asked_at", time.time())) * 1000)
+
+            events.riddle_attempt(chat_id, TIME_LOOP_QUEST_ID, "Question1", correct, elapsed_ms)
+            if not correct:
+                if tries >= 4:
+                    msg = await bot.send_message(chat_id=chat_id, text=f"Не верно! У Вас не осталось попыток")
+                    await unsuccessful(message)
+                    #await state.set_state(TimeLoop.Unsuccessful)
+                    await state.clear()
+                else:
+                    msg = await bot.send_message(chat_id=chat_id, text=f"Не верно! Осталось {4 - tries} попыток")
+                    if tries == 3:
+                        text = "Вот тебе подсказка:\nВлюбленные этого не наблюдают"
+                        msg_tip = await bot.send_message(chat_id=chat_id, text=text)
+                        await database.set_last_message_by_user_id(chat_id, msg_tip.message_id)
+                    await state.update_data(question1=tries + 1)
+                    await sessions.inc(chat_id, TIME_LOOP_SESSION, 'first_question_tip')
+            else:
+                msg = await bot.send_message(chat_id=chat_id, text="Правильно!")
+                txt = "Что есть и было, но никогда не настанет?"
+                msg2 = await bot.send_message(chat_id=chat_id, text=txt)
+                await state.set_state(TimeLoop.Question2)
+                await state.update_data(question2=1, asked_at=time.time())
+                start_riddle_timer(chat_id)
+                await database.set_last_message_by_user_id(chat_id, msg2.message_id)
+
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в question2: %s", e)
+
+
+    @router.message(TimeLoop.Question2)
+    async def question3(message: Message, state: FSMContext):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = message.chat.id
+            correct = riddles.TIME_LOOP_QUESTION_2.match(message.text)
+            user_data = await state.get_data()
+            tries = user_data.get("question2", 1)
+            elapsed_ms = int((time.time() - user_data.get("asked_at", time.time())) * 1000)
+
+            events.riddle_attempt(chat_id, TIME_LOOP_QUEST_ID, "Question2", correct, elapsed_ms)
+            if not correct:
+                if tries >= 4:
+                    msg = await bot.send_message(chat_id=chat_id, text="Не верно! У Вас не осталось попыток..")
+                    await unsuccessful(message)
+                    # await state.set_state(TimeLoop.Unsuccessful)
+                    await state.clear()
+                else:
+                    msg = await bot.send_message(chat_id=chat_id, text=f"Не верно! Осталось {4 - tries} попыток")
+                    if tries == 3:
+                        text = "Вот тебе подсказка:\nУ каждого человека сегодня, этот момент уже прошел."
+                        msg_tip = await bot.send_message(chat_id=chat_id, text=text)
+                        await database.set_last_message_by_user_id(chat_id, msg_tip.message_id)
+                    await state.update_data(question2=tries + 1)
+                    await sessions.inc(chat_id, TIME_LOOP_SESSION, 'second_question_tip')
+            else:
+                msg = await bot.send_message(chat_id=chat_id, text="Правильно!")
+                txt = "Что является ключом, к пониманию всего вокруг, что нас окружает?"
+                msg2 = await bot.send_message(chat_id=chat_id, text=txt)
+                await state.set_state(TimeLoop.Question3)
+                await state.update_data(question3=1, asked_at=time.time())
+                start_riddle_timer(chat_id)
+                await database.set_last_message_by_user_id(chat_id, msg2.message_id)
+
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в question3: %s", e)
+
+
+    @router.message(TimeLoop.Question3)
+    async def last_question(message: Message, state: FSMContext):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = message.chat.id
+            correct = riddles.TIME_LOOP_QUESTION_3.match(message.text)
+            user_data = await state.get_data()
+            tries = user_data.get("question3", 1)
+            elapsed_ms = int((time.time() - user_data.get("asked_at", time.time())) * 1000)
+
+            events.riddle_attempt(chat_id, TIME_LOOP_QUEST_ID, "Question3", correct, elapsed_ms)
+            if not correct:
+                if tries >= 4:
+                    msg = await bot.send_message(chat_id=chat_id, text="Не верно! У Вас не осталось попыток")
+                    await unsuccessful(message)
+                    # await state.set_state(TimeLoop.Unsuccessful)
+                    await state.clear()
+                else:
+                    msg = await bot.send_message(chat_id=chat_id, text=f"Не верно! Осталось {4 - tries} попыток")
+                    if tries == 3:
+                        text = "Вот тебе подсказка:\nВнутри каждого из нас, это есть, в основном, это в голове."
+                        msg_tip = await bot.send_message(chat_id=chat_id, text=text)
+                        await database.set_last_message_by_user_id(chat_id, msg_tip.message_id)
+                    await state.update_data(question3=tries + 1)
+                    await sessions.inc(chat_id, TIME_LOOP_SESSION, 'third_question_tip')
+            else:
+                msg = await bot.send_message(chat_id=chat_id, text="Правильно!")
+                txt = "Хранитель:\n Ты достоин, воспользоваться временной аномалией, я разрешаю попасть тебе туда, куда тебе нужно"
+                msg2 = await bot.send_message(chat_id=chat_id, text=txt, reply_markup=screens.ANOMALY_CHOICE_KB)
+                await state.clear()
+                timer_service.cancel(f"riddle:{chat_id}")
+                await database.set_last_message_by_user_id(chat_id, msg2.message_id)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в last_question: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "anomaly")
+    async def anomaly(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            user_data = await database.get_user_data(tg_user_id)
+            name = user_data['username']
+            txt = (f"Дядя:\nПривет, {name}, я рад, что ты смог разобраться во "
+                   "всем и спасти своего любимого дядю. Я очень тебе благодарен. "
+                   "Мне нужно тебе столько всего рассказать и показать, я надеюсь, "
+                   "что мы будем вместе путешествовать, изучать разные временные промежутки "
+                   "и погружаться в историю планеты.")
+            await sessions.clear(chat_id, TIME_LOOP_SESSION)
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            events.ending_reached(tg_user_id, TIME_LOOP_QUEST_ID, "anomaly")
+            await success_final_rate(callback.message, 2)
+        except Exception as e:
+            logger.error("Произошла ошибка в anomaly: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "rejection")
+    async def rejection(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ("Вы отказались от возможности спасти Вашего дядю..\n"
+                   "Хранитель времени пропадает, и Вам больше "
+                   "не удается включить прибор заново.")
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await sessions.clear(chat_id, TIME_LOOP_SESSION)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            events.ending_reached(tg_user_id, TIME_LOOP_QUEST_ID, "rejection")
+            await unsuccess_final_rate(callback.message, 2)
+        except Exception as e:
+            logger.error("Произошла ошибка в rejection: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "myselfUncle")
+    async def myselfUncle(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            txt = ("Вы решили проигнорировать Хранителя Времени, "
+                   "и просто запустить прибор, к сожалению, прибор не сработал, "
+                   "без помощи Хранителя, вас засосало в прошлое к вашему дяде, и "
+                   "теперь вы оба находитесь в потерянном времени.")
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await sessions.clear(chat_id, TIME_LOOP_SESSION)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+            events.ending_reached(tg_user_id, TIME_LOOP_QUEST_ID, "myselfUncle")
+            await unsuccess_final_rate(callback.message, 2)
+        except Exception as e:
+            logger.error("Произошла ошибка в myselfUncle: %s", e)
+
+
+    async def unsuccessful(message: Message):
+        try:
+            # tg_user_id: int = int(message.from_user.id)
+            chat_id: int = message.chat.id
+            txt = ("Вам не удалось отгадать загадку с третьего раза и Хранитель молча исчез.\n"
+                   "Прибор больше не включается, Вам не удалось спасти Вашего дядю..")
+            msg = await bot.send_message(chat_id=chat_id, text=txt)
+            await sessions.clear(chat_id, TIME_LOOP_SESSION)
+            await safely_delete_last_message(chat_id, chat_id)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+            events.ending_reached(chat_id, TIME_LOOP_QUEST_ID, "unsuccessful")
+            await unsuccess_final_rate(message, 2)
+        except Exception as e:
+            logger.error("Произошла ошибка в unsuccessful: %s", e)
+
+
+    async def unsuccess_final_rate(message: Message, quest_id):
+        try:
+            chat_id: int = int(message.chat.id)
+            cancel_quest_timers(chat_id)
+            user_data = await database.get_user_data(chat_id)
+            name = user_data['username']
+            quest_data = await catalog.get(quest_id)
+            quest_name = quest_data['name']
+            screen = screens.UNSUCCESS_FINAL.render(name=name, quest_name=quest_name)
+            msg = await bot.send_message(chat_id=chat_id, text=screen.text, reply_markup=screen.reply_markup)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в unsuccess_final_rate: %s", e)
+
+
+    async def success_final_rate(message: Message, quest_id):
+        try:
+            chat_id: int = int(message.chat.id)
+            cancel_quest_timers(chat_id)
+            user_data = await database.get_user_data(chat_id)
+            name = user_data['username']
+            quest_data = await catalog.get(quest_id)
+            quest_name = quest_data['name']
+            timeloop_data = await sessions.get(chat_id, TIME_LOOP_SESSION)
+            rate_count = timeloop_data['rate_count']
+            # сертификат рисуется в пуле процессов, пока отправляется экран концовки и сохраняется прохождение
+            certificate = asyncio.ensure_future(certificates.render(name, quest_name, rate_count + 1))
+            if rate_count == 0:
+                screen = screens.SUCCESS_FINAL_FIRST.render(name=name, quest_name=quest_name)
+            elif rate_count + 1 == 2:
+                screen = screens.SUCCESS_FINAL_SECOND.render(name=name, quest_name=quest_name, rate_count=rate_count + 1)
+            else:
+                screen = screens.SUCCESS_FINAL_AGAIN.render(name=name, quest_name=quest_name, rate_count=rate_count + 1)
+            msg = await bot.send_message(chat_id=chat_id, text=screen.text, reply_markup=screen.reply_markup)
+            await sessions.inc(chat_id, TIME_LOOP_SESSION, 'rate_count')
+            player_stats.record_completion(chat_id, first=rate_count == 0)
+
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+            await send_certificate(chat_id, await certificate, name, quest_name, rate_count + 1)
+
+        except Exception as e:
+            logger.error("Произошла ошибка в success_final_rate: %s", e)
+
+
+    # Сертификат остается в чате при переходах между экранами (kept_messages, а не last_message_ids),
+    # но удаляется вместе с аккаунтом
+    async def send_certificate(chat_id: int, image, name: str, quest_name: str, completions: int):
+        try:
+            if image is not None:
+                msg = await bot.send_photo(chat_id=chat_id,
+                                           photo=BufferedInputFile(image, filename="certificate.png"))
+            else:
+                screen = screens.CERTIFICATE_TEXT.render(name=name, quest_name=quest_name, completions=completions)
+                msg = await bot.send_message(chat_id=chat_id, text=screen.text)
+            await database.keep_message(chat_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в send_certificate: %s", e)
+
+
+    @router.callback_query(lambda query: query.data.startswith("final_like:"))
+    async def final_like(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            quest_id = int(callback.data.split(':')[1])
+            await quest_ratings.vote(tg_user_id, quest_id, "like")
+            screen = screens.RATED_LIKE
+            msg = await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в final_like: %s", e)
+
+
+    @router.callback_query(lambda query: query.data.startswith("final_dislike:"))
+    async def final_dislike(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            chat_id: int = callback.message.chat.id
+            quest_id = int(callback.data.split(':')[1])
+            await quest_ratings.vote(tg_user_id, quest_id, "dislike")
+            screen = screens.RATED_DISLIKE
+            msg = await bot.send_message(tg_user_id, text=screen.text, reply_markup=screen.reply_markup)
+            await safely_delete_last_message(tg_user_id, chat_id)
+            await database.set_last_message_by_user_id(tg_user_id, msg.message_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в final_dislike: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "again_time_loop")
+    async def again_time_loop(callback: CallbackQuery):
+        try:
+            await quest(callback.message)
+        except Exception as e:
+            logger.error("Произошла ошибка в again_time_loop: %s", e)
+
+
+    # --------------------------timers--------------------------
+    # Апдейты таймеров приходят как нажатие кнопки "timer:<kind>"; timer=None - значит, это не таймер
+    @router.callback_query(lambda call: call.data == "timer:riddle_timeout")
+    async def riddle_timeout(callback: CallbackQuery, state: FSMContext, timer: timers.Timer = None):
+        try:
+            if timer is None:
+                return
+            chat_id: int = callback.message.chat.id
+            current_state = await state.get_state()
+            if current_state not in (TimeLoop.Question1.state, TimeLoop.Question2.state, TimeLoop.Question3.state):
+                return
+            screen = screens.TIME_IS_UP
+            msg = await bot.send_message(chat_id=chat_id, text=screen.text)
+            await database.set_last_message_by_user_id(chat_id, msg.message_id)
+            await state.clear()
+            await unsuccessful(callback.message)
+        except Exception as e:
+            logger.error("Произошла ошибка в riddle_timeout: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "timer:quest_reminder")
+    async def quest_reminder(callback: CallbackQuery, timer: timers.Timer = None):
+        try:
+            if timer is None:
+                return
+            screen = screens.QUEST_REMINDER
+            await bot.send_message(callback.message.chat.id, text=screen.text, reply_markup=screen.reply_markup)
+        except Exception as e:
+            logger.error("Произошла ошибка в quest_reminder: %s", e)
+
+
+    @router.callback_query(lambda call: call.data == "timer:quest_expire")
+    async def quest_expire(callback: CallbackQuery, state: FSMContext, timer: timers.Timer = None):
+        try:
+            if timer is None:
+                return
+            await sessions.clear(callback.from_user.id, TIME_LOOP_SESSION)
+            current_state = await state.get_state()
+            if current_state is not None and current_state.startswith("TimeLoop:"):
+                await state.clear()
+        except Exception as e:
+            logger.error("Произошла ошибка в quest_expire: %s", e)
+
+
+    # --------------------------broadcast-----------------------
+    @router.message(Command("broadcast"), lambda message: message.from_user.id in config.admin_ids)
+    async def broadcast_command(message: Message, command: CommandObject):
+        try:
+            if not command.args:
+                await message.answer("Использование: /broadcast текст сообщения")
+                return
+            progress = await broadcaster.start(command.args)
+            await message.answer(f"Рассылка #{progress.broadcast_id} запущена, получателей: {progress.total}")
+        except RuntimeError as e:
+            await message.answer(str(e))
+        except Exception as e:
+            logger.error("Произошла ошибка в broadcast_command: %s", e)
+
+
+    @router.message(Command("broadcast_status"), lambda message: message.from_user.id in config.admin_ids)
+    async def broadcast_status(message: Message):
+        try:
+            if broadcaster.progress is None:
+                await message.answer("Рассылок еще не было")
+            else:
+                await message.answer(str(broadcaster.progress))
+        except Exception as e:
+            logger.error("Произошла ошибка в broadcast_status: %s", e)
+
+
+    # Время ответа Bot API по методам (api_session.TunedSession)
+    @router.message(Command("api_stats"), lambda message: message.from_user.id in config.admin_ids)
+    async def api_stats(message: Message):
+        try:
+            latency = getattr(bot.session, 'latency', None)
+            stats = latency() if latency is not None else {}
+            if not stats:
+                await message.answer("Запросов к Bot API еще не было")
+            else:
+                await message.answer("\n".join(screens.API_STATS_ROW.format(method=method, calls=calls, errors=errors,
+                                                                             avg=avg * 1000, max=max_time * 1000)
+                                                for method, (calls, errors, avg, max_time) in stats.items()))
+        except Exception as e:
+            logger.error("Произошла ошибка в api_stats: %s", e)
+
+
+    # Пользователь заблокировал или разблокировал бота
+    @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED))
+    async def user_blocked_bot(event: ChatMemberUpdated):
+        try:
+            await database.set_blocked_bot(event.from_user.id, True)
+        except Exception as e:
+            logger.error("Произошла ошибка в user_blocked_bot: %s", e)
+
+
+    @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+    async def user_unblocked_bot(event: ChatMemberUpdated):
+        try:
+            await database.set_blocked_bot(event.from_user.id, False)
+        except Exception as e:
+            logger.error("Произошла ошибка в user_unblocked_bot: %s", e)
+
+
+    # ----------------------------------------------------------
+
+    @router.callback_query(lambda call: call.data == "main_menu")
+    async def MMenu(callback: CallbackQuery):
+        try:
+            tg_user_id: int = int(callback.from_user.id)
+            await main_menu(tg_user_id)
+        except Exception as e:
+            logger.error("Произошла ошибка в MMenu: %s", e)
@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, insort
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Звезды (местная валюта) за прохождение квеста на хорошую концовку: первое прохождение квеста и повторные
+STARS_FIRST_COMPLETION = 3
+STARS_REPEAT_COMPLETION = 1
+
+
+class Stats(NamedTuple):
+    completions: int
+    stars: int
+    rank: Optional[int]  # None - игрок еще ничего не прошел или рейтинг еще не загружен
+    players: int
+
+
+class _ScoreCounts:
+    # Дерево Фенвика: сколько игроков набрали ровно s звезд. Число игроков с большим количеством звезд
+    # (то есть место в рейтинге) считается за O(log S), где S - максимум звезд; дерево растет удвоением
+    def __init__(self, size: int = 1024):
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def _grow(self, score: int):
+        size = len(self.tree) - 1
+        if score < size:
+            return
+        while score >= size:
+            size *= 2
+        counts = [self._count(s) for s in range(len(self.tree) - 1)]
+        self.tree = [0] * (size + 1)
+        self.total = 0
+        for s, count in enumerate(counts):
+            if count:
+                self.add(s, count)
+
+    def _count(self, score: int) -> int:
+        return self._prefix(score + 1) - self._prefix(score)
+
+    def _prefix(self, end: int) -> int:
+        # Игроков со звездами в [0, end)
+        result = 0
+        while end > 0:
+            result += self.tree[end]
+            end -= end & -end
+        return result
+
+    def add(self, score: int, delta: int):
+        self._grow(score)
+        self.total += delta
+        i = score + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def above(self, score: int) -> int:
+        return self.total - self._prefix(min(score + 1, len(self.tree) - 1))
+
+
+class PlayerStats:
+    # Статистика игроков: пройденные квесты, звезды и место в рейтинге по звездам.
+    # Всё считается в памяти и обновляется на каждом прохождении: счетчики игрока - dict, место - дерево
+    # Фенвика по количеству звезд, лучшие top_size игроков - отсортированный список. Профиль и таблица
+    # лидеров не делают агрегирующих запросов. В player_stats изменения пишутся накопленными дельтами
+    # раз в flush_interval секунд (как оценки в ratings.QuestRatings), с других инстансов - подтягиваются
+    # из ответа на запись. Одинаковое количество звезд - одно место
+    def __init__(self, database, top_size: int = 10, flush_interval: float = 10.0):
+        self.database = database
+        self.top_size = top_size
+        self.flush_interval = flush_interval
+        self.stats = {}  # tg_user_id -> (completions, stars)
+        self.scores = _ScoreCounts()
+        self.top = []  # (-stars, -completions, tg_user_id), не длиннее top_size
+        self.pending = {}  # tg_user_id -> [completions_delta, stars_delta]
+        self.ready = False
+        self._task = None
+
+    async def create_table(self, schema):
+        # Начальные значения - из счетчика rate_count квеста (прохождения до появления статистики)
+        await self.database.create_player_stats_table(schema.quest_id, schema.counters['rate_count'],
+                                                      STARS_FIRST_COMPLETION, STARS_REPEAT_COMPLETION)
+
+    async def load(self):
+        stats = {}
+        async for row in self.database.iter_player_stats():
+            stats[row['tg_user_id']] = (row['completions'], row['stars'])
+        # Прохождения, случившиеся до загрузки, уже лежат в pending - добавляем их к значениям из базы
+        for tg_user_id, (completions, stars) in self.pending.items():
+            old_completions, old_stars = stats.get(tg_user_id, (0, 0))
+            stats[tg_user_id] = (old_completions + completions, old_stars + stars)
+        self.stats = {}
+        self.scores = _ScoreCounts()
+        self.top = []
+        for tg_user_id, (completions, stars) in stats.items():
+            self._set(tg_user_id, completions, stars)
+        self.ready = True
+        logger.warning("Статистика игроков загружена: %s", len(self.stats))
+
+    # ----------чтение-------------
+    def get(self, tg_user_id: int) -> Stats:
+        completions, stars = self.stats.get(tg_user_id, (0, 0))
+        rank = self.scores.above(stars) + 1 if self.ready and tg_user_id in self.stats else None
+        return Stats(completions, stars, rank, self.scores.total)
+
+    # Лучшие игроки: [(tg_user_id, completions, stars, место), ...]
+    def leaders(self):
+        result = []
+        for stars, completions, tg_user_id in self.top:
+            result.append((tg_user_id, -completions, -stars, self.scores.above(-stars) + 1))
+        return result
+
+    # ----------изменения-------------
+    # Квест пройден на хорошую концовку; first - первое прохождение этого квеста. Возвращает начисленные звезды
+    def record_completion(self, tg_user_id: int, first: bool) -> int:
+        stars = STARS_FIRST_COMPLETION if first else STARS_REPEAT_COMPLETION
+        completions, old_stars = self.stats.get(tg_user_id, (0, 0))
+        self._set(tg_user_id, completions + 1, old_stars + stars)
+        pending = self.pending.setdefault(tg_user_id, [0, 0])
+        pending[0] += 1
+        pending[1] += stars
+        return stars
+
+    # Аккаунт удален (строка player_stats удаляется вместе с остальными данными пользователя)
+    def discard(self, tg_user_id: int):
+        self.pending.pop(tg_user_id, None)
+        self._set(tg_user_id, None, None)
+
+    def _set(self, tg_user_id: int, completions, stars):
+        old = self.stats.pop(tg_user_id, None)
+        left_top = False
+        if old is not None:
+            self.scores.add(old[1], -1)
+            entry = (-old[1], -old[0], tg_user_id)
+            index = bisect_left(self.top, entry)
+            if index < len(self.top) and self.top[index] == entry:
+                del self.top[index]
+                left_top = True
+        if stars is not None:
+            self.stats[tg_user_id] = (completions, stars)
+            self.scores.add(stars, 1)
+            entry = (-stars, -completions, tg_user_id)
+            if len(self.top) < self.top_size or entry < self.top[-1]:
+                insort(self.top, entry)
+                del self.top[self.top_size:]
+        if left_top and len(self.top) < min(self.top_size, len(self.stats)):
+            # Игрок ушел из лучших вниз или удален - место занимает следующий (редко, полный проход)
+            self._rebuild_top()
+
+    def _rebuild_top(self):
+        self.top = heapq.nsmallest(self.top_size, ((-stars, -completions, tg_user_id)
+                                                   for tg_user_id, (completions, stars) in self.stats.items()))
+
+    # ----------фоновая запись-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        deltas, self.pending = self.pending, {}
+        try:
+            rows = await self.database.apply_player_stats_deltas(deltas)
+        except Exception as e:
+            # Возвращаем дельты обратно, чтобы записать их в следующий раз
+            for tg_user_id, (completions, stars) in deltas.items():
+                pending = self.pending.setdefault(tg_user_id, [0, 0])
+                pending[0] += completions
+                pending[1] += stars
+            logger.error("Ошибка при записи статистики игроков: %s", e)
+            return
+        # Значения из базы учитывают прохождения на других инстансах; добавляем то, что накопилось за время записи
+        for row in rows:
+            pending = self.pending.get(row['tg_user_id'], [0, 0])
+            if row['tg_user_id'] in self.stats or pending != [0, 0]:
+                self._set(row['tg_user_id'], row['completions'] + pending[0], row['stars'] + pending[1])
@@ -0,0 +1,247 @@
+# Нагрузочный тест: много игроков одновременно проходят квест TimeLoop.
+#
+# Запуск: python load_benchmark.py [--players 200] [--scenario fault_scenarios/degraded.json]
+#
+# Приложение собирается через main.create_app с фейками базы и Bot API из quest_explorer (без сети и postgres),
+# апдейты идут через настоящий dp.feed_update. Каждый игрок начинает с "buy:2" и нажимает случайные кнопки
+# из последних сообщений бота (сначала те, что еще не нажимал; в состояниях с вводом текста чаще отвечает
+# правильно), пока не закончит квест.
+# Считается время обработки каждого апдейта (p50/p95/p99/max), ошибки в логе, апдейты, отклоненные
+# ограничением нагрузки, и игроки, которые застряли - после апдейта им нечего нажать.
+# Со сценарием сбоев (faults.py) тест идет в три фазы: без сбоев, со сбоями и снова без сбоев (восстановление).
+# Апдейты приходят JSON-строкой и разбираются json_loads сессии, как ответ getUpdates. --profile - профиль
+# выполнения (runtime.py), --compare - прогон в профилях default и fast и разница между ними
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+import analytics
+import handlers
+import main
+import runtime
+from config import load_config
+from quest_explorer import TERMINAL_CALLBACKS, TEXT_INPUTS, Counters, ErrorCounter, RecordingDatabase, RecordingSession
+
+FIRST_PLAYER_ID = 1_000_000
+RIGHT_ANSWER_CHANCE = 0.8
+
+
+class BenchSession(RecordingSession):
+    # Кнопки отправленных сообщений - отдельно по чатам (игроки играют одновременно)
+    def __init__(self, counters: Counters, **kwargs):
+        super().__init__(counters, **kwargs)
+        self.buttons = defaultdict(list)  # chat_id -> callback_data
+
+    async def make_request(self, bot, method, timeout=None):
+        result = await super().make_request(bot, method, timeout)
+        self.buttons[getattr(method, 'chat_id', None)].extend(self.sent_buttons)
+        self.sent_buttons = []
+        self.sent_methods = []
+        return result
+
+
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.finished = 0
+        self.stuck = 0
+        self.step_limit = 0
+        self.endings = 0
+        self.errors = 0
+        self.shed = 0
+        self.elapsed = 0.0
+        self.cpu = 0.0
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Benchmark:
+    def __init__(self, players: int, think_ms: float, max_steps: int, scenario: str = "", seed: int = 1,
+                 profile: str = runtime.DEFAULT):
+        self.players = players
+        self.profile = profile
+        self.think = think_ms / 1000
+        self.max_steps = max_steps
+        self.rng = random.Random(seed)
+        self.counters = Counters()
+        self.database = RecordingDatabase(self.counters)
+        self.session = BenchSession(self.counters, **runtime.session_json(profile))
+        # защита от флуда не мешает игрокам, которые нажимают кнопки без пауз
+        config = load_config(dotenv=False)._replace(
+            TELEGRAM_BOT_TOKEN="123456:benchmark",
+            throttle_message_rate=1000.0, throttle_message_burst=1000,
+            throttle_callback_rate=1000.0, throttle_callback_burst=1000,
+            fault_scenario=scenario,
+            runtime_profile=profile,
+        )
+        self.app = main.create_app(config, database=self.database, session=self.session)
+        self.faults = self.app.shared.faults
+        self.update_ids = iter(range(1, 1 << 62))
+        self.errors = ErrorCounter()
+
+    # ---------------- апдейты ----------------
+    def _user(self, player_id: int):
+        return {"id": player_id, "is_bot": False, "first_name": f"Игрок {player_id}"}
+
+    def parse(self, raw: str) -> Update:
+        return Update.model_validate(self.session.json_loads(raw), context={"bot": self.app.bot})
+
+    def callback_update(self, player_id: int, data: str) -> str:
+        return json.dumps({
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)), "from": self._user(player_id), "chat_instance": "benchmark",
+                "data": data,
+                "message": {"message_id": 1, "date": 0, "chat": {"id": player_id, "type": "private"}, "text": "..."},
+            },
+        })
+
+    def message_update(self, player_id: int, text: str) -> str:
+        return json.dumps({
+            "update_id": next(self.update_ids),
+            "message": {"message_id": next(self.update_ids), "date": 0, "chat": {"id": player_id, "type": "private"},
+                        "from": self._user(player_id), "text": text},
+        })
+
+    # ---------------- игрок ----------------
+    async def play(self, player_id: int, phase: Phase):
+        rng = random.Random(self.rng.random())
+        key = StorageKey(bot_id=self.app.bot.id, chat_id=player_id, user_id=player_id)
+        name, update = "buy:2", self.callback_update(player_id, "buy:2")
+        pressed = set()
+        for _ in range(self.max_steps):
+            self.session.buttons[player_id] = []
+            started = time.perf_counter()
+            await self.app.dp.feed_update(self.app.bot, self.parse(update))
+            phase.latencies.append(time.perf_counter() - started)
+            if name in TERMINAL_CALLBACKS:
+                phase.finished += 1
+                return
+
+            state = await self.app.storage.get_state(key)
+            buttons = [data for data in self.session.buttons.pop(player_id, ())
+                       if data in handlers.TIME_LOOP_CALLBACKS or data in TERMINAL_CALLBACKS]
+            answers = TEXT_INPUTS.get(state)
+            if answers and (not buttons or rng.random() < 0.5):
+                text = answers[0] if rng.random() < RIGHT_ANSWER_CHANCE else answers[1]
+                name, update = state, self.message_update(player_id, text)
+            elif buttons:
+                name = rng.choice([data for data in buttons if data not in pressed] or buttons)
+                pressed.add(name)
+                update = self.callback_update(player_id, name)
+            else:
+                phase.stuck += 1
+                return
+            if self.think:
+                await asyncio.sleep(rng.uniform(0, self.think))
+        phase.step_limit += 1
+
+    async def run_phase(self, name: str, first_player: int) -> Phase:
+        phase = Phase(name)
+        events = self.app.shared.events
+        shed_before = self.app.shared.admission_controller.shed
+        self.errors.count = 0
+        self.counters.reset()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(self.play(first_player + i, phase) for i in range(self.players)))
+        phase.elapsed = time.perf_counter() - started
+        phase.cpu = time.process_time() - cpu_started
+        phase.errors = self.errors.count
+        phase.shed = self.app.shared.admission_controller.shed - shed_before
+        phase.endings = sum(1 for event in events.buffer if event[1] == analytics.ENDING_REACHED)
+        events.buffer.clear()
+        return phase
+
+    async def run(self):
+        users = self.database.state['users']
+        for player_id in range(FIRST_PLAYER_ID, FIRST_PLAYER_ID + 3 * self.players):
+            users[player_id] = {'tg_user_id': player_id, 'username': f"Игрок {player_id}", 'paid_quest_ids': []}
+
+        root = logging.getLogger()
+        root.addHandler(self.errors)
+        phases = []
+        try:
+            if self.faults is None:
+                phases.append(await self.run_phase("без сбоев", FIRST_PLAYER_ID))
+            else:
+                for index, (name, enabled) in enumerate((("без сбоев", False), ("сбои", True),
+                                                         ("восстановление", False))):
+                    self.faults.enabled = enabled
+                    phases.append(await self.run_phase(name, FIRST_PLAYER_ID + index * self.players))
+        finally:
+            root.removeHandler(self.errors)
+        return phases
+
+    # ---------------- отчет ----------------
+    def report(self, phases):
+        print(f"профиль {self.profile} ({' + '.join(runtime.describe(self.profile))}), игроков: {self.players}, "
+              f"пауза до {self.think * 1000:.0f} мс, не больше {self.max_steps} шагов")
+        print(f"{'фаза':<16}{'апдейтов':>9}{'в сек':>8}{'CPU мс':>8}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+              f"{'max мс':>9}{'ошибок':>8}{'отказ':>7}{'прошли':>8}{'концовок':>9}{'застряли':>9}{'лимит':>7}")
+        for phase in phases:
+            latencies = phase.latencies
+            print(f"{phase.name:<16}{len(latencies):>9}{len(latencies) / max(phase.elapsed, 1e-9):>8.0f}"
+                  f"{phase.cpu * 1000 / max(len(latencies), 1):>8.2f}{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>9.1f}{max(latencies, default=0) * 1000:>9.1f}"
+                  f"{phase.errors:>8}{phase.shed:>7}{phase.finished:>8}{phase.endings:>9}{phase.stuck:>9}"
+                  f"{phase.step_limit:>7}")
+        if self.faults is not None:
+            print(f"\nсценарий: {self.faults.path}")
+            for side, injector in (("база", self.faults.database), ("Bot API", self.faults.bot_api)):
+                calls, errors, timeouts = (sum(values) for values in zip(*injector.stats.values())) \
+                    if injector.stats else (0, 0, 0)
+                print(f"{side}: запросов со сбоями {calls}, ошибок {errors}, таймаутов {timeouts}")
+
+
+async def benchmark(args, profile: str):
+    bench = Benchmark(args.players, args.think_ms, args.max_steps, args.scenario, args.seed, profile)
+    phases = await bench.run()
+    bench.report(phases)
+    return phases
+
+
+# Разница профилей по первой фазе (без сбоев): пропускная способность, CPU на апдейт и задержки
+def compare(results):
+    (base_name, base), (fast_name, fast) = results
+    base, fast = base[0], fast[0]
+    print(f"\n{fast_name} относительно {base_name}:")
+    for title, before, after in (
+            ("апдейтов в секунду", len(base.latencies) / base.elapsed, len(fast.latencies) / fast.elapsed),
+            ("CPU на апдейт", base.cpu / len(base.latencies), fast.cpu / len(fast.latencies)),
+            ("p50", percentile(base.latencies, 0.5), percentile(fast.latencies, 0.5)),
+            ("p99", percentile(base.latencies, 0.99), percentile(fast.latencies, 0.99))):
+        print(f"  {title}: {(after / before - 1) * 100:+.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный тест квеста TimeLoop")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--think-ms", type=float, default=20)
+    parser.add_argument("--max-steps", type=int, default=80)
+    parser.add_argument("--scenario", default="", help="файл сценария сбоев (faults.py)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", default=runtime.DEFAULT, choices=(runtime.DEFAULT, runtime.FAST))
+    parser.add_argument("--compare", action="store_true", help="прогнать в профилях default и fast")
+    args = parser.parse_args()
+    profiles = (runtime.DEFAULT, runtime.FAST) if args.compare else (args.profile,)
+    results = []
+    for profile in profiles:
+        results.append((profile, runtime.run(benchmark(args, profile), profile)))
+        print()
+    if args.compare:
+        compare(results)
+    sys.exit(0 if all(phase.latencies for _, phases in results for phase in phases) else 1)
@@ -0,0 +1,30 @@
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MediaRegistry:
+    # Файлы, уже загруженные в Telegram: путь -> file_id, отдельно для каждого бота.
+    # file_id действителен только для бота, который загрузил файл, поэтому у каждого бота свое пространство
+    # имен (bot_id -> {путь: file_id}). Реестр один на процесс: сколько бы ботов ни работало, каждый файл
+    # лежит на диске в одном экземпляре и загружается каждым ботом не больше одного раза
+    def __init__(self):
+        self.file_ids = {}  # bot_id -> {путь: file_id}
+        self.uploads = 0
+        self.hits = 0
+
+    def get(self, bot_id: int, path: str) -> Optional[str]:
+        file_id = self.file_ids.get(bot_id, {}).get(path)
+        if file_id is not None:
+            self.hits += 1
+        return file_id
+
+    def remember(self, bot_id: int, path: str, file_id: str):
+        self.file_ids.setdefault(bot_id, {})[path] = file_id
+        self.uploads += 1
+
+    # file_id перестал приниматься Telegram - в следующий раз файл загрузится заново
+    def forget(self, bot_id: int, path: str):
+        if self.file_ids.get(bot_id, {}).pop(path, None) is not None:
+            logger.warning("file_id для %s (бот %s) больше не действителен", path, bot_id)
@@ -0,0 +1,89 @@
+import logging
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'users_membership'
+
+
+class MemberIndex:
+    # Множество tg_user_id зарегистрированных пользователей в памяти: отсортированный массив int64
+    # (8 байт на пользователя) и бинарный поиск. Загружается при старте потоком из базы,
+    # обновляется при регистрации/удалении, а изменения с других инстансов приходят через LISTEN/NOTIFY.
+    # Пока индекс не загружен (или соединение LISTEN потеряно), проверка идет в базу
+    def __init__(self, database):
+        self.database = database
+        self.ids = array('q')
+        self.ready = False
+        self._listener = None
+        self._backlog = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _find(self, tg_user_id: int):
+        index = bisect_left(self.ids, tg_user_id)
+        return index, index < len(self.ids) and self.ids[index] == tg_user_id
+
+    def add(self, tg_user_id: int):
+        index, found = self._find(tg_user_id)
+        if not found:
+            self.ids.insert(index, tg_user_id)
+
+    def discard(self, tg_user_id: int):
+        index, found = self._find(tg_user_id)
+        if found:
+            del self.ids[index]
+
+    async def contains(self, tg_user_id: int) -> bool:
+        if not self.ready:
+            return await self.database.user_exists(tg_user_id)
+        return self._find(tg_user_id)[1]
+
+    async def start(self):
+        try:
+            # Сначала подписываемся, потом загружаем; уведомления, пришедшие во время загрузки,
+            # копятся в _backlog и применяются к загруженному массиву по порядку
+            self._backlog = []
+            await self.database.create_users_notify_trigger(NOTIFY_CHANNEL)
+            self._listener = await self.database.listen(NOTIFY_CHANNEL, self._on_notify)
+            self._listener.add_termination_listener(self._on_listener_lost)
+            ids = array('q')
+            async for tg_user_id in self.database.iter_user_ids():
+                ids.append(tg_user_id)
+            self.ids = ids
+            backlog, self._backlog = self._backlog, None
+            for payload in backlog:
+                self._apply(payload)
+            self.ready = True
+            logger.warning("Индекс пользователей загружен: %s", len(self.ids))
+        except Exception as e:
+            self.ready = False
+            self._backlog = None
+            logger.error("Ошибка при загрузке индекса пользователей: %s", e)
+
+    async def stop(self):
+        self.ready = False
+        if self._listener is not None:
+            self._listener.remove_termination_listener(self._on_listener_lost)
+            await self._listener.close()
+            self._listener = None
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        if self._backlog is not None:
+            self._backlog.append(payload)
+        else:
+            self._apply(payload)
+
+    def _apply(self, payload: str):
+        tg_user_id = int(payload[1:])
+        if payload[0] == '+':
+            self.add(tg_user_id)
+        else:
+            self.discard(tg_user_id)
+
+    def _on_listener_lost(self, connection):
+        # Без уведомлений индекс может устареть - до перезапуска проверяем через базу
+        logger.error("Соединение LISTEN потеряно, проверка пользователей идет через базу")
+        self.ready = False
@@ -0,0 +1,37 @@
+from typing import Optional
+
+# Telegram Stars: для цифровых товаров provider_token не нужен, цена - целое число звезд
+STARS_CURRENCY = "XTR"
+
+PAYLOAD_PREFIX = "quest:"
+
+
+# payload счета (invoice_payload) - по нему pre_checkout_query и successful_payment находят квест
+def quest_payload(quest_id: int) -> str:
+    return f"{PAYLOAD_PREFIX}{quest_id}"
+
+
+def parse_quest_payload(payload: str) -> Optional[int]:
+    if not payload or not payload.startswith(PAYLOAD_PREFIX):
+        return None
+    try:
+        return int(payload[len(PAYLOAD_PREFIX):])
+    except ValueError:
+        return None
+
+
+# Подпись цены в карточке квеста. amount - в минимальных единицах валюты (для звезд - звезды)
+def price_label(quest_data, currency: str) -> str:
+    if quest_data['is_free']:
+        return "free"
+    amount = quest_data.get('price') or 0
+    if currency == STARS_CURRENCY:
+        return f"{amount} ⭐"
+    return f"{amount / 100:.2f} {currency}"
+
+
+# Апдейты платежей не отбрасываются ограничением нагрузки и защитой от флуда:
+# на pre_checkout_query Telegram ждет ответа 10 секунд, а successful_payment - уже списанные деньги
+def is_payment_update(update) -> bool:
+    return update.pre_checkout_query is not None or (
+        update.message is not None and update.message.successful_payment is not None)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Bot API позволяет удалить не больше 100 сообщений одним запросом
+DELETE_MESSAGES_BATCH = 100
+
+
+class AccountPurgeQueue:
+    # Фоновое удаление аккаунтов. Хендлер только ставит задачу в очередь (и записывает ее в account_purges,
+    # чтобы она не потерялась при перезапуске), а воркер удаляет все данные пользователя одной транзакцией,
+    # удаляет отслеживаемые сообщения в чате пачками и убирает пользователя из кешей в памяти.
+    # Неудачное удаление повторяется с растущей паузой (retry_delay, удваивается до max_retry_delay);
+    # до успешного удаления пользователь остается в pending, и регистрация его ждет
+    def __init__(self, bot, database, retry_delay: float = 5.0, max_retry_delay: float = 300.0):
+        self.bot = bot
+        self.database = database
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.queue = asyncio.Queue()
+        self.pending = {}  # tg_user_id -> asyncio.Event (выставляется, когда удаление выполнено)
+        self.attempts = {}  # tg_user_id -> число неудачных попыток
+        self.evictors = []
+        self._task = None
+
+    # Функция (tg_user_id, chat_id), которая убирает пользователя из кеша в памяти. Может быть корутиной.
+    # С with_marks=True функция получает третьим аргументом удаленные оценки [(quest_id, mark), ...]
+    def register_evictor(self, evictor, with_marks: bool = False):
+        self.evictors.append((evictor, with_marks))
+
+    async def enqueue(self, tg_user_id: int, chat_id: int):
+        if tg_user_id in self.pending:
+            return
+        self.pending[tg_user_id] = asyncio.Event()
+        await self.database.add_account_purge(tg_user_id, chat_id)
+        self.queue.put_nowait((tg_user_id, chat_id))
+
+    # Дождаться удаления аккаунта, если оно еще в очереди (например, перед повторной регистрацией).
+    # False - удаление не закончилось за timeout секунд
+    async def wait_for(self, tg_user_id: int, timeout: Optional[float] = None) -> bool:
+        done = self.pending.get(tg_user_id)
+        if done is None:
+            return True
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def is_pending(self, tg_user_id: int) -> bool:
+        return tg_user_id in self.pending
+
+    async def start(self):
+        for row in await self.database.get_account_purges():
+            if row['tg_user_id'] not in self.pending:
+                self.pending[row['tg_user_id']] = asyncio.Event()
+                self.queue.put_nowait((row['tg_user_id'], row['chat_id']))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            tg_user_id, chat_id = await self.queue.get()
+            try:
+                await self.purge(tg_user_id, chat_id)
+            except Exception as e:
+                # Задача остается в account_purges (и выполнится после перезапуска), а пока - повтор с паузой
+                attempt = self.attempts[tg_user_id] = self.attempts.get(tg_user_id, 0) + 1
+                delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+                logger.error("Ошибка при удалении аккаунта %s (попытка %s, повтор через %.0f с): %s",
+                             tg_user_id, attempt, delay, e)
+                asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, (tg_user_id, chat_id))
+            else:
+                self.attempts.pop(tg_user_id, None)
+                done = self.pending.pop(tg_user_id, None)
+                if done is not None:
+                    done.set()
+            finally:
+                self.queue.task_done()
+
+    async def purge(self, tg_user_id: int, chat_id: int):
+        message_ids, marks = await self.database.delete_account(tg_user_id)
+        for evictor, with_marks in self.evictors:
+            try:
+                result = evictor(tg_user_id, chat_id, marks) if with_marks else evictor(tg_user_id, chat_id)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error("Ошибка при очистке кеша для пользователя %s: %s", tg_user_id, e)
+        for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH):
+            try:
+                await self.bot.delete_messages(chat_id=chat_id,
+                                               message_ids=message_ids[start:start + DELETE_MESSAGES_BATCH])
+            except Exception:
+                # Часть сообщений могла быть уже удалена или слишком старая - это не ошибка удаления аккаунта
+                continue
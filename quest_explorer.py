@@ -0,0 +1,553 @@
+# Обход квеста TimeLoop с подсчетом стоимости каждого перехода.
+#
+# Запуск: python quest_explorer.py
+#
+# Приложение собирается через main.create_app с записывающими фейками вместо базы и Bot API, апдейты проходят
+# через настоящий dp.feed_update (все middleware и хендлеры). Начиная с кнопки "buy:2", обходятся все достижимые состояния квеста:
+# нажимаются кнопки из последних отправленных сообщений, а в состояниях с вводом текста отправляются
+# правильный и неправильный ответ. Для каждого перехода считаются запросы в базу, вызовы Bot API
+# и отправленные байты. Если какой-то переход превышает бюджет, какая-то концовка недостижима или в логе
+# есть ошибки - код возврата 1. Отдельно проверяется покупка платного квеста (счет, pre_checkout_query и повтор successful_payment)
+# и inline-поиск (ответ без запросов в базу), а api_session.TunedSession - на локальном заменителе сервера Bot API
+import asyncio
+import copy
+import itertools
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import NamedTuple
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, FSInputFile, BufferedInputFile, InlineKeyboardMarkup, Message, Update, User
+
+import analytics
+import api_session
+import handlers
+import main
+import payments
+import screens
+from config import load_config
+from database import MAX_TRACKED_MESSAGES
+from quest_sessions import COUNTERS_SIZE
+
+USER_ID = 100500
+USERNAME = "Тестер"
+QUEST = {'id': 2, 'name': "Петля времени", 'description': "", 'is_free': True, 'likes': 0, 'dislikes': 0}
+PAID_QUEST = {'id': 3, 'name': "Платный квест", 'description': "", 'is_free': False, 'price': 50,
+              'likes': 0, 'dislikes': 0}
+CHARGE_ID = "explorer-charge"
+
+# Ввод текста в состояниях FSM: состояние -> варианты ответа
+TEXT_INPUTS = {
+    "TimeLoop:Code": ("6142", "0000"),
+    "TimeLoop:Question1": ("время", "не знаю"),
+    "TimeLoop:Question2": ("вчера", "не знаю"),
+    "TimeLoop:Question3": ("сознание", "не знаю"),
+}
+# Кнопки, после которых квест закончен - переход измеряется, но дальше не обходится
+TERMINAL_CALLBACKS = {"again_time_loop", "final_like:2", "final_dislike:2", "main_menu"}
+ENDINGS = {"anomaly", "rejection", "myselfUncle", "use_device", "no_key", "unsuccessful"}
+
+
+class Budget(NamedTuple):
+    db: int
+    api: int
+    bytes: int
+
+
+# Бюджет перехода: запросы в базу, вызовы Bot API, байты в запросах к Bot API.
+# Фотографии в бюджет не входят (их размер зависит от файлов в uploads) и показываются отдельно
+DEFAULT_BUDGET = Budget(db=4, api=3, bytes=1536)
+BUDGETS = {
+    "TimeLoop:Code": Budget(db=8, api=5, bytes=1536),
+    "TimeLoop:Question1": Budget(db=8, api=4, bytes=1536),
+    "TimeLoop:Question2": Budget(db=8, api=4, bytes=1536),
+    "TimeLoop:Question3": Budget(db=8, api=4, bytes=1536),
+    "again_time_loop": Budget(db=5, api=4, bytes=1536),
+    # первый запуск: загрузка каталога и квестов пользователя, бесплатный квест добавляется в "Мои квесты"
+    "buy:2": Budget(db=7, api=3, bytes=1536),
+    # хорошая концовка: сообщение, сертификат (здесь - текстом, без Pillow) и оценка квеста
+    "anomaly": Budget(db=10, api=4, bytes=1536),
+    "myselfUncle": Budget(db=7, api=3, bytes=1536),
+    "rejection": Budget(db=7, api=3, bytes=1536),
+    "use_device": Budget(db=8, api=3, bytes=1536),
+    "use_diary": Budget(db=10, api=5, bytes=1536),
+}
+
+
+class Counters:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.db = 0
+        self.api = 0
+        self.bytes = 0
+        self.files = 0
+        self.calls = []
+
+    def as_budget(self) -> Budget:
+        return Budget(self.db, self.api, self.bytes)
+
+
+class RecordingDatabase:
+    # Фейк AsyncDatabase в памяти. Каждый вызов метода - один запрос в базу
+    # (в AsyncDatabase каждый из этих методов выполняет ровно один запрос)
+    def __init__(self, counters: Counters):
+        self.counters = counters
+        self.state = {
+            'users': {USER_ID: {'tg_user_id': USER_ID, 'username': USERNAME, 'paid_quest_ids': [QUEST['id']]}},
+            'quests': {QUEST['id']: dict(QUEST), PAID_QUEST['id']: dict(PAID_QUEST)},
+            'entitlements': {},  # (tg_user_id, quest_id) -> source
+            'payments': {},  # charge_id -> (tg_user_id, quest_id)
+            'refunds': {},  # charge_id -> refund_status
+            'sessions': {},
+            'messages': {},
+            'kept': {},
+            'ratings': {},
+        }
+
+    def _record(self, name: str):
+        self.counters.db += 1
+        self.counters.calls.append("db." + name)
+
+    def snapshot(self):
+        return copy.deepcopy(self.state)
+
+    def restore(self, state):
+        self.state = copy.deepcopy(state)
+
+    async def user_exists(self, tg_user_id: int):
+        self._record('user_exists')
+        return tg_user_id in self.state['users']
+
+    async def get_user_data(self, tg_user_id: int):
+        self._record('get_user_data')
+        return self.state['users'].get(tg_user_id)
+
+    async def get_all_quest(self):
+        self._record('get_all_quest')
+        return list(self.state['quests'].values())
+
+    async def get_quest_data_by_id(self, quest_id: int):
+        self._record('get_quest_data_by_id')
+        return self.state['quests'].get(quest_id)
+
+    async def get_last_messages_by_user_id(self, tg_user_id: int):
+        self._record('get_last_messages_by_user_id')
+        return list(self.state['messages'].get(tg_user_id, []))
+
+    async def set_last_message_by_user_id(self, tg_user_id: int, message_id: int):
+        self._record('set_last_message_by_user_id')
+        messages = self.state['messages'].setdefault(tg_user_id, [])
+        if message_id not in messages:
+            messages.append(message_id)
+            del messages[:-MAX_TRACKED_MESSAGES]
+
+    async def clear_last_message_ids_by_user_id(self, tg_user_id: int):
+        self._record('clear_last_message_ids_by_user_id')
+        self.state['messages'].pop(tg_user_id, None)
+
+    async def keep_message(self, tg_user_id: int, message_id: int):
+        self._record('keep_message')
+        self.state['kept'].setdefault(tg_user_id, []).append(message_id)
+
+    async def init_quest_session(self, tg_user_id: int, quest_id: int):
+        self._record('init_quest_session')
+        # как ON CONFLICT DO NOTHING в базе: существующая сессия (и ее флаги) не меняется
+        self.state['sessions'].setdefault((tg_user_id, quest_id), {'flags': 0, 'counters': [0] * COUNTERS_SIZE})
+
+    async def get_quest_session(self, tg_user_id: int, quest_id: int, primary: bool = False):
+        self._record('get_quest_session')
+        session = self.state['sessions'].get((tg_user_id, quest_id))
+        return copy.deepcopy(session)
+
+    async def set_quest_session_flag(self, tg_user_id: int, quest_id: int, bit: int, value: bool):
+        self._record('set_quest_session_flag')
+        session = self.state['sessions'].get((tg_user_id, quest_id))
+        if session is not None:
+            mask = 1 << bit
+            session['flags'] = session['flags'] | mask if value else session['flags'] & ~mask
+
+    async def inc_quest_session_counter(self, tg_user_id: int, quest_id: int, index: int):
+        self._record('inc_quest_session_counter')
+        session = self.state['sessions'].get((tg_user_id, quest_id))
+        if session is not None:
+            session['counters'][index] = min(session['counters'][index] + 1, 32767)
+
+    async def clear_quest_session(self, tg_user_id: int, quest_id: int, keep_counters):
+        self._record('clear_quest_session')
+        session = self.state['sessions'].get((tg_user_id, quest_id))
+        if session is not None:
+            session['flags'] = 0
+            session['counters'] = [value if i in keep_counters else 0 for i, value in enumerate(session['counters'])]
+
+    async def set_quest_rating(self, tg_user_id: int, quest_id: int, mark: int):
+        self._record('set_quest_rating')
+        old_mark = self.state['ratings'].get((tg_user_id, quest_id))
+        self.state['ratings'][(tg_user_id, quest_id)] = mark
+        return old_mark
+
+    async def get_entitlements(self, tg_user_id: int):
+        self._record('get_entitlements')
+        return [quest_id for user_id, quest_id in self.state['entitlements'] if user_id == tg_user_id]
+
+    async def grant_entitlement(self, tg_user_id: int, quest_id: int, source: str):
+        self._record('grant_entitlement')
+        return self.state['entitlements'].setdefault((tg_user_id, quest_id), source) == source
+
+    async def record_payment(self, tg_user_id: int, quest_id: int, charge_id: str, provider_charge_id: str,
+                             amount: int, currency: str):
+        self._record('record_payment')
+        if charge_id in self.state['payments']:
+            return False, False
+        self.state['payments'][charge_id] = (tg_user_id, quest_id)
+        granted = (tg_user_id, quest_id) not in self.state['entitlements']
+        self.state['entitlements'].setdefault((tg_user_id, quest_id), 'payment')
+        return True, granted
+
+    async def set_payment_refund(self, charge_id: str, status: str):
+        self._record('set_payment_refund')
+        self.state['refunds'][charge_id] = status
+
+    def __getattr__(self, name):
+        # Метод, которого нет в фейке: новый запрос в базу нужно добавить сюда, а не молча вернуть None
+        raise AttributeError(f"RecordingDatabase: нет метода {name}")
+
+
+class ErrorCounter(logging.Handler):
+    # Ошибки в логе: хендлеры ловят исключения сами, поэтому сбой (например, метод, которого нет
+    # в RecordingDatabase) виден только здесь
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+        self.messages = []
+
+    def emit(self, record):
+        self.count += 1
+        if len(self.messages) < 10:
+            self.messages.append(record.getMessage())
+
+
+class RecordingSession(screens.ScreenSession):
+    # Сессия бота без сети: форма запроса собирается как при настоящей отправке, считаются вызовы и байты
+    def __init__(self, counters: Counters, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = counters
+        self._message_ids = itertools.count(1)
+        self.sent_buttons = []  # callback_data кнопок из отправленных сообщений
+        self.sent_methods = []  # отправленные методы Bot API
+
+    async def make_request(self, bot, method, timeout=None):
+        form = self.build_form_data(bot, method)
+        for _, _, value in form._fields:
+            if isinstance(value, str):
+                self.counters.bytes += len(value.encode())
+        for value in method.model_dump(warnings=False).values():
+            if isinstance(value, FSInputFile) and os.path.exists(value.path):
+                self.counters.files += os.path.getsize(value.path)
+            elif isinstance(value, BufferedInputFile):
+                self.counters.files += len(value.data)
+        self.counters.api += 1
+        self.counters.calls.append("api." + method.__api_method__)
+        self.sent_methods.append(method)
+        markup = getattr(method, 'reply_markup', None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            self.sent_buttons.extend(button.callback_data for row in markup.inline_keyboard for button in row
+                                     if button.callback_data is not None)
+
+        if method.__returning__ is User:
+            return User(id=bot.id, is_bot=True, first_name="explorer", username="explorer_bot")
+        if method.__returning__ is Message:
+            return Message(message_id=next(self._message_ids), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=getattr(method, 'text', None))
+        return True
+
+    async def close(self):
+        pass
+
+
+class Explorer:
+    def __init__(self, max_states=5000):
+        self.max_states = max_states
+        self.counters = Counters()
+        self.database = RecordingDatabase(self.counters)
+        self.session = RecordingSession(self.counters)
+        config = load_config(dotenv=False)._replace(TELEGRAM_BOT_TOKEN="123456:explorer")
+        self.app = main.create_app(config, database=self.database, session=self.session)
+        self.key = StorageKey(bot_id=self.app.bot.id, chat_id=USER_ID, user_id=USER_ID)
+        self.update_ids = itertools.count(1)
+        self.costs = defaultdict(list)  # переход -> [Budget, ...]
+        self.files = defaultdict(int)  # переход -> байт фотографий (максимум)
+        self.worst_calls = {}  # переход -> вызовы самого дорогого прохода
+        self.buttons = []
+        self.endings = set()
+        self.paths = 0
+        self.payment_errors = []
+        self.inline_errors = []
+        self.errors = ErrorCounter()
+
+    # ---------------- состояние мира ----------------
+    async def snapshot(self):
+        return (self.database.snapshot(), await self.app.storage.get_state(self.key),
+                copy.deepcopy(await self.app.storage.get_data(self.key)))
+
+    async def restore(self, snapshot):
+        db_state, fsm_state, fsm_data = snapshot
+        self.database.restore(db_state)
+        await self.app.storage.set_state(self.key, fsm_state)
+        await self.app.storage.set_data(self.key, copy.deepcopy(fsm_data))
+
+    # ---------------- апдейты ----------------
+    def _user(self):
+        return {"id": USER_ID, "is_bot": False, "first_name": USERNAME}
+
+    def _chat(self):
+        return {"id": USER_ID, "type": "private"}
+
+    def callback_update(self, data: str) -> Update:
+        return Update.model_validate({
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)), "from": self._user(), "chat_instance": "explorer", "data": data,
+                "message": {"message_id": 1, "date": 0, "chat": self._chat(), "text": "..."},
+            },
+        }, context={"bot": self.app.bot})
+
+    def message_update(self, text: str) -> Update:
+        return Update.model_validate({
+            "update_id": next(self.update_ids),
+            "message": {"message_id": next(self.update_ids), "date": 0, "chat": self._chat(),
+                        "from": self._user(), "text": text},
+        }, context={"bot": self.app.bot})
+
+    def pre_checkout_update(self, quest_id: int, amount: int) -> Update:
+        return Update.model_validate({
+            "update_id": next(self.update_ids),
+            "pre_checkout_query": {
+                "id": str(next(self.update_ids)), "from": self._user(), "currency": payments.STARS_CURRENCY,
+                "total_amount": amount, "invoice_payload": payments.quest_payload(quest_id),
+            },
+        }, context={"bot": self.app.bot})
+
+    def payment_update(self, quest_id: int, amount: int, charge_id: str = CHARGE_ID) -> Update:
+        return Update.model_validate({
+            "update_id": next(self.update_ids),
+            "message": {"message_id": next(self.update_ids), "date": 0, "chat": self._chat(), "from": self._user(),
+                        "successful_payment": {"currency": payments.STARS_CURRENCY, "total_amount": amount,
+                                               "invoice_payload": payments.quest_payload(quest_id),
+                                               "telegram_payment_charge_id": charge_id,
+                                               "provider_payment_charge_id": ""}},
+        }, context={"bot": self.app.bot})
+
+    def inline_update(self, query: str) -> Update:
+        return Update.model_validate({
+            "update_id": next(self.update_ids),
+            "inline_query": {"id": str(next(self.update_ids)), "from": self._user(), "query": query, "offset": ""},
+        }, context={"bot": self.app.bot})
+
+    async def step(self, name: str, update: Update):
+        # Один переход: апдейт через диспетчер, на выходе - стоимость и кнопки из отправленных сообщений
+        self.counters.reset()
+        self.app.flood_control.buckets.clear()
+        self.app.shared.events.buffer.clear()
+        self.session.sent_buttons = []
+        self.session.sent_methods = []
+        await self.app.dp.feed_update(self.app.bot, update)
+        cost = self.counters.as_budget()
+        if not self.costs[name] or cost > max(self.costs[name]):
+            self.worst_calls[name] = self.counters.calls
+        self.costs[name].append(cost)
+        self.files[name] = max(self.files[name], self.counters.files)
+        for event in self.app.shared.events.buffer:
+            if event[1] == analytics.ENDING_REACHED:
+                self.endings.add(event[4])
+        self.buttons = self.session.sent_buttons
+
+    # ---------------- обход ----------------
+    async def actions(self):
+        # Кнопки нажимаются в любом состоянии FSM, а текст вводится, только если состояние его ждет
+        state = await self.app.storage.get_state(self.key)
+        actions = [(data, self.callback_update, data) for data in self.buttons
+                   if data in handlers.TIME_LOOP_CALLBACKS or data in TERMINAL_CALLBACKS]
+        actions += [(state, self.message_update, text) for text in TEXT_INPUTS.get(state, ())]
+        return actions
+
+    async def signature(self):
+        db_state = self.database.state
+        # asked_at (время, когда задана загадка) меняется на каждом шаге и в состояние не входит
+        fsm_data = {key: value for key, value in (await self.app.storage.get_data(self.key)).items() if key != 'asked_at'}
+        return (repr(sorted(db_state['sessions'].items())), await self.app.storage.get_state(self.key),
+                repr(sorted(fsm_data.items())), tuple(self.buttons))
+
+    async def run(self):
+        root = logging.getLogger()
+        root.addHandler(self.errors)
+        try:
+            initial = await self.snapshot()
+            seen = set()
+            await self._visit("buy:2", self.callback_update, "buy:2", seen)
+            await self.restore(initial)
+            await self.run_payment()
+            await self.run_inline()
+        finally:
+            root.removeHandler(self.errors)
+
+    # Покупка PAID_QUEST: счет, подтверждение, два одинаковых successful_payment (квест выдается один раз),
+    # затем повторный выбор квеста без счета и отказ в повторной оплате
+    async def run_payment(self):
+        quest_id, price = PAID_QUEST['id'], PAID_QUEST['price']
+
+        def sent(api_method):
+            return [method for method in self.session.sent_methods if method.__api_method__ == api_method]
+
+        def check(ok: bool, error: str):
+            if not ok:
+                self.payment_errors.append(error)
+
+        await self.step(f"buy:{quest_id}", self.callback_update(f"buy:{quest_id}"))
+        invoices = sent("sendInvoice")
+        check(len(invoices) == 1 and invoices[0].prices[0].amount == price, "не отправлен счет на оплату")
+        await self.step("pre_checkout_query", self.pre_checkout_update(quest_id, price))
+        answers = sent("answerPreCheckoutQuery")
+        check(len(answers) == 1 and answers[0].ok, "оплата не подтверждена")
+        for _ in range(2):
+            await self.step("successful_payment", self.payment_update(quest_id, price))
+        check(self.database.state['entitlements'].get((USER_ID, quest_id)) == 'payment'
+              and len(self.database.state['payments']) == 1, "квест выдан не один раз")
+        # вторая оплата (другой charge_id) уже купленного квеста возвращается
+        await self.step("successful_payment", self.payment_update(quest_id, price, CHARGE_ID + "-2"))
+        check(len(sent("refundStarPayment")) == 1
+              and self.database.state['refunds'] == {CHARGE_ID + "-2": 'refunded'}, "повторная оплата не возвращена")
+        await self.step(f"buy:{quest_id}", self.callback_update(f"buy:{quest_id}"))
+        check(not sent("sendInvoice"), "повторный счет за купленный квест")
+        await self.step("pre_checkout_query", self.pre_checkout_update(quest_id, price))
+        answers = sent("answerPreCheckoutQuery")
+        check(len(answers) == 1 and not answers[0].ok, "повторная оплата купленного квеста")
+
+    async def _visit(self, name, make_update, payload, seen):
+        await self.step(name, make_update(payload))
+        if name in TERMINAL_CALLBACKS:
+            self.paths += 1
+            return
+        signature = await self.signature()
+        if signature in seen or len(seen) >= self.max_states:
+            self.paths += 1
+            return
+        seen.add(signature)
+
+        actions = await self.actions()
+        if not actions:
+            self.paths += 1
+            return
+        snapshot = await self.snapshot()
+        buttons = self.buttons
+        for action_name, action_update, action_payload in actions:
+            await self.restore(snapshot)
+            self.buttons = buttons
+            await self._visit(action_name, action_update, action_payload, seen)
+
+    # Inline-поиск: по началу слова в другой форме находится нужный квест, в базу запросов нет
+    async def run_inline(self):
+        for query, expected in (("петли", [str(QUEST['id'])]), ("Платн", [str(PAID_QUEST['id'])]),
+                                ("", [str(QUEST['id']), str(PAID_QUEST['id'])]), ("подводная лодка", [])):
+            await self.step("inline_query", self.inline_update(query))
+            answers = [method for method in self.session.sent_methods if method.__api_method__ == "answerInlineQuery"]
+            found = [result.id for result in answers[0].results] if answers else None
+            if found != expected or self.counters.db:
+                self.inline_errors.append(f"«{query}»: {found}, запросов в базу: {self.counters.db}")
+
+    # ---------------- отчет ----------------
+    def report(self) -> bool:
+        ok = True
+        print(f"{'переход':<24}{'раз':>6}{'db':>6}{'api':>6}{'байт':>8}{'фото':>10}   бюджет")
+        for name in sorted(self.costs):
+            worst = Budget(*(max(values) for values in zip(*self.costs[name])))
+            budget = BUDGETS.get(name, DEFAULT_BUDGET)
+            over = [field for field in Budget._fields if getattr(worst, field) > getattr(budget, field)]
+            mark = "  ПРЕВЫШЕН: " + ", ".join(over) if over else ""
+            print(f"{name:<24}{len(self.costs[name]):>6}{worst.db:>6}{worst.api:>6}{worst.bytes:>8}"
+                  f"{self.files[name]:>10}   {budget.db}/{budget.api}/{budget.bytes}{mark}")
+            if over:
+                print("    " + " -> ".join(self.worst_calls[name]))
+            ok = ok and not over
+        for error in self.payment_errors:
+            print("покупка:", error)
+            ok = False
+        for error in self.inline_errors:
+            print("inline-поиск:", error)
+            ok = False
+        if self.errors.count:
+            print(f"ошибок в логе: {self.errors.count}")
+            for message in self.errors.messages:
+                print("   ", message)
+            ok = False
+        missing = ENDINGS - self.endings
+        print(f"\nпутей: {self.paths}, переходов: {sum(map(len, self.costs.values()))}, "
+              f"концовки: {', '.join(sorted(self.endings))}")
+        if missing:
+            print("недостижимые концовки:", ", ".join(sorted(missing)))
+            ok = False
+        return ok
+
+
+# Заменитель сервера Bot API на localhost: запросы идут через настоящий aiohttp (пул соединений, таймауты),
+# фото из файла при local_files отправляется путем file://, время ответа считается по методам
+async def check_api_session() -> bool:
+    from aiohttp import web
+
+    received = []
+
+    async def handle(request):
+        method = request.match_info['method']
+        received.append((method, dict(await request.post())))
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "stand-in", "username": "standin_bot"}
+        else:
+            result = {"message_id": len(received), "date": 0, "chat": {"id": USER_ID, "type": "private"}}
+        return web.json_response({"ok": True, "result": result})
+
+    server = web.Application()
+    server.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    session = api_session.TunedSession(api_url=f"http://127.0.0.1:{port}", local_files=True, limit=4,
+                                       limit_per_host=2, method_timeouts={"sendMessage": 5})
+    bot = Bot("123456:standin", session=session)
+    errors = []
+    try:
+        await bot.get_me()
+        await bot.send_message(USER_ID, "stand-in")
+        await bot.send_photo(USER_ID, FSInputFile(__file__))
+        methods = [method for method, _ in received]
+        if methods != ["getMe", "sendMessage", "sendPhoto"]:
+            errors.append(f"запросы: {methods}")
+        elif not received[2][1].get("photo", "").startswith("file://"):
+            errors.append("фото отправлено не локальным путем")
+        latency = session.latency()
+        if sorted(latency) != sorted(methods) or any(calls != 1 or failed for calls, failed, _, _ in latency.values()):
+            errors.append(f"счетчики: {latency}")
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        await session.close()
+        await runner.cleanup()
+    for error in errors:
+        print("сессия Bot API:", error)
+    return not errors
+
+
+async def explore() -> bool:
+    explorer = Explorer()
+    await explorer.run()
+    return explorer.report() and await check_api_session()
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(explore()) else 1)
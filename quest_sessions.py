@@ -0,0 +1,82 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Длина массива счетчиков в quest_sessions (одинаковая для всех квестов)
+COUNTERS_SIZE = 8
+
+
+class SessionSchema:
+    # Описание сессии квеста: имена артефактов (биты flags) и счетчиков (ячейки counters).
+    # persistent_counters не сбрасываются при clear (например, сколько раз квест пройден)
+    def __init__(self, quest_id: int, flags, counters, persistent_counters=()):
+        if len(flags) > 31:
+            raise ValueError("Слишком много артефактов для одной сессии")
+        if len(counters) > COUNTERS_SIZE:
+            raise ValueError("Слишком много счетчиков для одной сессии")
+        self.quest_id = quest_id
+        self.flags = {name: bit for bit, name in enumerate(flags)}
+        self.counters = {name: index for index, name in enumerate(counters)}
+        self.persistent_counters = [self.counters[name] for name in persistent_counters]
+
+
+class QuestSession:
+    # Типизированный доступ к строке quest_sessions.
+    # session['key'] / session['rate_count'] работает так же, как раньше со строкой из timeloop
+    __slots__ = ('schema', 'flags', 'counters')
+
+    def __init__(self, schema: SessionSchema, flags: int, counters):
+        self.schema = schema
+        self.flags = flags
+        self.counters = list(counters)
+
+    def flag(self, name: str) -> bool:
+        return bool(self.flags >> self.schema.flags[name] & 1)
+
+    def counter(self, name: str) -> int:
+        return self.counters[self.schema.counters[name]]
+
+    def __getitem__(self, name: str) -> int:
+        if name in self.schema.flags:
+            return int(self.flag(name))
+        return self.counter(name)
+
+
+class QuestSessionStore:
+    def __init__(self, database):
+        self.database = database
+
+    async def create_table(self):
+        await self.database.create_quest_sessions_table(COUNTERS_SIZE)
+
+    async def migrate_timeloop(self):
+        moved = await self.database.migrate_timeloop_to_quest_sessions(TIME_LOOP.quest_id, COUNTERS_SIZE)
+        if moved:
+            logger.warning("Перенесено %s сессий из timeloop в quest_sessions", moved)
+
+    async def init(self, tg_user_id: int, schema: SessionSchema):
+        await self.database.init_quest_session(tg_user_id, schema.quest_id)
+
+    async def get(self, tg_user_id: int, schema: SessionSchema, primary: bool = False):
+        row = await self.database.get_quest_session(tg_user_id, schema.quest_id, primary=primary)
+        if row is None:
+            return None
+        return QuestSession(schema, row['flags'], row['counters'])
+
+    async def set_flag(self, tg_user_id: int, schema: SessionSchema, name: str, value: bool = True):
+        await self.database.set_quest_session_flag(tg_user_id, schema.quest_id, schema.flags[name], value)
+
+    async def inc(self, tg_user_id: int, schema: SessionSchema, name: str):
+        await self.database.inc_quest_session_counter(tg_user_id, schema.quest_id, schema.counters[name])
+
+    async def clear(self, tg_user_id: int, schema: SessionSchema):
+        await self.database.clear_quest_session(tg_user_id, schema.quest_id, schema.persistent_counters)
+
+
+# Квест «Петля времени». Порядок артефактов и счетчиков совпадает со старой таблицей timeloop
+TIME_LOOP = SessionSchema(
+    quest_id=2,
+    flags=('dog', 'safe', 'key'),
+    counters=('safe_tip', 'first_question_tip', 'second_question_tip', 'third_question_tip', 'rate_count'),
+    persistent_counters=('rate_count',)
+)
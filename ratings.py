@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+LIKE = 1
+DISLIKE = -1
+MARKS = {"like": LIKE, "dislike": DISLIKE}
+
+
+class QuestRatings:
+    # Оценки квестов. Голос пользователя хранится в quest_ratings (одна строка на пользователя и квест),
+    # а счетчики likes/dislikes в quests обновляются не на каждый клик, а периодически - накопленными дельтами.
+    # Каталог читает счетчики из памяти (counts), поэтому горячая строка quests не блокируется.
+    def __init__(self, database, flush_interval=10.0):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.counts = {}  # quest_id -> [likes, dislikes]
+        self.pending = {}  # quest_id -> [likes_delta, dislikes_delta]
+        self._task = None
+
+    async def load(self):
+        rows = await self.database.get_quest_marks()
+        self.counts = {row['id']: [row['likes'], row['dislikes']] for row in rows}
+
+    # Текущие счетчики квеста. quest_data - строка из quests на случай, если квест еще не загружен
+    def get(self, quest_id: int, quest_data=None):
+        counts = self.counts.get(quest_id)
+        if counts is None:
+            if quest_data is None:
+                return 0, 0
+            counts = self.counts[quest_id] = [quest_data['likes'], quest_data['dislikes']]
+        return counts[0], counts[1]
+
+    # Голос пользователя: повторный такой же голос ничего не меняет, противоположный - переносит голос
+    async def vote(self, tg_user_id: int, quest_id: int, mark: str):
+        new_mark = MARKS[mark]
+        old_mark = await self.database.set_quest_rating(tg_user_id, quest_id, new_mark)
+        if old_mark == new_mark:
+            return
+        if old_mark is not None:
+            self._add(quest_id, old_mark, -1)
+        self._add(quest_id, new_mark, 1)
+
+    # Аккаунт удален: его голоса уже вычтены из quests в той же транзакции (delete_account),
+    # поэтому меняются только счетчики в памяти, без дельт для записи
+    def discard_votes(self, marks):
+        for quest_id, mark in marks:
+            counts = self.counts.get(quest_id)
+            if counts is not None:
+                counts[0 if mark == LIKE else 1] -= 1
+
+    def _add(self, quest_id: int, mark: int, delta: int):
+        index = 0 if mark == LIKE else 1
+        self.counts.setdefault(quest_id, [0, 0])[index] += delta
+        self.pending.setdefault(quest_id, [0, 0])[index] += delta
+
+    # ----------фоновая запись-------------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        deltas, self.pending = self.pending, {}
+        try:
+            rows = await self.database.apply_quest_mark_deltas(deltas)
+        except Exception as e:
+            # Возвращаем дельты обратно, чтобы записать их в следующий раз
+            for quest_id, (likes, dislikes) in deltas.items():
+                pending = self.pending.setdefault(quest_id, [0, 0])
+                pending[0] += likes
+                pending[1] += dislikes
+            logger.error("Ошибка при записи счетчиков оценок: %s", e)
+            return
+        # Значения из базы учитывают голоса с других инстансов бота; добавляем то, что накопилось за время записи
+        for row in rows:
+            pending = self.pending.get(row['id'], [0, 0])
+            self.counts[row['id']] = [row['likes'] + pending[0], row['dislikes'] + pending[1]]
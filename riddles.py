@@ -0,0 +1,70 @@
+import string
+
+# Таблица нормализации ответа строится один раз: убираем пунктуацию и пробелы, ё -> е
+_NORMALIZE_TABLE = str.maketrans({
+    **{char: None for char in string.punctuation + string.whitespace + "«»—–…"},
+    'ё': 'е',
+})
+
+
+def normalize(text: str) -> str:
+    return text.casefold().translate(_NORMALIZE_TABLE)
+
+
+# Расстояние Левенштейна с ограничением: если расстояние больше limit, возвращается limit + 1.
+# Считаются только клетки в полосе шириной 2 * limit + 1 вокруг диагонали,
+# а как только вся строка таблицы больше limit - выходим досрочно
+def bounded_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = limit + 1
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        row_min = current[0]
+        char_a = a[i - 1]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if char_a == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if value > too_far:
+                value = too_far
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return too_far
+        previous = current
+    return previous[len(b)]
+
+
+class RiddleMatcher:
+    # Правильные ответы загадки нормализуются один раз при создании.
+    # max_distance - сколько опечаток допускается; короткие ответы (min_length букв и меньше) проверяются точно:
+    # в коротком слове одна ошибка часто дает другое настоящее слово ("бремя" вместо "время")
+    def __init__(self, answers, max_distance: int = 1, min_length: int = 5):
+        self.answers = frozenset(normalize(answer) for answer in answers)
+        self.max_distance = max_distance
+        self.min_length = min_length
+
+    def match(self, text: str) -> bool:
+        if not text:
+            return False
+        answer = normalize(text)
+        if answer in self.answers:
+            return True
+        if len(answer) <= self.min_length:
+            return False
+        for correct in self.answers:
+            if len(correct) > self.min_length and bounded_distance(answer, correct, self.max_distance) <= self.max_distance:
+                return True
+        return False
+
+
+# Загадки квеста «Петля времени»
+TIME_LOOP_QUESTION_1 = RiddleMatcher(("время",))
+TIME_LOOP_QUESTION_2 = RiddleMatcher(("вчера", "вчерашний день"))
+TIME_LOOP_QUESTION_3 = RiddleMatcher(("сознание", "осознание"))
@@ -0,0 +1,54 @@
+import asyncio
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Профиль выполнения (config.runtime_profile):
+# default - стандартный цикл asyncio и json из стандартной библиотеки,
+# fast - цикл uvloop и orjson для разбора ответов Bot API (в том числе апдейтов из getUpdates) и сборки запросов.
+# uvloop и orjson необязательные: если пакета нет, используется стандартная замена
+DEFAULT = "default"
+FAST = "fast"
+
+
+def _optional(name: str):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# json_loads/json_dumps для сессии aiogram; пустой словарь - стандартный json
+def session_json(profile: str) -> dict:
+    if profile != FAST:
+        return {}
+    orjson = _optional("orjson")
+    if orjson is None:
+        logger.warning("orjson не установлен - используется стандартный json")
+        return {}
+    dumps = orjson.dumps
+
+    # aiogram ждет строку, orjson возвращает bytes
+    def json_dumps(value) -> str:
+        return dumps(value).decode()
+    return {"json_loads": orjson.loads, "json_dumps": json_dumps}
+
+
+# Что реально работает в профиле: (цикл, json)
+def describe(profile: str):
+    if profile != FAST:
+        return "asyncio", "json"
+    return ("uvloop" if _optional("uvloop") is not None else "asyncio",
+            "orjson" if _optional("orjson") is not None else "json")
+
+
+# asyncio.run с циклом профиля
+def run(coro, profile: str):
+    if profile == FAST:
+        uvloop = _optional("uvloop")
+        if uvloop is not None:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                return runner.run(coro)
+        logger.warning("uvloop не установлен - используется стандартный цикл asyncio")
+    return asyncio.run(coro)
@@ -0,0 +1,274 @@
+import logging
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, Message
+from aiohttp import FormData
+from pydantic import ConfigDict, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+
+class _FrozenButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenKeyboard(InlineKeyboardMarkup):
+    # Клавиатура из реестра: неизменяемая (строки - кортежи, кнопки frozen), поэтому словарь для json
+    # готовится один раз при создании, а сама клавиатура хешируется по содержимому и годится в ключ кеша
+    model_config = ConfigDict(frozen=True)
+
+    inline_keyboard: Tuple[Tuple[_FrozenButton, ...], ...]
+    _prepared: Optional[dict] = PrivateAttr(default=None)
+
+
+def keyboard(*rows) -> FrozenKeyboard:
+    # Каждая строка - список пар (текст кнопки, callback_data)
+    markup = FrozenKeyboard(inline_keyboard=tuple(
+        tuple(_FrozenButton(text=text, callback_data=data) for text, data in row)
+        for row in rows
+    ))
+    markup._prepared = markup.model_dump(warnings=False, exclude_none=True)
+    return markup
+
+
+def prepared_markup(markup) -> Optional[dict]:
+    if not isinstance(markup, FrozenKeyboard):
+        return None
+    return markup._prepared
+
+
+class Screen(NamedTuple):
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+
+
+class Template:
+    # Экран с подстановками ({username}, {rate_count}, ...). Клавиатура общая и не пересоздается
+    __slots__ = ('text', 'reply_markup')
+
+    def __init__(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        self.text = text
+        self.reply_markup = reply_markup
+
+    def render(self, **values) -> Screen:
+        return Screen(self.text.format_map(values), self.reply_markup)
+
+
+class ScreenSession(AiohttpSession):
+    # Сессия бота, которая не сериализует клавиатуры из реестра заново на каждую отправку.
+    # media (media.MediaRegistry) - фото из файлов отправляются по file_id, если бот уже загружал этот файл.
+    # Одну сессию могут использовать несколько ботов: кеши ключуются по клавиатуре и по id бота
+    def __init__(self, *args, media=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._markup_json = {}
+        self.media = media
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.media is None or not isinstance(method, SendPhoto) or not isinstance(method.photo, FSInputFile):
+            return await super().make_request(bot, method, timeout)
+        path = str(method.photo.path)
+        file_id = self.media.get(bot.id, path)
+        if file_id is not None:
+            try:
+                return await super().make_request(bot, method.model_copy(update={'photo': file_id}), timeout)
+            except TelegramBadRequest as e:
+                # "wrong file identifier" и т.п. - загружаем файл заново; остальные ошибки не про файл
+                if "file" not in e.message.lower():
+                    raise
+                self.media.forget(bot.id, path)
+        result = await super().make_request(bot, method, timeout)
+        if isinstance(result, Message) and result.photo:
+            self.media.remember(bot.id, path, result.photo[-1].file_id)
+        return result
+
+    def build_form_data(self, bot, method) -> FormData:
+        prepared = prepared_markup(getattr(method, 'reply_markup', None))
+        if prepared is None:
+            return super().build_form_data(bot, method)
+
+        markup_json = self._markup_json.get(method.reply_markup)
+        if markup_json is None:
+            markup_json = self._markup_json[method.reply_markup] = self.json_dumps(prepared)
+
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={'reply_markup'}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field('reply_markup', markup_json)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
+# Клавиатура карточки квеста в маркете ("Выбрать" -> buy:id) и в "Моих квестах" ("Играть" -> play:id)
+@lru_cache(maxsize=None)
+def quest_card_keyboard(button_text: str, action: str, quest_id: int) -> InlineKeyboardMarkup:
+    return keyboard([(button_text, f"{action}:{quest_id}")])
+
+
+# ---------------------меню и профиль------------------------
+MAIN_MENU_FOOTER_KB = keyboard([("Главное меню", "main_menu")])
+MARKET_LINK_KB = keyboard([("Маркет", "market")])
+PROFILE_KB = keyboard(
+    [("Рейтинг игроков", "leaderboard")],
+    [("Изменить никнейм", "change_username")],
+    [("Удалить аккаунт", "delete_account")],
+    [("Главное меню", "main_menu")]
+)
+
+START_REGISTRATION = Screen('Готовы зарегистрироваться?', keyboard([("Зарегистрироваться", "Registration")]))
+MAIN_MENU = Screen("Выберите дальнейшее действие", keyboard(
+    [('Мой профиль', 'my_profile')],
+    [('Маркет квестов', 'market')]
+    # ,[('Мои квесты', 'my_quests')]
+))
+PROFILE = Template(
+    "Здравствуйте, {username}!\nДобро пожаловать в Ваш профиль!\n\n"
+    "Пройдено квестов: {completions}\nЗвезды: {stars} ⭐\nМесто в рейтинге: {rank}",
+    PROFILE_KB
+)
+PROFILE_CHANGED = Template("Так выглядит измененный профиль:\n\n" + PROFILE.text, PROFILE_KB)
+LEADERBOARD = Template("Лучшие игроки:\n\n{rows}", keyboard([("Мой профиль", "my_profile")],
+                                                              [("Главное меню", "main_menu")]))
+LEADERBOARD_ROW = "{rank}. {username} - {stars} ⭐ (квестов: {completions})"
+LEADERBOARD_EMPTY = "Пока никто не прошел ни одного квеста"
+DELETE_ACCOUNT = Screen("Вы уверены, что хотите удалить аккаунт?\nВсе Ваши квесты не сохранятся", keyboard(
+    [("Нет", "main_menu")],
+    [("Да", "apply_delete_account")]
+))
+
+# ---------------------маркет и мои квесты-------------------
+QUEST_CARD = Template("Название: «{name}»  \nОписание: {description}\n{like}❤️   {dislike}🙁\n{price}")
+MY_QUEST_CARD = Template("Название: «{name}»\nОписание: {description}\n{like}❤️   {dislike}🙁\n{price}")
+TO_MAIN_MENU = Screen("В главное меню", MAIN_MENU_FOOTER_KB)
+MARKET_EMPTY = Screen("В настоящее время тут пусто. \n **Coming soon**",
+                      keyboard([("Вернуться в меню", "main_menu")]))
+MY_QUESTS_EMPTY = Screen("У вас нет купленных квестов.\n Хотите посмотреть каталог наших квестов?", MARKET_LINK_KB)
+QUEST_START_ERROR = "Ошибка запуска квеста"
+
+# ---------------------администрирование--------------------
+API_STATS_ROW = "{method}: {calls} выз., {errors} ош., среднее {avg:.0f} мс, макс. {max:.0f} мс"
+
+# ---------------------inline-поиск--------------------------
+# Карточка, которую пользователь отправляет в чат из inline-выдачи, и кнопка со ссылкой на квест в боте
+# (callback-кнопки из чужого чата не приходят в хендлеры квестов - у них нет сообщения бота)
+INLINE_QUEST_DESCRIPTION = Template("{price} · {like}❤️ {dislike}🙁 · {description}")
+INLINE_OPEN_BUTTON = "Открыть в боте"
+
+
+@lru_cache(maxsize=None)
+def quest_link_keyboard(bot_username: str, start: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text=INLINE_OPEN_BUTTON, url=f"https://t.me/{bot_username}?start={start}")]])
+
+# ---------------------оплата--------------------------------
+PAYMENT_SUCCESS = Template("Спасибо за покупку! Квест «{quest_name}» теперь в разделе «Мои квесты»")
+# ответы на pre_checkout_query (показываются пользователю в окне оплаты)
+PAYMENT_QUEST_UNAVAILABLE = "Этот квест больше нельзя купить"
+PAYMENT_PRICE_CHANGED = "Цена квеста изменилась, откройте маркет еще раз"
+PAYMENT_ALREADY_OWNED = "Этот квест уже есть в разделе «Мои квесты»"
+PAYMENT_FAILED = "Не удалось проверить покупку, попробуйте еще раз"
+# оплата квеста, который уже куплен (например, оплатили два счета подряд)
+PAYMENT_REFUNDED = "Этот квест уже был куплен, оплата возвращена"
+PAYMENT_REFUND_PENDING = "Этот квест уже был куплен, оплату вернем в ближайшее время"
+
+# ---------------------TimeLoop------------------------------
+TIME_LOOP_INTRO_KB = keyboard([("Играть", "startTimeLoop")], [("Другие квесты", "market")])
+LETTER_KB = keyboard([("Открыть письмо", "open_letter")], [("Искать другие улики", "other_clues_1")])
+OPEN_LETTER_KB = keyboard([("Искать другие улики", "other_clues_1")])
+CLUES_1_KB = keyboard(
+    [("Да", "read_notes")],
+    [("Нет", "other_clues_2")],
+    [("Вернуться к письму", "startTimeLoop")]
+)
+NOTES_KB = keyboard([("Искать другие улики", "other_clues_2")], [("Вернуться назад", "other_clues_1")])
+CLUES_2_KB = keyboard(
+    [("Изучить записи", "code")],
+    [("Не трогать дневник", "other_clues_3")],
+    [("Вернуться назад", "other_clues_1")]
+)
+CODE_KB = keyboard([("Искать другие улики", "other_clues_3")], [("Вернуться назад", "other_clues_2")])
+CLUES_3_KB = keyboard(
+    [("Попытаться открыть ящик", "open_box")],
+    [("Не трогать ящик", "other_clues_4")],
+    [("Вернуться назад", "other_clues_2")]
+)
+CLUES_3_OPENED_KB = keyboard([("Искать дальше", "other_clues_4")], [("Вернуться назад", "other_clues_2")])
+BACK_TO_BOX_KB = keyboard([("Вернуться назад", "other_clues_3")])
+WRONG_CODE_TIP_KB = keyboard([("Вернуться назад", "other_clues_3")], [("Подсказка", "safe_tip")])
+SAFE_TIP_KB = keyboard([("Вернуться к коду (подсказка исчезнет)", "open_box")])
+ACCESS_CODE_KB = keyboard([("Искать другие улики", "other_clues_4")], [("Вернуться назад", "other_clues_3")])
+CLUES_4_KB = keyboard([("Войти в тайный ход", "laboratory")], [("Назад", "other_clues_3")])
+LABORATORY_KB = keyboard(
+    [('Попытаться открыть дверь', "open_door")],
+    [('Изучить записную книжку', "devices")],
+    [('Посмотреть чертеж', "drafts")],
+    [('Искать другие улики', "other_clues_5")]
+)
+OPEN_DOOR_KB = keyboard([('Взять щенка себе', "take_puppy")], [('Не рисковать', "not_risk")])
+BACK_TO_LABORATORY_KB = keyboard([('Вернуться назад', "not_risk")])
+NOT_RISK_KB = keyboard(
+    [('Изучить записную книжку', "devices")],
+    [('Посмотреть чертеж', "drafts")],
+    [('Искать другие улики', "other_clues_5")]
+)
+CLUES_5_KB = keyboard(
+    [("Изучить информацию о Хранителе Времени", "searchTS")],
+    [("Искать Хранителя Времени самостоятельно", "myselfTS")]
+)
+MYSELF_TS_KB = keyboard(
+    [("Использовать информацию из дневника", "use_diary")],
+    [("Искать прибор самостоятельно в другом месте", "myselfD")]
+)
+MYSELF_D_KB = keyboard(
+    [("Использовать этот прибор", "use_device")],
+    [("Не рисковать, не использовать прибор", "not_risk_D")]
+)
+NOT_RISK_D_KB = keyboard([("Использовать информацию из дневника", "use_diary")])
+KEEPER_MET_KB = keyboard(
+    [("Заговорить с Хранителем времени", "talkTS")],
+    [("Попытаться вернуть дядю самостоятельно", "myselfUncle")]
+)
+SEARCH_TS_KB = keyboard([("Найти прибор", "use_diary")])
+TALK_TS_KB = keyboard(
+    [("Согласиться ответить на вопросы", "question1")],
+    [("Проигнорировать и самостоятельно спасти Дядю", "myselfUncle")]
+)
+ANOMALY_CHOICE_KB = keyboard([("Воспользоваться аномалией", "anomaly")], [("Отказаться", "rejection")])
+
+# ---------------------финал квеста--------------------------
+UNSUCCESS_FINAL = Template(
+    "{name}, к сожалению, Вам не удалось пройти квест «{quest_name}» на счастливую концовку\n"
+    "Вы всегда можете попробовать еще раз!\n",
+    keyboard(
+        [("Пройти заново", "again_time_loop")],
+        [("Маркет", "market")],
+        [("Главное меню", "main_menu")]
+    )
+)
+SUCCESS_FINAL_FIRST = Template(
+    "Поздравляю, {name}, Вы прошли квест «{quest_name}»\nОцените пожалуйста квест",
+    keyboard([("   ❤️   ", "final_like:2")], [("   🙁   ", "final_dislike:2")])
+)
+SUCCESS_FINAL_SECOND = Template("Поздравляю, {name}, Вы прошли квест «{quest_name}» во {rate_count} раз!",
+                                MAIN_MENU_FOOTER_KB)
+SUCCESS_FINAL_AGAIN = Template("Поздравляю, {name}, Вы прошли квест «{quest_name}» в {rate_count} раз!",
+                               MAIN_MENU_FOOTER_KB)
+# Сертификат за прохождение текстом - если картинку нарисовать не удалось
+CERTIFICATE_TEXT = Template("🏅 Сертификат\n\n{name}\nпрошел(а) квест «{quest_name}»\nПройден раз: {completions}")
+QUEST_REMINDER = Screen("Вы так и не закончили квест «Петля времени». Хранитель времени все еще ждет Вас!",
+                        keyboard([("Начать заново", "again_time_loop")], [("Главное меню", "main_menu")]))
+TIME_IS_UP = Screen("Время вышло! Хранитель не дождался ответа.", None)
+RATED_KB = keyboard([("Маркет", "market")], [("Главное меню", "main_menu")])
+RATED_LIKE = Screen("Спасибо за Вашу оценку.\nЕсли у Вас есть какие-то предложения или Вы нашли недочеты, "
+                    "напишите пожалуйста на профиль в описании бота.", RATED_KB)
+RATED_DISLIKE = Screen("Спасибо за Вашу оценку!\n Нам жаль, что Вам не понравилось..\n"
+                       "Если у Вас есть какие-то предложения или Вы нашли недочеты, "
+                       "напишите пожалуйста на профиль в описании бота.", RATED_KB)
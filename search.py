@@ -0,0 +1,113 @@
+import re
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+# Поиск квестов для inline-режима (@bot запрос): инвертированный индекс по названиям и описаниям в памяти
+
+_WORD = re.compile(r"\w+")
+
+# Окончания для грубого стемминга: "петля", "петли", "петлю" -> "петл". Сначала длинные
+_ENDINGS = sorted((
+    "ыми", "ими", "ого", "его", "ому", "ему", "ами", "ями", "иях", "ией",
+    "ая", "яя", "ое", "ее", "ие", "ые", "ой", "ей", "ий", "ый", "ую", "юю", "ам", "ям", "ах", "ях",
+    "ом", "ем", "ов", "ев", "ия", "ью", "их", "ых",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+MIN_STEM = 3
+
+# Вес совпадения: слово из названия важнее слова из описания
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+# Текст -> основы слов: нижний регистр, ё -> е, без знаков препинания
+def terms(text: str) -> List[str]:
+    return [stem(word) for word in _WORD.findall(text.lower().replace("ё", "е"))]
+
+
+class QuestIndex:
+    # Основа слова -> {id квеста: вес}, плюс отсортированный список всех основ, чтобы префикс запроса
+    # ("пет" -> "петл", "петр") находил диапазон основ бинарным поиском. Слово запроса совпадает,
+    # если оно - префикс основы из квеста; квест попадает в выдачу, если совпали все слова запроса.
+    # update получает каталог целиком (catalog.QuestCatalog вызывает его после каждой загрузки),
+    # а переиндексирует только добавленные, удаленные и измененные квесты. В базу индекс не ходит
+    def __init__(self):
+        self.postings = {}  # основа -> {quest_id: вес}
+        self.sorted_terms = []
+        self.docs = {}  # quest_id -> (название, описание)
+        self.quests = {}  # quest_id -> строка quests (для карточек в выдаче)
+        self.reindexed = 0
+
+    def update(self, quests: Dict[int, object]):
+        for quest_id in [quest_id for quest_id in self.docs if quest_id not in quests]:
+            self._remove(quest_id)
+        for quest_id, quest_data in quests.items():
+            doc = (quest_data['name'] or "", quest_data['description'] or "")
+            if self.docs.get(quest_id) != doc:
+                self._remove(quest_id)
+                self._add(quest_id, doc)
+        self.quests = dict(quests)
+
+    def _add(self, quest_id: int, doc: Tuple[str, str]):
+        weights = {}
+        for term in terms(doc[1]):
+            weights[term] = DESCRIPTION_WEIGHT
+        for term in terms(doc[0]):
+            weights[term] = NAME_WEIGHT
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.sorted_terms, term)
+            posting[quest_id] = weight
+        self.docs[quest_id] = doc
+        self.reindexed += 1
+
+    def _remove(self, quest_id: int):
+        doc = self.docs.pop(quest_id, None)
+        if doc is None:
+            return
+        for term in set(terms(doc[0]) + terms(doc[1])):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(quest_id, None)
+            if not posting:
+                del self.postings[term]
+                del self.sorted_terms[bisect_left(self.sorted_terms, term)]
+
+    def _match_prefix(self, prefix: str) -> Dict[int, int]:
+        # Лучший вес каждого квеста среди основ, начинающихся с prefix
+        matches = {}
+        index = bisect_left(self.sorted_terms, prefix)
+        while index < len(self.sorted_terms) and self.sorted_terms[index].startswith(prefix):
+            for quest_id, weight in self.postings[self.sorted_terms[index]].items():
+                if weight > matches.get(quest_id, 0):
+                    matches[quest_id] = weight
+            index += 1
+        return matches
+
+    # Квесты по запросу, лучшие первыми: [строка quests, ...]. Пустой запрос - все квесты по порядку id
+    def search(self, query: str) -> List:
+        query_terms = terms(query)
+        if not query_terms:
+            return [self.quests[quest_id] for quest_id in sorted(self.quests)]
+        scores = None
+        for term in dict.fromkeys(query_terms):
+            matches = self._match_prefix(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {quest_id: score + matches[quest_id] for quest_id, score in scores.items()
+                          if quest_id in matches}
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda quest_id: (-scores[quest_id], quest_id))
+        return [self.quests[quest_id] for quest_id in ranked if quest_id in self.quests]
@@ -0,0 +1,103 @@
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+import payments
+
+logger = logging.getLogger(__name__)
+
+# Лимиты по типу апдейта: (токенов в секунду, размер корзины)
+DEFAULT_LIMITS = {
+    "message": (1.0, 5),
+    "callback_query": (2.0, 8),
+    # inline-запросы приходят по мере набора текста
+    "inline_query": (3.0, 10),
+}
+DEFAULT_LIMIT = (1.0, 5)
+
+THROTTLED_TEXT = "Слишком быстро, подождите пару секунд"
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'strikes', 'blocked_until')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.strikes = 0
+        self.blocked_until = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Защита от флуда: token bucket на пользователя и тип апдейта (outer middleware на dp.update).
+    # Апдейт без токена отбрасывается до хендлеров и запросов в базу. За каждое повторное
+    # превышение пользователь получает паузу, которая удваивается (cooldown .. max_cooldown секунд).
+    # На отброшенные callback и inline-запросы отвечаем сразу (иначе у клиента крутится загрузка до таймаута),
+    # на сообщения - нет, чтобы флуд не превращался в такой же поток ответов
+    # Корзины лежат в OrderedDict по времени последнего обращения; неактивные дольше idle_ttl удаляются
+    def __init__(self, limits=None, cooldown=5.0, max_cooldown=300.0, idle_ttl=600.0):
+        self.limits = limits or DEFAULT_LIMITS
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.idle_ttl = idle_ttl
+        self.buckets = OrderedDict()  # (user_id, тип апдейта) -> _Bucket
+        self.dropped = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        # Апдейты таймеров (timers.TimerService) присылает сам бот, а не пользователь; платежи не отбрасываем
+        if user is None or data.get("timer") is not None or payments.is_payment_update(event) or self.allow(user.id, event.event_type, time.monotonic()):
+            return await handler(event, data)
+        self.dropped += 1
+        await self._reject(event)
+        return None
+
+    async def _reject(self, update):
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(THROTTLED_TEXT)
+            elif update.inline_query is not None:
+                # пустой ответ без кеша: следующий запрос после паузы получит настоящие результаты
+                await update.inline_query.answer([], cache_time=0, is_personal=True)
+        except Exception as e:
+            logger.error("Ошибка при ответе на отброшенный апдейт: %s", e)
+
+    def allow(self, user_id: int, event_type: str, now: float) -> bool:
+        rate, burst = self.limits.get(event_type, DEFAULT_LIMIT)
+        key = (user_id, event_type)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _Bucket(burst, now)
+        else:
+            self.buckets.move_to_end(key)
+            # Долго вел себя спокойно - прощаем прошлые нарушения
+            if now - bucket.updated > self.max_cooldown:
+                bucket.strikes = 0
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+        self._evict(now)
+
+        if now < bucket.blocked_until:
+            return False
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+
+        bucket.strikes += 1
+        bucket.blocked_until = now + min(self.cooldown * 2 ** (bucket.strikes - 1), self.max_cooldown)
+        if bucket.strikes > 2:
+            logger.warning("Флуд от пользователя %s (%s), пауза до %.0f с",
+                           user_id, event_type, bucket.blocked_until - now)
+        return False
+
+    def _evict(self, now: float):
+        # Самые старые корзины в начале; проверяем по несколько штук за вызов
+        for _ in range(2):
+            if not self.buckets:
+                return
+            key, bucket = next(iter(self.buckets.items()))
+            if now - bucket.updated < self.idle_ttl or now < bucket.blocked_until:
+                return
+            del self.buckets[key]
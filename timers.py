@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime
+from typing import NamedTuple
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+logger = logging.getLogger(__name__)
+
+# callback_data апдейта, которым срабатывает таймер: "timer:<kind>"
+TIMER_PREFIX = "timer:"
+
+
+class Timer(NamedTuple):
+    key: str
+    kind: str
+    tg_user_id: int
+    chat_id: int
+    due_at: float  # unix time
+
+
+class TimingWheel:
+    # Иерархическое колесо таймеров: levels уровней по slots ячеек, ячейка уровня L покрывает slots**L тиков.
+    # Добавление и отмена - O(1) (ячейка - dict по ключу таймера), на каждом тике разбирается одна ячейка
+    # нижнего уровня, а при обороте нижнего колеса таймеры из ячейки верхнего уровня спускаются ниже.
+    # 4 уровня по 64 ячейки при тике в 1 секунду покрывают ~194 дня
+    def __init__(self, slots: int = 64, levels: int = 4, now: int = 0):
+        self.slots = slots
+        self.levels = levels
+        self.now = now
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.where = {}  # ключ -> (уровень, ячейка)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def add(self, key, due: int, value):
+        self.cancel(key)
+        self._place(key, max(due, self.now + 1), value)
+
+    def _place(self, key, due: int, value):
+        # Самый нижний уровень, на котором due попадает в текущий оборот колеса
+        level = 0
+        while level < self.levels - 1 and due // self.slots ** (level + 1) != self.now // self.slots ** (level + 1):
+            level += 1
+        slot = due // self.slots ** level % self.slots
+        self.wheels[level][slot][key] = (due, value)
+        self.where[key] = (level, slot)
+
+    def cancel(self, key) -> bool:
+        place = self.where.pop(key, None)
+        if place is None:
+            return False
+        level, slot = place
+        del self.wheels[level][slot][key]
+        return True
+
+    # Сдвинуть колесо на один тик; возвращает значения сработавших таймеров
+    def advance(self):
+        self.now += 1
+        for level in range(self.levels - 1, 0, -1):
+            if self.now % self.slots ** level == 0:
+                self._cascade(level, self.now // self.slots ** level % self.slots)
+        bucket = self.wheels[0][self.now % self.slots]
+        if not bucket:
+            return []
+        self.wheels[0][self.now % self.slots] = {}
+        expired = []
+        for key, (due, value) in bucket.items():
+            del self.where[key]
+            if due <= self.now:
+                expired.append(value)
+            else:
+                self._place(key, due, value)
+        return expired
+
+    def _cascade(self, level: int, slot: int):
+        bucket, self.wheels[level][slot] = self.wheels[level][slot], {}
+        for key, (due, value) in bucket.items():
+            # Таймер на текущий тик попадает в ячейку, которая разбирается сразу после спуска
+            self._place(key, due, value)
+
+
+class TimerService:
+    # Таймеры квестов (время на загадку, напоминание о брошенном квесте, очистка сессии).
+    # Таймер срабатывает апдейтом callback_query с data "timer:<kind>" от имени игрока, который проходит
+    # через dp.feed_update - те же middleware, FSM и хендлеры, что и у нажатия кнопки.
+    # В хендлер передается timer=Timer, по нему хендлер отличает таймер от нажатия с такими же данными.
+    # Таймеры записываются в таблицу timers пачками раз в flush_interval секунд и загружаются при старте.
+    # namespace - префикс ключей в таблице: у каждого бота процесса свои таймеры в общей базе
+    def __init__(self, bot, dispatcher, database, tick: float = 1.0, flush_interval: float = 5.0,
+                 namespace: str = ''):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.database = database
+        self.namespace = namespace
+        self.tick = tick
+        self.flush_interval = flush_interval
+        self.origin = time.time()
+        self.wheel = TimingWheel()
+        self.timers = {}  # ключ -> Timer
+        self.dirty = {}  # ключ -> Timer (записать) или None (удалить)
+        self.fired = 0
+        self._task = None
+        self._handlers = set()
+
+    def _tick_of(self, due_at: float) -> int:
+        return math.ceil((due_at - self.origin) / self.tick)
+
+    def schedule(self, key: str, kind: str, tg_user_id: int, chat_id: int, delay: float):
+        key = self.namespace + key
+        timer = Timer(key, kind, tg_user_id, chat_id, time.time() + delay)
+        self._add(timer)
+        self.dirty[key] = timer
+
+    def cancel(self, key: str):
+        key = self.namespace + key
+        if self.wheel.cancel(key):
+            del self.timers[key]
+            self.dirty[key] = None
+
+    def _add(self, timer: Timer):
+        self.timers[timer.key] = timer
+        self.wheel.add(timer.key, self._tick_of(timer.due_at), timer)
+
+    # ----------фоновая работа-------------
+    async def start(self):
+        if self.namespace:
+            # Таймеры, сохраненные без namespace (до его появления), забирает первый запущенный бот
+            claimed = await self.database.claim_legacy_timers(self.namespace)
+            if claimed:
+                logger.warning("Таймеров без namespace перенесено в %s: %s", self.namespace, claimed)
+        for row in await self.database.get_timers(self.namespace):
+            self._add(Timer(row['key'], row['kind'], row['tg_user_id'], row['chat_id'], row['due_at']))
+        if self.timers:
+            logger.warning("Загружено таймеров: %s", len(self.timers))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.tick)
+            # Если цикл отстал (долгий хендлер, пауза процесса), догоняем все пропущенные тики
+            target = int((time.time() - self.origin) / self.tick)
+            while self.wheel.now < target:
+                for timer in self.wheel.advance():
+                    self._fire(timer)
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + self.flush_interval
+                await self.flush()
+
+    def _fire(self, timer: Timer):
+        del self.timers[timer.key]
+        self.dirty[timer.key] = None
+        self.fired += 1
+        task = asyncio.create_task(self._dispatch(timer))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+    async def _dispatch(self, timer: Timer):
+        user = User(id=timer.tg_user_id, is_bot=False, first_name="")
+        update = Update(
+            update_id=0,
+            callback_query=CallbackQuery(
+                id=TIMER_PREFIX + timer.key,
+                from_user=user,
+                chat_instance=TIMER_PREFIX + timer.key,
+                data=TIMER_PREFIX + timer.kind,
+                message=Message(message_id=0, date=datetime.now(), chat=Chat(id=timer.chat_id, type="private")),
+            ),
+        )
+        try:
+            await self.dispatcher.feed_update(self.bot, update, timer=timer)
+        except Exception as e:
+            logger.error("Ошибка при обработке таймера %s: %s", timer.key, e)
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, {}
+        upserts = [timer for timer in dirty.values() if timer is not None]
+        deletes = [key for key, timer in dirty.items() if timer is None]
+        try:
+            await self.database.save_timers(upserts, deletes)
+        except Exception as e:
+            # Изменения, сделанные за время записи, новее - их не затираем
+            for key, timer in dirty.items():
+                self.dirty.setdefault(key, timer)
+            logger.error("Ошибка при записи таймеров: %s", e)